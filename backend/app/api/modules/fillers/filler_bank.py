@@ -0,0 +1,116 @@
+# VLM の最初のトークンが遅いときに流す短い相槌（フィラー）。
+# フレーズは TTS モデルごとに一度だけ合成してメモリに保持し、
+# ターンの文脈（質問か・画像についてか等）に合わせて選ぶ。
+import itertools
+import re
+import threading
+from dataclasses import dataclass
+
+from api.modules.tts_wrappers.base_tts import BaseTTS
+from api.utils.model_registry import registry
+
+# model_set_catalog.filler_id / filler_catalog に対応する ID
+FILLER_SET_ID = "ack_ja_v1"
+
+FILLER_PHRASES: dict[str, tuple[str, ...]] = {
+    # 相槌（既定）
+    "ack": ("うん、", "なるほど。", "そうだね。"),
+    # 質問への前置き
+    "think": ("えーっと、", "うーん、そうだなあ。", "ちょっと考えるね。"),
+    # 画像・カメラに関する発話
+    "look": ("どれどれ、", "ちょっと見てみるね。"),
+}
+
+_QUESTION = re.compile(
+    r"[?？]|(何|なに|なん|どう|どこ|どれ|いつ|誰|だれ|なぜ|なんで|教えて)"
+    r"|(か|の|かな)[。.]?$"
+)
+_LOOK = re.compile(
+    r"(見て|見える|写って|映って|これ|それ|この|その|あれ|画像|写真)"
+)
+
+
+@dataclass(frozen=True)
+class Filler:
+    key: str
+    text: str
+    audio: bytes
+
+
+class FillerBank:
+    """TTS モデル 1 つ分の合成済みフィラー"""
+
+    def __init__(self, tts: BaseTTS, phrases=FILLER_PHRASES):
+        self.tts = tts
+        self.phrases = phrases
+        self._audio: dict[str, dict[str, bytes]] = {}
+        self._cursor = {key: itertools.count() for key in phrases}
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._audio)
+
+    def prepare(self):
+        """全フレーズを合成する（同期・重い処理なので起動時やスレッドで呼ぶ）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for key, texts in self.phrases.items():
+            done: dict[str, bytes] = {}
+            for text in texts:
+                try:
+                    done[text] = self.tts.synthesize_to_bytes(text)
+                except Exception as e:
+                    print(f"⚠️ フィラー合成に失敗: {text} ({e})")
+            # pick() と並行するのでカテゴリ単位でまとめて公開する
+            if done:
+                self._audio[key] = done
+        if not self._audio:
+            # 1 件も合成できなければ次の get_filler_bank で再試行する
+            with self._lock:
+                self._started = False
+            print(f"⚠️ フィラーを準備できませんでした: {self.tts.model_name}")
+            return
+        print(
+            f"🗣️ フィラー準備完了: {self.tts.model_name} "
+            f"({sum(len(v) for v in self._audio.values())} 件)"
+        )
+
+    def prepare_in_background(self):
+        if not self._started:
+            threading.Thread(target=self.prepare, daemon=True).start()
+
+    def pick(self, user_text: str, has_image: bool = False) -> Filler | None:
+        """発話内容からカテゴリを選び、同じフレーズが続かないよう順に返す"""
+        for key in self._categories(user_text, has_image):
+            texts = list(self._audio.get(key, {}))
+            if not texts:
+                continue
+            text = texts[next(self._cursor[key]) % len(texts)]
+            return Filler(key, text, self._audio[key][text])
+        return None
+
+    @staticmethod
+    def _categories(user_text: str, has_image: bool) -> list[str]:
+        text = user_text.strip()
+        order = []
+        if has_image and _LOOK.search(text):
+            order.append("look")
+        if _QUESTION.search(text):
+            order.append("think")
+        order.append("ack")
+        return order
+
+
+def get_filler_bank(tts: BaseTTS, background: bool = True) -> FillerBank:
+    """TTS モデルごとに共有のフィラーを返す（未合成ならバックグラウンドで合成）"""
+    bank = registry.get_or_load(
+        ("filler", FILLER_SET_ID, tts.model_name, tts.voice_id),
+        lambda: FillerBank(tts),
+    ).model
+    if background:
+        bank.prepare_in_background()
+    return bank
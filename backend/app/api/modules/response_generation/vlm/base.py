@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import AsyncIterator, Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from api.utils.image_store import StoredImage
 
 from .tokenizer import get_tokenizer
 from .types import GenerationResult
@@ -15,12 +17,27 @@ class BaseVLM(ABC):
         tokenizer = get_tokenizer(self.model_name)
         return len(tokenizer(text))
 
+    async def count_message_tokens(self, messages: List[Dict]) -> int:
+        """メッセージ列のテキスト部分のトークン数（画像は数えない）"""
+        texts = []
+        for m in messages:
+            content = m.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                texts.extend(
+                    part.get("text", "")
+                    for part in content
+                    if part.get("type") == "text"
+                )
+        return await self.count_tokens("\n".join(texts))
+
     @abstractmethod
     async def generate(
         self,
         message: str,
         history: List[Dict[str, str]],
-        image_base64: Optional[str] = None,
+        image: Optional[Union[StoredImage, str]] = None,
     ) -> GenerationResult:
         """全文（完了形）を返す。"""
         ...
@@ -30,7 +47,11 @@ class BaseVLM(ABC):
         self,
         message: str,
         history: List[Dict[str, str]],
-        image_base64: Optional[str] = None,
-    ) -> AsyncIterator[str]:
-        """トークンまたは文チャンクを ``async for`` で逐次返す。"""
+        image: Optional[Union[StoredImage, str]] = None,
+    ) -> AsyncIterator[Union[str, GenerationResult]]:
+        """
+        トークンまたは文チャンクを ``async for`` で逐次返す。
+        最後まで生成した場合は、使用量と速度を入れた GenerationResult を
+        最後に 1 つ返す（content は全文）。
+        """
         ...
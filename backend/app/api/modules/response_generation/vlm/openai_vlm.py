@@ -1,11 +1,12 @@
-import asyncio
-import base64
 import os
+import time
 from typing import AsyncIterator, Optional
 
 import tiktoken
+from api.utils.image_preprocess import PreparedImage, prepare_image
+from api.utils.image_store import StoredImage
 from dotenv import load_dotenv
-from openai import AsyncOpenAI, OpenAI, Stream
+from services.openai_client import get_async_openai, with_retries
 
 from .base import BaseVLM
 from .tokenizer import register_tokenizer
@@ -13,21 +14,26 @@ from .types import GenerationResult
 
 load_dotenv()
 
-# OpenAIのAPIキー
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-openai_client2 = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# 1 回の呼び出しの上限秒数（ストリームでは次のチャンクまでの待ち時間）
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "30"))
 
 
 # ---- tokenizer 登録 -------------------------------------------------
 _enc = tiktoken.encoding_for_model("gpt-4o")
+# /ws/audio の会話（get_chat_response）が使う gpt-3.5-turbo 用
+_enc_35 = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 
 def _tok_openai(text: str):
     return _enc.encode(text)
 
 
+def _tok_openai_35(text: str):
+    return _enc_35.encode(text)
+
+
 register_tokenizer("gpt-4o", _tok_openai)
+register_tokenizer("gpt-3.5-turbo", _tok_openai_35)
 
 
 class OpenAIVLM(BaseVLM):
@@ -42,7 +48,7 @@ class OpenAIVLM(BaseVLM):
         self,
         message: str,
         history: list[dict[str, str]],
-        image_base64: Optional[str] = None,
+        image: Optional[StoredImage | str] = None,
         system_prompt: str = (
             "あなたは気さくで話しやすい会話アシスタントです。"
             "ユーザーとは友達感覚で話し、長すぎる説明は避け、テンポよく短めの発言を心がけてください。"
@@ -50,104 +56,136 @@ class OpenAIVLM(BaseVLM):
             "ユーザーの発言が画像に関係ない場合、視覚情報には言及せず、テキストだけで返答してください。"
         ),
     ) -> GenerationResult:
-        # Base64文字列からプレフィックス（例: data:image/jpeg;base64,）を取り除く
-        if image_base64:
-            if image_base64.startswith("data:image"):
-                image_base64 = image_base64.split(",")[1]
-
-        # ユーザーの画像付き発話
-        if image_base64 is None:
-            image_url = None
-        else:
-            image_url = {"url": f"data:image/png;base64,{image_base64}"}
-
-        # ユーザーの発話と画像を含むメッセージ
-        if image_url is None:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": message,
-                },
-            ]
-
-        else:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": message,
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": image_url,
-                        },
-                    ],
-                },
-            ]
-
-        response = openai_client.chat.completions.create(
-            model=self._model_name,
-            messages=messages,
-            max_tokens=500,
-            temperature=1,
+        # 履歴は過去のターンのみ（今回の発話は末尾に 1 回だけ入る）
+        messages = self._build_messages(
+            message, await self._prepare(image), system_prompt, history
         )
 
-        # ---------- トークン数計測 ----------
-        prompt_tokens = await self.count_tokens(message)
-        completion_tokens = await self.count_tokens(
-            response.choices[0].message.content.strip()
+        client = get_async_openai()
+        response = await with_retries(
+            lambda: client.chat.completions.create(
+                model=self._model_name,
+                messages=messages,
+                max_tokens=500,
+                temperature=1,
+                timeout=OPENAI_CHAT_TIMEOUT,
+            )
         )
 
-        return GenerationResult(
-            content=response.choices[0].message.content.strip(),
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-        )
+        # ---------- トークン数（API の usage を優先） ----------
+        content = response.choices[0].message.content.strip()
+        return await self._result(content, response.usage, messages)
 
     async def stream_generate(
         self,
         message: str,
         history: list[dict[str, str]] | None = None,
-        image_base64: Optional[str] = None,
+        image: Optional[StoredImage | str] = None,
         *,
         system_prompt: str | None = None,
         max_tokens: int = 512,
         temperature: float = 0.9,
-    ) -> AsyncIterator[str]:
-        """トークンまたはチャンクを逐次 yield する非同期ジェネレータ."""
+    ) -> AsyncIterator[str | GenerationResult]:
+        """
+        トークンまたはチャンクを逐次 yield する非同期ジェネレータ.
+        最後に使用量・TTFT・トークン間隔を入れた GenerationResult を返す.
+        """
 
         body_messages = self._build_messages(
-            message, image_base64, system_prompt
+            message, await self._prepare(image), system_prompt, history
         )
-        if history:
-            body_messages = history + body_messages[1:]
-
-        # OpenAI 非同期ストリーム
-        stream = await openai_client2.chat.completions.create(
-            model=self._model_name,
-            messages=body_messages,
-            max_tokens=512,
-            temperature=0.9,
-            stream=True,
+
+        # OpenAI 非同期ストリーム（再試行はトークンを返し始める前まで）
+        client = get_async_openai()
+        started = time.perf_counter()
+        stream = await with_retries(
+            lambda: client.chat.completions.create(
+                model=self._model_name,
+                messages=body_messages,
+                max_tokens=512,
+                temperature=0.9,
+                stream=True,
+                # 最後のチャンクで usage（キャッシュ分を含む）を受け取る
+                stream_options={"include_usage": True},
+                timeout=OPENAI_CHAT_TIMEOUT,
+            )
         )
 
+        parts: list[str] = []
+        usage = None
+        first = last = None
         async for chunk in stream:  # type: ignore[attr-defined]
+            if chunk.usage is not None:
+                usage = chunk.usage
             if chunk.choices and chunk.choices[0].delta.content:
+                last = time.perf_counter()
+                if first is None:
+                    first = last
+                parts.append(chunk.choices[0].delta.content)
                 yield chunk.choices[0].delta.content
 
+        result = await self._result("".join(parts), usage, body_messages)
+        if first is not None:
+            result.ttft_ms = int((first - started) * 1000)
+            if result.completion_tokens > 1:
+                result.itl_ms = (
+                    (last - first) * 1000 / (result.completion_tokens - 1)
+                )
+        yield result
+
+    async def count_prompt_tokens(
+        self,
+        message: str,
+        history: list[dict[str, str]] | None = None,
+        *,
+        system_prompt: str | None = None,
+    ) -> int:
+        """
+        stream_generate と同じプロンプトのトークン数（tokenizer で数える）.
+        usage を受け取る前にストリームを打ち切ったターンの集計用.
+        """
+        return await self.count_message_tokens(
+            self._build_messages(message, None, system_prompt, history)
+        )
+
+    async def _result(
+        self, content: str, usage, messages: list[dict]
+    ) -> GenerationResult:
+        """API の usage から結果を作る（無ければ tokenizer で数える）"""
+        if usage is None:
+            return GenerationResult(
+                content=content,
+                prompt_tokens=await self.count_message_tokens(messages),
+                completion_tokens=await self.count_tokens(content),
+                usage_source="tokenizer",
+            )
+        details = getattr(usage, "prompt_tokens_details", None)
+        return GenerationResult(
+            content=content,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=getattr(details, "cached_tokens", None),
+        )
+
     # ------------------------------------------------------------------
     # internal helpers
     # ------------------------------------------------------------------
+    async def _prepare(
+        self, image: Optional[StoredImage | str]
+    ) -> Optional[PreparedImage]:
+        """モデル向けに縮小・再エンコードした画像（フレームごとにキャッシュ）"""
+        if not image:
+            return None
+        return await prepare_image(image, self._model_name)
+
     @staticmethod
     def _build_messages(
         user_text: str,
-        image_b64: Optional[str],
+        image: Optional[PreparedImage],
         system_prompt: Optional[str],
+        history: list[dict[str, str]] | None = None,
     ) -> list[dict[str, object]]:
+        """[system] + 過去のターン + 今回のユーザー発話"""
         if system_prompt is None:
             system_prompt = (
                 "あなたは気さくで話しやすい会話アシスタントです。"
@@ -156,22 +194,17 @@ class OpenAIVLM(BaseVLM):
                 "ユーザーの発言が画像に関係ない場合、視覚情報には言及せず、テキストだけで返答してください。"
             )
 
-        # 画像が渡されていれば data URL へ整形
-        if image_b64:
-            if image_b64.startswith("data:image"):
-                image_b64 = image_b64.split(",", 1)[1]
-            image_url_block = {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{image_b64}"},
-            }
+        # 画像が渡されていればテキストと並べる
+        if image is not None:
             user_block = [
                 {"type": "text", "text": user_text},
-                image_url_block,
+                image.content_block(),
             ]
         else:
             user_block = user_text
 
         return [
             {"role": "system", "content": system_prompt},
+            *(history or []),
             {"role": "user", "content": user_block},
         ]
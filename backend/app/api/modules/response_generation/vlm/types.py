@@ -8,3 +8,22 @@ class GenerationResult:
     content: str
     prompt_tokens: int
     completion_tokens: int
+    # プロンプトのうちプロバイダ側でキャッシュ済みだったトークン数
+    cached_tokens: int | None = None
+    # 最初のトークンまでの時間 / トークン間の平均時間（ストリーム時のみ）
+    ttft_ms: int | None = None
+    itl_ms: float | None = None
+    # 使用量の出所（"provider" = API の usage / "tokenizer" = 手元で計数）
+    usage_source: str = "provider"
+
+
+def tokens_per_sec(result: GenerationResult, latency_ms: int) -> float | None:
+    """
+    生成速度。TTFT が分かればデコード区間（最初のトークン以降）で割る。
+    """
+    if not result.completion_tokens or not latency_ms:
+        return None
+    decode_ms = latency_ms - (result.ttft_ms or 0)
+    if decode_ms <= 0:
+        decode_ms = latency_ms
+    return result.completion_tokens / (decode_ms / 1000)
@@ -0,0 +1,205 @@
+# 複数セッションの Whisper デコードを短い時間窓でまとめ、1 回の
+# バッチ推論（log-mel + encoder/decoder）で処理するスケジューラ。
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import torch
+import whisper
+from api.utils.inference_executor import get_stt_executor
+from api.utils.model_registry import SharedModel
+from numpy.typing import NDArray
+from whisper.audio import HOP_LENGTH, N_FFT, N_SAMPLES, mel_filters
+
+
+@dataclass
+class _PendingSegment:
+    audio: NDArray[np.float32]
+    future: asyncio.Future[str]
+    enqueued: float
+
+
+def batched_log_mel_spectrogram(
+    audio: torch.Tensor, n_mels: int
+) -> torch.Tensor:
+    """
+    whisper.log_mel_spectrogram のバッチ版。(B, N_SAMPLES) → (B, n_mels, 3000)
+    本家はダイナミックレンジのクリップに全体の max を使うため、
+    ここではサンプルごとの max で同じ処理を行う。
+    """
+    window = torch.hann_window(N_FFT, device=audio.device)
+    stft = torch.stft(
+        audio, N_FFT, HOP_LENGTH, window=window, return_complex=True
+    )
+    magnitudes = stft[..., :-1].abs() ** 2
+
+    filters = mel_filters(audio.device, n_mels)
+    mel_spec = filters @ magnitudes
+
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    peak = log_spec.amax(dim=(-2, -1), keepdim=True)
+    log_spec = torch.maximum(log_spec, peak - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+class WhisperBatchScheduler:
+    def __init__(
+        self,
+        shared: SharedModel[whisper.Whisper],
+        window_ms: float = 20.0,
+        max_batch: int = 8,
+        language: str = "ja",
+    ):
+        self._shared = shared
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.language = language
+        self._queue: asyncio.Queue[_PendingSegment] = asyncio.Queue()
+        self._task: asyncio.Task[None] | None = None
+
+        # ---- メトリクス ----
+        self._batches = 0
+        self._segments = 0
+        self._last_batch_size = 0
+        self._total_wait_ms = 0.0
+
+    async def transcribe(self, audio: NDArray[np.float32]) -> str:
+        """
+        1 発話分の float32 音声を投入し、バッチ推論の結果テキストを待つ。
+        30 秒を超える音声はバッチに載らないため通常の transcribe で処理する。
+        """
+        if len(audio) > N_SAMPLES:
+            result = await get_stt_executor().run(
+                self._shared.call,
+                self._shared.model.transcribe,
+                audio,
+                language=self.language,
+                fp16=torch.cuda.is_available(),
+            )
+            return str(result["text"])
+
+        self._ensure_running()
+        loop = asyncio.get_running_loop()
+        pending = _PendingSegment(
+            audio=audio, future=loop.create_future(), enqueued=loop.time()
+        )
+        await self._queue.put(pending)
+        return await pending.future
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._batch_loop())
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 最初の 1 件が来てから window_ms だけ（または満杯まで）集める
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window_ms / 1000
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            # 待っている間にセッション側で取り消されたものは除く
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                continue
+
+            started = loop.time()
+            try:
+                texts = await get_stt_executor().run(
+                    self._shared.call,
+                    self._decode_batch,
+                    [p.audio for p in batch],
+                )
+            except Exception as e:
+                print("Whisper バッチ推論エラー:", e)
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+
+            self._batches += 1
+            self._segments += len(batch)
+            self._last_batch_size = len(batch)
+            self._total_wait_ms += sum(
+                (started - p.enqueued) * 1000 for p in batch
+            )
+            for p, text in zip(batch, texts):
+                if not p.future.done():
+                    p.future.set_result(text)
+
+    def _decode_batch(self, audios: list[NDArray[np.float32]]) -> list[str]:
+        model = self._shared.model
+
+        # 30 秒に揃えたバッチ配列へ直接書き込む（pad_or_trim 相当）
+        padded = np.zeros((len(audios), N_SAMPLES), dtype=np.float32)
+        for row, audio in zip(padded, audios):
+            row[: len(audio)] = audio
+
+        mel = batched_log_mel_spectrogram(
+            torch.from_numpy(padded).to(model.device), model.dims.n_mels
+        )
+        options = whisper.DecodingOptions(
+            language=self.language,
+            fp16=model.device.type == "cuda",
+            without_timestamps=True,
+        )
+        results = whisper.decode(model, mel, options)
+        return [r.text for r in results]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "model": "/".join(str(k) for k in self._shared.key),
+            "window_ms": self.window_ms,
+            "max_batch": self.max_batch,
+            "queued": self._queue.qsize(),
+            "batches": self._batches,
+            "segments": self._segments,
+            "last_batch_size": self._last_batch_size,
+            "avg_batch_size": (
+                round(self._segments / self._batches, 2)
+                if self._batches
+                else 0.0
+            ),
+            "avg_wait_ms": (
+                round(self._total_wait_ms / self._segments, 1)
+                if self._segments
+                else 0.0
+            ),
+        }
+
+
+# ---------- モデルごとのスケジューラ ----------
+_schedulers: dict[tuple[Any, ...], WhisperBatchScheduler] = {}
+
+
+def get_batch_scheduler(
+    shared: SharedModel[whisper.Whisper],
+) -> WhisperBatchScheduler:
+    """
+    共有 Whisper モデルごとのスケジューラを返す。
+    時間窓とバッチ上限は STT_BATCH_WINDOW_MS / STT_BATCH_MAX_SIZE で変更できる。
+    """
+    scheduler = _schedulers.get(shared.key)
+    if scheduler is None:
+        scheduler = WhisperBatchScheduler(
+            shared,
+            window_ms=float(os.getenv("STT_BATCH_WINDOW_MS", "20")),
+            max_batch=int(os.getenv("STT_BATCH_MAX_SIZE", "8")),
+        )
+        _schedulers[shared.key] = scheduler
+    return scheduler
+
+
+def batch_scheduler_stats() -> list[dict[str, Any]]:
+    return [s.stats() for s in _schedulers.values()]
@@ -0,0 +1,21 @@
+import numpy as np
+from numpy.typing import NDArray
+
+# int16 → float32 [-1.0, 1.0) の変換係数（Whisper の load_audio と同じ）
+PCM16_SCALE = 1.0 / 32768.0
+
+
+def pcm16_to_float32(
+    pcm: bytes | memoryview | NDArray[np.int16],
+) -> NDArray[np.float32]:
+    """
+    int16 PCM を Whisper にそのまま渡せる float32 配列へ変換する。
+    frombuffer はビューを返すだけなので、確保されるのは astype の 1 回のみ。
+    """
+    if isinstance(pcm, np.ndarray):
+        samples = pcm
+    else:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+    audio = samples.astype(np.float32)
+    audio *= PCM16_SCALE
+    return audio
@@ -1,18 +1,38 @@
 import asyncio
 import contextlib
 import io
-import tempfile
 import uuid
 import wave
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from typing import Any
 
 import numpy as np
 import openai
-import torch
-import whisper
+from api.utils.inference_executor import get_stt_executor
+from api.utils.model_registry import get_whisper_model
 from numpy.typing import NDArray
 
+from .batch_scheduler import get_batch_scheduler
+from .pcm import pcm16_to_float32
+
+
+@dataclass
+class TranscriptSegment:
+    text: str
+    end: float | None = None  # 窓先頭からの終了時刻（秒）。不明なら None
+
+
+@dataclass
+class IncrementalState:
+    """発話中の逐次文字起こし（local-agreement）の状態"""
+
+    committed_text: str = ""
+    committed_samples: int = 0  # 確定済みテキストに対応する音声長
+    decoded_samples: int = 0  # 最後にデコードを始めた時点の音声長
+    tentative: list[TranscriptSegment] = field(default_factory=list)
+    in_flight: asyncio.Task[None] | None = None
+
 
 # ---------- 共通基底 ----------
 class BaseTranscriber(ABC):
@@ -22,7 +42,11 @@ class BaseTranscriber(ABC):
         self.sample_rate = sample_rate
         self.result_queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
         self._silence_trim_duration = 0.0
-        self.latest_image_base64: str | None = None
+
+        # 逐次文字起こし（partial_transcription）用
+        self.partial_queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self.partial_interval_sec = 1.0
+        self._incremental: IncrementalState | None = None
 
     async def start(self):
         print("▶️ Transcriber ready")
@@ -38,12 +62,39 @@ class BaseTranscriber(ABC):
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
-    async def transcribe_audio_chunk(self, pcm_chunk: bytes):
+    async def _transcribe_segments_impl(
+        self, pcm_chunk: bytes, prompt: str | None = None
+    ) -> list[TranscriptSegment]:
+        """
+        逐次文字起こし用。タイムスタンプ付きの区間列を返す。
+        タイムスタンプを返せないモデルは全体を 1 区間（end=None）として返し、
+        その場合は確定（commit）は行われず暫定テキストだけが流れる。
+        """
+        return [TranscriptSegment(await self._transcribe_impl(pcm_chunk))]
+
+    async def transcribe_audio_chunk(
+        self,
+        pcm_chunk: bytes,
+        meta: dict[str, Any] | None = None,
+        keep_incremental: bool = False,
+    ):
+        """
+        meta は結果 dict にそのまま同梱される（発話 ID などの対応付け用）。
+        keep_incremental=True の場合は逐次状態を破棄しない（投機的な確定用）。
+        """
         # ① 計測開始
         start = asyncio.get_event_loop().time()
 
         # ② 実際の音声→文字起こしを呼び出し
-        text = await self._transcribe_impl(pcm_chunk)
+        #    逐次モードで確定済みの先頭があれば、未確定の末尾だけをデコードする
+        state = self._incremental
+        if not keep_incremental:
+            self.end_incremental()
+        if state and state.committed_samples:
+            tail = memoryview(pcm_chunk)[state.committed_samples * 2 :]
+            text = state.committed_text + await self._transcribe_impl(tail)
+        else:
+            text = await self._transcribe_impl(pcm_chunk)
 
         # ③ 計測終了＆ms に変換
         latency_ms = int((asyncio.get_event_loop().time() - start) * 1000)
@@ -53,11 +104,81 @@ class BaseTranscriber(ABC):
         # ④ 結果キューに {'text':…, 'latency_ms':…} を流す
         await self.result_queue.put(
             {
+                **(meta or {}),
                 "text": text,
                 "latency_ms": latency_ms,
             }
         )
 
+    # ---------- 逐次文字起こし ----------
+    def begin_incremental(self):
+        """発話開始時に呼ぶ。前の発話の逐次状態は破棄する。"""
+        self.end_incremental()
+        self._incremental = IncrementalState()
+
+    def end_incremental(self):
+        """逐次状態を破棄し、実行中の再デコードがあれば取り消す。"""
+        if self._incremental and self._incremental.in_flight:
+            self._incremental.in_flight.cancel()
+        self._incremental = None
+
+    def feed_incremental(self, pcm_so_far: bytes | bytearray | memoryview):
+        """
+        発話開始から現在までの PCM を渡す。前回から partial_interval_sec 以上
+        伸びていて、デコード中でなければ未確定区間の再デコードを起動する。
+        """
+        state = self._incremental
+        if state is None or (state.in_flight and not state.in_flight.done()):
+            return
+        total = len(pcm_so_far) // 2
+        interval = int(self.partial_interval_sec * self.sample_rate)
+        if total - state.decoded_samples < interval:
+            return
+
+        # 未確定区間だけを切り出してスナップショットする（受信側は追記を続ける）
+        window = memoryview(pcm_so_far)[
+            state.committed_samples * 2 : total * 2
+        ].tobytes()
+        state.decoded_samples = total
+        state.in_flight = asyncio.create_task(
+            self._decode_incremental(state, window)
+        )
+
+    async def _decode_incremental(
+        self, state: IncrementalState, window: bytes
+    ):
+        try:
+            segments = await self._transcribe_segments_impl(
+                window, prompt=state.committed_text or None
+            )
+        except Exception as e:
+            print("partial transcription error:", e)
+            return
+        if state is not self._incremental:
+            return  # 発話が切り替わった
+
+        # local-agreement: 前回と今回の仮説で一致した先頭区間を確定する。
+        # 最後の区間はまだ伸びる可能性があるので常に未確定扱い。
+        agreed = 0
+        for prev, cur in zip(state.tentative, segments[:-1]):
+            if cur.end is None or prev.text != cur.text:
+                break
+            agreed += 1
+        if agreed:
+            end = segments[agreed - 1].end or 0.0
+            state.committed_text += "".join(s.text for s in segments[:agreed])
+            state.committed_samples += int(end * self.sample_rate)
+            segments = segments[agreed:]
+        state.tentative = segments
+
+        tentative_text = "".join(s.text for s in segments)
+        await self.partial_queue.put(
+            {
+                "text": state.committed_text + tentative_text,
+                "committed": state.committed_text,
+            }
+        )
+
     # 共通ユーティリティ
     def _trim_tail_silence(
         self, np_chunk: NDArray[np.int16]
@@ -69,9 +190,6 @@ class BaseTranscriber(ABC):
         print(f"⚙️ silence_duration_threshold を {sec:.2f} 秒に更新")
         self._silence_trim_duration = sec
 
-    def update_latest_image(self, image_base64: str):
-        self.latest_image_base64 = image_base64
-
     @property
     def model_name(self) -> str:
         return self._model_name
@@ -81,30 +199,37 @@ class BaseTranscriber(ABC):
 class WhisperLocalTranscriber(BaseTranscriber):
     def __init__(self, sample_rate: int = 16000, name: str = "base"):
         super().__init__(sample_rate)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = whisper.load_model(name, device=device)
+        # 重みはレジストリで共有し、セッションごとには再ロードしない
+        self._whisper = get_whisper_model(name)
+        self.model = self._whisper.model
+        self._scheduler = get_batch_scheduler(self._whisper)
         self._model_name = f"whisper_{name}"
 
     async def _transcribe_impl(self, pcm_chunk: bytes) -> str:
+        # WAV / ffmpeg を経由せず float32 配列を直接 Whisper に渡す
+        audio = pcm16_to_float32(pcm_chunk)
 
-        np_chunk = np.frombuffer(pcm_chunk, dtype=np.int16)
-
-        # Save tmp WAV for Whisper
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-            wav_path = f.name
-            with contextlib.closing(wave.open(f, "wb")) as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)
-                wf.setframerate(self.sample_rate)
-                wf.writeframes(np_chunk.tobytes())
+        # 他セッションの発話とまとめてバッチ推論される
+        return await self._scheduler.transcribe(audio)
 
-        result = await asyncio.to_thread(
+    async def _transcribe_segments_impl(
+        self, pcm_chunk: bytes, prompt: str | None = None
+    ) -> list[TranscriptSegment]:
+        # 区間タイムスタンプが必要なので逐次用はバッチを通さず transcribe する
+        audio = pcm16_to_float32(pcm_chunk)
+        result = await get_stt_executor().run(
+            self._whisper.call,
             self.model.transcribe,
-            wav_path,
+            audio,
             language="ja",
-            fp16=torch.cuda.is_available(),
+            fp16=self.model.device.type == "cuda",
+            initial_prompt=prompt,
+            condition_on_previous_text=False,
         )
-        return str(result["text"])
+        return [
+            TranscriptSegment(text=str(seg["text"]), end=float(seg["end"]))
+            for seg in result["segments"]
+        ]
 
 
 # ---------- ② OpenAI 一括 STT ----------
@@ -119,14 +244,14 @@ class OpenAITranscriber(BaseTranscriber):
         self._model_name = model
 
     async def _transcribe_impl(self, pcm_chunk: bytes) -> str:
-        np_chunk = np.frombuffer(pcm_chunk, dtype=np.int16)
         buf = io.BytesIO()
 
+        # API 送信用の WAV はメモリ上で組み立てる（PCM はそのまま書き込む）
         with contextlib.closing(wave.open(buf, "wb")) as wf:
             wf.setnchannels(1)
             wf.setsampwidth(2)
             wf.setframerate(self.sample_rate)
-            wf.writeframes(np_chunk.tobytes())
+            wf.writeframes(pcm_chunk)
         buf.seek(0)
         buf.name = f"audio_{uuid.uuid4().hex[:8]}.wav"
 
@@ -0,0 +1,167 @@
+# フレーム単位で VAD 判定を行い、発話区間を切り出すセグメンタ。
+# 受信チャンクの全フレームを判定し、プリロール・ハングオーバー・
+# 最短/最長長を考慮して 1 発話分の音声を返す。バッファはすべて事前確保。
+from typing import Callable
+
+import numpy as np
+from api.utils.pcm_ring_buffer import PcmRingBuffer
+from numpy.typing import NDArray
+
+from .pcm import pcm16_to_float32
+
+SUPPORTED_FRAME_MS = (10, 20, 30)
+
+FrameClassifier = Callable[[NDArray[np.int16]], bool]
+
+
+class VadSegmenter:
+    def __init__(
+        self,
+        classifier: FrameClassifier,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        pre_roll_ms: int = 300,
+        hangover_ms: int = 300,
+        min_segment_ms: int = 500,
+        max_segment_ms: int = 30_000,
+    ):
+        if frame_ms not in SUPPORTED_FRAME_MS:
+            raise ValueError(f"frame_ms must be one of {SUPPORTED_FRAME_MS}")
+
+        self._classify = classifier
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.min_segment_ms = min_segment_ms
+        self.hangover_frames = max(1, -(-hangover_ms // frame_ms))
+
+        # 端数フレーム（チャンク境界をまたぐ分）
+        self._frame = np.empty(self.frame_size, dtype=np.int16)
+        self._frame_fill = 0
+        # チャンク境界で割り切れなかった 1 バイト（サンプルの前半）
+        self._odd_byte = b""
+
+        # 発話開始前の音声を保持するリングバッファ（古いものから捨てる）
+        pre_roll_frames = -(-pre_roll_ms // frame_ms)
+        self._pre_roll = (
+            PcmRingBuffer(pre_roll_frames * self.frame_size, "drop_oldest")
+            if pre_roll_frames
+            else None
+        )
+
+        # 発話区間バッファ（最長長ぶんを事前確保）
+        max_frames = max(1, max_segment_ms // frame_ms)
+        self._segment = np.empty(max_frames * self.frame_size, dtype=np.int16)
+        self._segment_len = 0
+        self._silence_run = 0
+        self.triggered = False
+
+    def push(
+        self, pcm: bytes | memoryview | NDArray[np.int16]
+    ) -> list[NDArray[np.float32]]:
+        """
+        PCM チャンクを取り込み、確定した発話区間（float32）を返す。
+        チャンク内のすべてのフレームを判定する。
+        """
+        if isinstance(pcm, np.ndarray):
+            samples = pcm
+        else:
+            if self._odd_byte:
+                pcm = self._odd_byte + bytes(pcm)
+            usable = len(pcm) & ~1
+            self._odd_byte = bytes(pcm[usable:])
+            samples = np.frombuffer(pcm[:usable], dtype=np.int16)
+        segments: list[NDArray[np.float32]] = []
+        fs = self.frame_size
+        pos = 0
+        n = len(samples)
+
+        while pos < n:
+            if self._frame_fill == 0 and n - pos >= fs:
+                # フレーム全体がチャンク内にある場合はビューのまま判定する
+                frame = samples[pos : pos + fs]
+                pos += fs
+            else:
+                take = min(fs - self._frame_fill, n - pos)
+                self._frame[self._frame_fill : self._frame_fill + take] = (
+                    samples[pos : pos + take]
+                )
+                self._frame_fill += take
+                pos += take
+                if self._frame_fill < fs:
+                    break
+                frame = self._frame
+                self._frame_fill = 0
+
+            segment = self._process_frame(frame)
+            if segment is not None:
+                segments.append(segment)
+
+        return segments
+
+    def flush(self) -> NDArray[np.float32] | None:
+        """録音中の区間を強制的に確定する（ストリーム終了・無通信時用）。"""
+        if not self.triggered:
+            return None
+        return self._finish()
+
+    def reset(self):
+        self._frame_fill = 0
+        self._odd_byte = b""
+        if self._pre_roll is not None:
+            self._pre_roll.clear()
+        self._segment_len = 0
+        self._silence_run = 0
+        self.triggered = False
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _process_frame(
+        self, frame: NDArray[np.int16]
+    ) -> NDArray[np.float32] | None:
+        is_speech = self._classify(frame)
+
+        if not self.triggered:
+            if not is_speech:
+                if self._pre_roll is not None:
+                    self._pre_roll.write(frame)
+                return None
+            # 発話開始: プリロールを先頭に敷いてから録音する
+            self.triggered = True
+            self._segment_len = 0
+            self._silence_run = 0
+            if self._pre_roll is not None:
+                self._append(self._pre_roll.view())
+                self._pre_roll.clear()
+
+        self._append(frame)
+        if is_speech:
+            self._silence_run = 0
+        else:
+            self._silence_run += 1
+
+        if (
+            self._silence_run >= self.hangover_frames
+            or self._segment_len + self.frame_size > len(self._segment)
+        ):
+            return self._finish()
+        return None
+
+    def _finish(self) -> NDArray[np.float32] | None:
+        self.triggered = False
+        # 末尾の無音は 1 フレームだけ残して落とす
+        trailing = max(self._silence_run - 1, 0) * self.frame_size
+        length = self._segment_len - trailing
+        self._segment_len = 0
+        self._silence_run = 0
+        # 最短長は（プリロールを含む）区間全体の長さで判定する
+        if length * 1000 < self.min_segment_ms * self.sample_rate:
+            print("⚠️ 録音が短すぎるためスキップ")
+            return None
+        return pcm16_to_float32(self._segment[:length])
+
+    def _append(self, frame: NDArray[np.int16]):
+        end = self._segment_len + len(frame)
+        self._segment[self._segment_len : end] = frame
+        self._segment_len = end
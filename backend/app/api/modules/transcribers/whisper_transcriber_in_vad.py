@@ -1,24 +1,33 @@
 import asyncio
 import re
-import time
 from collections import Counter
-from tempfile import NamedTemporaryFile
 
 import numpy as np
-import scipy.io.wavfile as wav
-import torch
 import webrtcvad
-import whisper
+from api.utils.image_store import StoredImage
+from api.utils.model_registry import get_whisper_model
 from numpy.typing import NDArray
 
+from .batch_scheduler import get_batch_scheduler
+from .pcm import PCM16_SCALE
+from .vad_segmenter import VadSegmenter
+
 
 class WhisperAudioTranscriber:
-    def __init__(self, sample_rate: int = 16000, use_vad: bool = True):
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        use_vad: bool = True,
+        frame_duration_ms: int = 30,
+        pre_roll_ms: int = 300,
+        min_segment_ms: int = 500,
+        max_segment_ms: int = 30_000,
+        max_pending_segments: int = 4,
+    ):
         self.sample_rate = sample_rate
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = whisper.load_model("base", device=device)
-        # 非同期処理用の asyncio.Queue を使用
-        self.audio_queue = asyncio.Queue()
+        # Whisper の重みはプロセス内で共有し、ここではセッション状態だけを持つ
+        self._whisper = get_whisper_model("base")
+        self.model = self._whisper.model
         # 文字起こし結果をクライアントに送信するためのキュー
         self.result_queue = asyncio.Queue()
         self.use_vad = use_vad
@@ -29,21 +38,54 @@ class WhisperAudioTranscriber:
 
         # VAD 判定用インスタンス（モード 2: 中程度の厳しさ）
         self.vad = webrtcvad.Vad(2)
-        self.frame_duration_ms = 30  # 30ms
+        self.frame_duration_ms = frame_duration_ms
         self.frame_size = int(sample_rate * self.frame_duration_ms / 1000)
 
+        # 受信チャンクの全フレームを判定して発話区間を切り出す
+        self.segmenter = VadSegmenter(
+            self.is_speech_vad if use_vad else self.is_speech_rms,
+            sample_rate=sample_rate,
+            frame_ms=frame_duration_ms,
+            pre_roll_ms=pre_roll_ms,
+            hangover_ms=int(self.silence_duration_threshold * 1000),
+            min_segment_ms=min_segment_ms,
+            max_segment_ms=max_segment_ms,
+        )
+        # 確定した発話区間 (audio, image) を受け渡すキュー（None は停止通知）。
+        # デコード中の区間も _decode_slots で同じ数までに制限するので、
+        # デコードが追いつかないとキューが埋まり put_audio_chunk が待つ
+        # （受信側に背圧がかかり、保持する区間は 2 × max_pending_segments まで）
+        self._segment_queue: asyncio.Queue[
+            tuple[NDArray[np.float32], StoredImage | None] | None
+        ] = asyncio.Queue(maxsize=max_pending_segments)
+        self._image_at_trigger: StoredImage | None = None
+        # 音声が途絶えた場合に録音中の区間を確定させるタイマー
+        self._stall_timer: asyncio.TimerHandle | None = None
+
         self._running = False
         self._task: asyncio.Task[None] | None = None
 
-        self.latest_image_base64 = None
+        # Whisper 推論は他セッションとまとめてバッチ化し、専用 executor で実行する
+        self._scheduler = get_batch_scheduler(self._whisper)
+        # 直近にスケジュールしたデコード（結果の投入順を発話順に揃えるため）
+        self._last_decode: asyncio.Task[None] | None = None
+        # 同時に抱えるデコードの上限（完了するとスロットを返す）
+        self._decode_slots = asyncio.Semaphore(max_pending_segments)
+
+        # 画像はセッションの ImageStore が持つ生バイトを参照する
+        self.latest_image: StoredImage | None = None
         self.result_bundle_queue = asyncio.Queue()
 
-    def compute_rms(self, data: NDArray[np.float32]) -> float:
-        return np.sqrt(np.mean(np.square(data)))
+    def compute_rms(self, data: NDArray[np.int16]) -> float:
+        # int16 のまま二乗平均を取り、最後に [-1, 1) スケールへ戻す
+        return float(
+            np.sqrt(np.mean(np.square(data, dtype=np.float32))) * PCM16_SCALE
+        )
+
+    def is_speech_rms(self, frame: NDArray[np.int16]) -> bool:
+        return self.compute_rms(frame) > self.silence_rms_threshold
 
     def is_speech_vad(self, pcm_chunk: NDArray[np.int16]) -> bool:
-        if pcm_chunk.dtype != np.int16:
-            pcm_chunk = (pcm_chunk * 32767).astype(np.int16)
         pcm_bytes = pcm_chunk.tobytes()
         try:
             return self.vad.is_speech(pcm_bytes, sample_rate=self.sample_rate)
@@ -51,127 +93,124 @@ class WhisperAudioTranscriber:
             print(f"VADエラー: {e}")
             return False
 
-    async def put_audio_chunk(self, chunk: bytes):
-        np_chunk = (
-            np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
-        )
-        await self.audio_queue.put(np_chunk)
+    async def put_audio_chunk(
+        self, chunk: bytes | memoryview | NDArray[np.int16]
+    ):
+        was_triggered = self.segmenter.triggered
+        segments = self.segmenter.push(chunk)
 
-    def update_latest_image(self, image_base64: str):
-        self.latest_image_base64 = image_base64
+        if self.segmenter.triggered and not was_triggered:
+            print("🎤 音声検出、録音開始")
+            self._image_at_trigger = self.latest_image
+
+        for segment in segments:
+            print("📴 無音検出、録音終了")
+            await self._segment_queue.put((segment, self._image_at_trigger))
+            if self.segmenter.triggered:
+                # 同じチャンク内で次の発話が始まっている
+                self._image_at_trigger = self.latest_image
+
+        self._arm_stall_timer()
+
+    def update_latest_image(self, image: StoredImage | None):
+        self.latest_image = image
 
     async def start(self):
         if not self._running:
             print("▶️ Improved transcription loop を開始")
             self._running = True
+            self.segmenter.reset()
             self._task = asyncio.create_task(self.transcription_loop())
 
     async def stop(self):
         print("⛔ Improved transcription loop を停止")
         self._running = False
+        self._cancel_stall_timer()
         if self._task:
+            await self._segment_queue.put(None)
             await self._task
             self._task = None
+        if self._last_decode:
+            await self._last_decode
+            self._last_decode = None
 
     async def transcription_loop(self):
         print("✨ Improved Whisper文字起こしループ起動")
-        while self._running:
-            audio_data = []
-            silence_start = None
-            image_at_trigger = None
+        # 発話区間が確定したときだけ起きる（ポーリングしない）。
+        # 停止通知 (None) までキューを読み切るので、stop の put が詰まらない
+        while True:
+            item = await self._segment_queue.get()
+            if item is None:
+                break
+            audio_segment, image_at_trigger = item
+
+            # デコード中もループは次の発話区間の受け取りを続ける。
+            # 上限に達したら空くまで待ち、その間はキューが埋まっていく
+            await self._decode_slots.acquire()
+            self._last_decode = asyncio.create_task(
+                self._decode_segment(
+                    audio_segment, image_at_trigger, self._last_decode
+                )
+            )
+            self._last_decode.add_done_callback(
+                lambda _: self._decode_slots.release()
+            )
 
+    def _arm_stall_timer(self):
+        self._cancel_stall_timer()
+        if not self.segmenter.triggered:
+            return
+        loop = asyncio.get_running_loop()
+        timeout = (
+            self.silence_duration_threshold + self.frame_duration_ms / 1000
+        )
+        self._stall_timer = loop.call_later(timeout, self._on_audio_stall)
+
+    def _cancel_stall_timer(self):
+        if self._stall_timer:
+            self._stall_timer.cancel()
+            self._stall_timer = None
+
+    def _on_audio_stall(self):
+        self._stall_timer = None
+        segment = self.segmenter.flush()
+        if segment is not None:
+            print("📴 タイムアウトで録音終了")
             try:
-                first_chunk = await asyncio.wait_for(
-                    self.audio_queue.get(), timeout=0.5
-                )
-            except asyncio.TimeoutError:
-                continue
-
-            # 初回チャンクが発話か否かで録音開始の判断
-            if self.use_vad:
-                is_speech = self.is_speech_vad(first_chunk[: self.frame_size])
-            else:
-                is_speech = (
-                    self.compute_rms(first_chunk) > self.silence_rms_threshold
+                self._segment_queue.put_nowait(
+                    (segment, self._image_at_trigger)
                 )
-
-            if not is_speech:
-                continue
-
-            print("🎤 音声検出、録音開始")
-            audio_data.append(first_chunk)
-            image_at_trigger = self.latest_image_base64
-
-            while self._running:
-                try:
-                    chunk = await asyncio.wait_for(
-                        self.audio_queue.get(), timeout=0.1
-                    )
-                except asyncio.TimeoutError:
-                    if (
-                        silence_start
-                        and time.time() - silence_start
-                        > self.silence_duration_threshold
-                    ):
-                        print("📴 タイムアウトで録音終了")
-                        break
-                    continue
-
-                if self.use_vad:
-                    is_speech = self.is_speech_vad(chunk[: self.frame_size])
-                else:
-                    is_speech = (
-                        self.compute_rms(chunk) > self.silence_rms_threshold
-                    )
-
-                if is_speech:
-                    audio_data.append(chunk)
-                    silence_start = None
-                else:
-                    if silence_start is None:
-                        silence_start = time.time()
-                    elif (
-                        time.time() - silence_start
-                        > self.silence_duration_threshold
-                    ):
-                        print("📴 無音検出、録音終了")
-                        break
-
-            if not audio_data:
-                continue
-
-            total_duration = (
-                sum(len(chunk) for chunk in audio_data) / self.sample_rate
+            except asyncio.QueueFull:
+                print("⚠️ 文字起こし待ちが上限に達したため発話を破棄")
+
+    async def _decode_segment(
+        self,
+        audio_segment: NDArray[np.float32],
+        image_snapshot: StoredImage | None,
+        previous: asyncio.Task[None] | None,
+    ):
+        print("🏋️ Whisperで文字起こし開始")
+        try:
+            transcription_text = await self._scheduler.transcribe(
+                audio_segment
             )
-            if total_duration < 0.5:
-                print("⚠️ 録音が短すぎるためスキップ")
-                continue
-
-            audio_segment = np.concatenate(audio_data)
-            print("🏋️ Whisperで文字起こし開始")
-            image_snapshot = image_at_trigger
-            with NamedTemporaryFile(suffix=".wav", delete=True) as tmp_file:
-                wav.write(
-                    tmp_file.name,
-                    self.sample_rate,
-                    (audio_segment * 32767).astype(np.int16),
-                )
-                tmp_file.flush()
-                result = self.model.transcribe(
-                    tmp_file.name,
-                    language="ja",
-                    fp16=torch.cuda.is_available(),
-                )
-                transcription_text = result["text"]
-                print("🔢 文字起こし結果:", transcription_text)
-                # 文字起こし結果を出力キューに投入
-                await self.result_queue.put(transcription_text)  # audio-only用
-                await self.result_bundle_queue.put(
-                    {  # image対応用
-                        "text": transcription_text,
-                        "image": image_snapshot,
-                    }
-                )
+        except Exception as e:
+            print("Whisper 文字起こしエラー:", e)
+            return
+        finally:
+            # 前の発話の結果を先に流す
+            if previous:
+                await previous
+
+        print("🔢 文字起こし結果:", transcription_text)
+        # 文字起こし結果を出力キューに投入
+        await self.result_queue.put(transcription_text)  # audio-only用
+        await self.result_bundle_queue.put(
+            {  # image対応用
+                "text": transcription_text,
+                "image": image_snapshot,
+            }
+        )
 
 
 def is_invalid_transcription(text: str, repeat_threshold: int = 5) -> bool:
@@ -1,4 +1,7 @@
+import asyncio
+import base64
 from abc import ABC, abstractmethod
+from typing import AsyncIterator
 
 
 class BaseTTS(ABC):
@@ -7,6 +10,48 @@ class BaseTTS(ABC):
     def model_name(self) -> str:
         """カタログの tts_id に対応する固有キーを返す"""
 
+    @property
+    def voice_id(self) -> str:
+        """話者・スタイルの識別子（キャッシュキーに使う）"""
+        return ""
+
+    @property
+    def audio_format(self) -> str:
+        """synthesize_to_bytes が返す音声のコンテナ形式（"wav" / "mp3" 等）"""
+        return "wav"
+
+    @property
+    def max_concurrency(self) -> int:
+        """同時に合成してよい数（共有モデルは 1）"""
+        return 1
+
+    @property
+    def supports_streaming(self) -> bool:
+        """stream_bytes が合成途中のバイト列を順次返すか"""
+        return False
+
+    def cached_bytes(self, text: str) -> bytes | None:
+        """合成せずに返せる音声があれば返す（キャッシュ層で実装）"""
+        return None
+
+    def prefetch(self, texts: list[str]):
+        """これから合成する文の前処理を先にまとめて行う（任意）"""
+
     @abstractmethod
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        """テキストを合成して音声バイナリ（audio_format 形式）で返す"""
+
     def synthesize_to_base64(self, text: str) -> str:
         """テキストを合成して base64 文字列で返す"""
+        return base64.b64encode(self.synthesize_to_bytes(text)).decode("utf-8")
+
+    async def stream_bytes(self, text: str) -> AsyncIterator[bytes]:
+        """
+        合成した音声を届いた順に返す（連結すると audio_format の音声になる）。
+        既定ではワーカースレッドで synthesize_to_bytes を呼び、全体を 1 回で返す。
+        """
+        yield await asyncio.to_thread(self.synthesize_to_bytes, text)
+
+    async def synthesize_async(self, text: str) -> bytes:
+        """イベントループから呼ぶ合成（stream_bytes を最後まで受け取る）"""
+        return b"".join([chunk async for chunk in self.stream_bytes(text)])
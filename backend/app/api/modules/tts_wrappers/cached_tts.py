@@ -0,0 +1,338 @@
+# 合成済み音声を (モデル, 話者/スタイル, 正規化テキスト) のハッシュで
+# キャッシュする BaseTTS ラッパー。
+# 「うん」「なるほど」のような定型句を毎回合成し直さないためのもの。
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+from .base_tts import BaseTTS
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _Abandoned(Exception):
+    """合成を担当していたストリームが途中で打ち切られた"""
+
+
+# 集計用に生成済みキャッシュを保持する（/metrics で参照）
+_caches: list["CachedTTS"] = []
+
+
+def normalize_text(text: str) -> str:
+    """全角/半角ゆれと空白の違いを吸収したキャッシュ用テキスト"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class CachedTTS(BaseTTS):
+    """
+    メモリ LRU（バイト数上限）＋任意のディスク層を持つ TTS キャッシュ。
+    同一キーの合成が同時に来た場合は 1 回だけ合成し、他は結果を待つ。
+    synthesize_to_* は to_thread から呼ばれる前提なのでスレッドで同期する。
+    """
+
+    def __init__(
+        self,
+        inner: BaseTTS,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_dir: str | Path | None = None,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.inner = inner
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight: dict[str, Future[bytes]] = {}
+        self._lock = threading.Lock()
+
+        self._disk_dir: Path | None = None
+        self._disk_bytes = 0
+        if disk_dir is not None:
+            self._disk_dir = Path(disk_dir) / _safe_name(inner.model_name)
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(
+                p.stat().st_size for p in self._disk_files()
+            )
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        _caches.append(self)
+
+    @property
+    def model_name(self) -> str:
+        return self.inner.model_name
+
+    @property
+    def voice_id(self) -> str:
+        return self.inner.voice_id
+
+    @property
+    def audio_format(self) -> str:
+        return self.inner.audio_format
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.inner.max_concurrency
+
+    @property
+    def supports_streaming(self) -> bool:
+        return self.inner.supports_streaming
+
+    def cached_bytes(self, text: str) -> bytes | None:
+        """メモリ層にあれば LRU を更新して返す（ディスク・合成は行わない）"""
+        key = self.cache_key(text)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def prefetch(self, texts: list[str]):
+        """キャッシュにない文だけ内側の TTS に先読みさせる"""
+        with self._lock:
+            todo = [t for t in texts if self.cache_key(t) not in self._memory]
+        if todo:
+            self.inner.prefetch(todo)
+
+    def cache_key(self, text: str) -> str:
+        raw = "\0".join((self.model_name, self.voice_id, normalize_text(text)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        key = self.cache_key(text)
+
+        while True:
+            data, future, owner = self._claim(key)
+            if data is not None:
+                return data
+            if owner:
+                break
+            try:
+                # 先行する同一テキストの合成結果を待つ（失敗時は例外も共有）
+                return future.result()
+            except _Abandoned:
+                # 先行したストリームが打ち切られた → 自分で合成し直す
+                continue
+
+        try:
+            data = self._read_disk(key)
+            if data is None:
+                data = self.inner.synthesize_to_bytes(text)
+                self._write_disk(key, data)
+                with self._lock:
+                    self.misses += 1
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                del self._inflight[key]
+            raise
+
+        with self._lock:
+            self._put_memory(key, data)
+            del self._inflight[key]
+        return data
+
+    async def stream_bytes(self, text: str) -> AsyncIterator[bytes]:
+        if not self.inner.supports_streaming:
+            # 一括合成のモデルは同時合成の集約とディスク層を通す
+            yield await asyncio.to_thread(self.synthesize_to_bytes, text)
+            return
+
+        key = self.cache_key(text)
+        while True:
+            data, future, owner = self._claim(key)
+            if data is not None:
+                yield data
+                return
+            if owner:
+                break
+            try:
+                # 同じ文を合成中のセッションがあれば完了を待って丸ごと返す
+                # （shield: 待つ側の取り消しで共有の Future を取り消さない）
+                data = await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                continue
+            yield data
+            return
+
+        try:
+            data = None
+            if self._disk_dir is not None:
+                data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                yield data
+            else:
+                chunks = []
+                async for chunk in self.inner.stream_bytes(text):
+                    chunks.append(chunk)
+                    yield chunk
+                # 途中で打ち切られた音声はキャッシュしない（ここまで来れば完走）
+                data = b"".join(chunks)
+                if self._disk_dir is not None:
+                    await asyncio.to_thread(self._write_disk, key, data)
+                with self._lock:
+                    self.misses += 1
+        except (GeneratorExit, asyncio.CancelledError):
+            # 打ち切り: 待っている側には自分で合成し直してもらう
+            future.set_exception(_Abandoned())
+            with self._lock:
+                del self._inflight[key]
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                del self._inflight[key]
+            raise
+
+        future.set_result(data)
+        with self._lock:
+            self._put_memory(key, data)
+            del self._inflight[key]
+
+    def _claim(
+        self, key: str
+    ) -> tuple[bytes | None, Future[bytes] | None, bool]:
+        """
+        (メモリ層のデータ, 合成中の Future, 自分が合成を担当するか) を返す。
+        担当する場合は Future を _inflight に登録済みなので、
+        完了時に結果を設定して外すこと。
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            future = Future()
+            self._inflight[key] = future
+            return None, future, True
+
+    def _put_memory(self, key: str, data: bytes):
+        """self._lock を保持した状態で呼ぶ"""
+        if len(data) > self.max_bytes:
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self.evictions += 1
+
+    # ---------- ディスク層 ----------
+
+    def _disk_path(self, key: str) -> Path:
+        assert self._disk_dir is not None
+        return self._disk_dir / f"{key}.{self.audio_format}"
+
+    def _disk_files(self) -> list[Path]:
+        assert self._disk_dir is not None
+        return [p for p in self._disk_dir.iterdir() if p.is_file()]
+
+    def _read_disk(self, key: str) -> bytes | None:
+        if self._disk_dir is None:
+            return None
+        try:
+            data = self._disk_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        return data
+
+    def _write_disk(self, key: str, data: bytes):
+        if self._disk_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            tmp.write_bytes(data)
+            # 上書き（別スレッドが同じ文を書いた等）なら古いサイズを差し引く
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ TTS キャッシュの書き込みに失敗: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """上限を超えたら更新日時の古いファイルから削除する"""
+        files = sorted(self._disk_files(), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        target = self.disk_max_bytes * 0.9
+        for p in files:
+            if total <= target:
+                break
+            size = p.stat().st_size
+            p.unlink(missing_ok=True)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "voice": self.voice_id,
+                "entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self._disk_dir else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "in_flight": len(self._inflight),
+                "hit_rate": (
+                    (self.hits + self.disk_hits) / lookups if lookups else 0.0
+                ),
+            }
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+def cached(inner: BaseTTS) -> CachedTTS:
+    """
+    環境変数の設定でキャッシュを被せる。
+    TTS_CACHE_MAX_MB（既定 64）/ TTS_CACHE_DIR（未設定ならディスク層なし）/
+    TTS_CACHE_DISK_MAX_MB（既定 512）
+    """
+    return CachedTTS(
+        inner,
+        max_bytes=int(float(os.getenv("TTS_CACHE_MAX_MB", "64")) * 1024**2),
+        disk_dir=os.getenv("TTS_CACHE_DIR") or None,
+        disk_max_bytes=int(
+            float(os.getenv("TTS_CACHE_DISK_MAX_MB", "512")) * 1024**2
+        ),
+    )
+
+
+def tts_cache_stats() -> list[dict[str, Any]]:
+    return [c.stats() for c in _caches]
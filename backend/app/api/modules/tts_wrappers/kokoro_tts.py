@@ -1,4 +1,3 @@
-import base64
 import io
 import threading
 from collections import defaultdict
@@ -34,7 +33,7 @@ class TTSGenerator(BaseTTS):
             )
         print("TTS model (re)initialized")
 
-    def synthesize_to_base64(self, text: str, _retry: bool = True) -> str:
+    def synthesize_to_bytes(self, text: str, _retry: bool = True) -> bytes:
         """
         Tacotron2 の内部 state が壊れて RuntimeError が出た場合は
         1 回だけモデルを再構築してリトライする。
@@ -58,11 +57,10 @@ class TTSGenerator(BaseTTS):
             self._build_tts()
 
             # 3) もう一度だけ試す
-            return self.synthesize_to_base64(text, _retry=False)
+            return self.synthesize_to_bytes(text, _retry=False)
 
         # ---------- 正常終了 ----------
-        buffer.seek(0)
-        return base64.b64encode(buffer.read()).decode("utf-8")
+        return buffer.getvalue()
 
     @property
     def model_name(self) -> str:
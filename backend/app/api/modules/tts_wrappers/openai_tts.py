@@ -1,13 +1,24 @@
-import base64
+import asyncio
+import itertools
 import os
+from typing import AsyncIterator
 
 import openai
 from dotenv import load_dotenv
+from services.openai_client import (
+    RETRYABLE_ERRORS,
+    backoff_delay,
+    get_async_openai,
+    max_retries,
+)
 
 from .base_tts import BaseTTS
 
 load_dotenv()
 
+# ストリーミング時に 1 回で受け取るバイト数
+STREAM_CHUNK_BYTES = 4096
+
 
 class OpenAI_TTS(BaseTTS):
     def __init__(self, model: str = "tts-1", voice: str = "alloy"):
@@ -29,14 +40,55 @@ class OpenAI_TTS(BaseTTS):
         )
         return response.content  # バイナリデータを返す
 
-    def synthesize_to_base64(self, text: str) -> str:
+    def synthesize_to_bytes(self, text: str) -> bytes:
         """
-        テキストをMP3形式で音声合成し、Base64エンコードされた文字列を返す
+        テキストをMP3形式で音声合成する
         :param text: 合成したいテキスト
-        :return: Base64文字列（mp3）
+        :return: 音声データ（mp3）
+        """
+        return self.generate(text)
+
+    async def stream_bytes(self, text: str) -> AsyncIterator[bytes]:
         """
-        audio_bytes = self.generate(text)
-        return base64.b64encode(audio_bytes).decode("utf-8")
+        共有の非同期クライアントで合成し、届いた MP3 を順に返す。
+        呼び出し側が途中で閉じる（キャンセルする）とレスポンスも閉じる。
+        """
+        client = get_async_openai()
+        for attempt in itertools.count():
+            started = False
+            try:
+                async with client.audio.speech.with_streaming_response.create(
+                    model=self.tts_model,
+                    voice=self.voice,
+                    input=text,
+                    response_format=self.audio_format,
+                ) as response:
+                    async for chunk in response.iter_bytes(STREAM_CHUNK_BYTES):
+                        started = True
+                        yield chunk
+                return
+            except RETRYABLE_ERRORS as e:
+                # 音声を返し始めた後は途中からやり直せない
+                if started or attempt >= max_retries():
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, e))
+
+    @property
+    def supports_streaming(self) -> bool:
+        return True
+
+    @property
+    def voice_id(self) -> str:
+        return self.voice
+
+    @property
+    def audio_format(self) -> str:
+        return "mp3"
+
+    @property
+    def max_concurrency(self) -> int:
+        # API 呼び出しなのでローカルモデルより多く並列にできる
+        return 4
 
     @property
     def model_name(self) -> str:
@@ -0,0 +1,138 @@
+# TTS 出力（WAV）の後処理: 前後の無音カットと音量の正規化、任意のリサンプル。
+# Kokoro / Style-BERT-VITS2 は文の前後に無音が入り音量も揃っていないため、
+# ストリーミングで文ごとに送ると無音の分だけ再生が遅れる。
+#
+# 処理はすべて numpy のベクトル演算で、デコード後の float32 配列 1 つに対して
+#   • フレームごとのエネルギーは reshape したビュー上で計算（コピーなし）
+#   • 無音カットはスライス（ビュー）
+#   • ゲインはその場で乗算
+# のみ行う（リサンプルを指定した場合だけ新しい配列になる）。
+import asyncio
+import io
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import numpy as np
+import soundfile as sf
+from api.utils.audio_resampler import resample
+
+from .base_tts import BaseTTS
+
+_EPS = 1e-10
+
+
+@dataclass(frozen=True)
+class PostProcessConfig:
+    # 最大フレームから何 dB 下までを有音とみなすか
+    trim_threshold_db: float | None = -40.0
+    # 無音カット後も前後に残す長さ（子音の立ち上がりを削らないため）
+    keep_ms: float = 40.0
+    frame_ms: float = 10.0
+    # 有音部分の RMS をこの dBFS に合わせる（None で無効）
+    target_dbfs: float | None = -20.0
+    # ゲイン適用後のピーク上限
+    peak_dbfs: float = -1.0
+    # 出力サンプルレート（None なら変換しない）
+    sample_rate: int | None = None
+
+    @property
+    def signature(self) -> str:
+        """キャッシュキー用の設定文字列"""
+        return (
+            f"trim={self.trim_threshold_db},keep={self.keep_ms},"
+            f"frame={self.frame_ms},rms={self.target_dbfs},"
+            f"peak={self.peak_dbfs},sr={self.sample_rate}"
+        )
+
+
+def frame_power(x: np.ndarray, frame: int) -> np.ndarray:
+    """フレームごとの平均パワー（末尾の端数フレームは除く）"""
+    n = len(x) // frame
+    frames = x[: n * frame].reshape(n, frame)
+    return np.einsum("ij,ij->i", frames, frames) / frame
+
+
+def postprocess(
+    x: np.ndarray, sr: int, config: PostProcessConfig
+) -> tuple[np.ndarray, int]:
+    """
+    モノラル float32 波形を後処理して返す。
+    x はその場で書き換えるので、呼び出し側で再利用しないこと。
+    """
+    frame = max(1, int(sr * config.frame_ms / 1000))
+    power = frame_power(x, frame)
+    if len(power) == 0 or power.max() <= _EPS:
+        return x, sr
+
+    power_db = 10 * np.log10(power + _EPS)
+    if config.trim_threshold_db is not None:
+        active = np.flatnonzero(
+            power_db >= power_db.max() + config.trim_threshold_db
+        )
+        keep = int(sr * config.keep_ms / 1000)
+        start = max(0, active[0] * frame - keep)
+        end = min(len(x), (active[-1] + 1) * frame + keep)
+        x = x[start:end]
+    else:
+        active = np.arange(len(power))
+
+    if config.target_dbfs is not None:
+        # 有音フレームのパワーから RMS を求める（波形を再走査しない）
+        rms_db = 10 * np.log10(power[active].mean() + _EPS)
+        gain_db = config.target_dbfs - rms_db
+        peak = float(np.abs(x).max())
+        if peak > 0:
+            peak_db = 20 * np.log10(peak)
+            gain_db = min(gain_db, config.peak_dbfs - peak_db)
+        x *= np.float32(10 ** (gain_db / 20))
+
+    if config.sample_rate and config.sample_rate != sr:
+        x, sr = resample(x, sr, config.sample_rate), config.sample_rate
+    return x, sr
+
+
+def postprocess_wav(data: bytes, config: PostProcessConfig) -> bytes:
+    """WAV バイナリを後処理し、16bit PCM の WAV で返す"""
+    x, sr = sf.read(io.BytesIO(data), dtype="float32")
+    if x.ndim > 1:
+        x = x.mean(axis=1, dtype=np.float32)
+    x, sr = postprocess(x, sr, config)
+    buffer = io.BytesIO()
+    sf.write(buffer, x, sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+class PostProcessingTTS(BaseTTS):
+    """WAV を出力する TTS の結果に後処理をかけるラッパー"""
+
+    def __init__(self, inner: BaseTTS, config: PostProcessConfig):
+        if inner.audio_format != "wav":
+            raise ValueError(
+                f"post-processing needs WAV output: {inner.model_name}"
+            )
+        self.inner = inner
+        self.config = config
+
+    @property
+    def model_name(self) -> str:
+        return self.inner.model_name
+
+    @property
+    def voice_id(self) -> str:
+        # 後処理の有無・設定ごとに合成キャッシュを分ける
+        return f"{self.inner.voice_id}|{self.config.signature}"
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.inner.max_concurrency
+
+    def prefetch(self, texts: list[str]):
+        self.inner.prefetch(texts)
+
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        data = self.inner.synthesize_to_bytes(text)
+        return postprocess_wav(data, self.config)
+
+    async def stream_bytes(self, text: str) -> AsyncIterator[bytes]:
+        data = await self.inner.synthesize_async(text)
+        yield await asyncio.to_thread(postprocess_wav, data, self.config)
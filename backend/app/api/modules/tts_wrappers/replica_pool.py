@@ -0,0 +1,148 @@
+# スレッドセーフでないローカル TTS モデルを N 個複製して並列に使うプール。
+# 1 リクエストは 1 レプリカを専有し、レプリカ数と同じ数の専用スレッドで
+# 実行する。torch の演算スレッド数はプロセス全体の設定なので、
+# 指定された場合だけプール生成時に 1 度設定する（スレッドごとには持てない）。
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+import torch
+
+from .base_tts import BaseTTS
+
+T = TypeVar("T")
+
+# 集計用に生成済みプールを保持する（/metrics で参照）
+_pools: list["TTSReplicaPool"] = []
+
+
+class TTSReplicaPool(BaseTTS):
+    def __init__(
+        self,
+        factory: Callable[[], BaseTTS],
+        replicas: int = 1,
+        torch_threads: int | None = None,
+    ):
+        """
+        :param factory: レプリカ 1 個を生成する関数
+        :param replicas: レプリカ数（= 同時合成数）
+        :param torch_threads: torch の演算スレッド数（プロセス全体に効くため
+            Whisper 等の他の torch 処理も同じ値になる。None なら変更しない）
+        """
+        if replicas < 1:
+            raise ValueError("replicas must be >= 1")
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+        self.replicas = [factory() for _ in range(replicas)]
+        self._free: queue.SimpleQueue[BaseTTS] = queue.SimpleQueue()
+        for replica in self.replicas:
+            self._free.put(replica)
+        self._executor = ThreadPoolExecutor(
+            max_workers=replicas,
+            thread_name_prefix=f"tts-{self.model_name}",
+        )
+
+        # ---- メトリクス ----
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+        self._completed = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        _pools.append(self)
+        print(
+            f"🧩 TTS replica pool: {self.model_name} "
+            f"x{replicas} (torch threads {torch.get_num_threads()})"
+        )
+
+    @property
+    def model_name(self) -> str:
+        return self.replicas[0].model_name
+
+    @property
+    def voice_id(self) -> str:
+        return self.replicas[0].voice_id
+
+    @property
+    def audio_format(self) -> str:
+        return self.replicas[0].audio_format
+
+    @property
+    def max_concurrency(self) -> int:
+        return len(self.replicas)
+
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        return self._submit(lambda r: r.synthesize_to_bytes(text)).result()
+
+    async def stream_bytes(self, text: str) -> AsyncIterator[bytes]:
+        # to_thread を挟まずプールのスレッドで直接合成する
+        future = self._submit(lambda r: r.synthesize_to_bytes(text))
+        yield await asyncio.wrap_future(future)
+
+    def prefetch(self, texts: list[str]):
+        self._submit(lambda r: r.prefetch(texts)).result()
+
+    def _submit(self, fn: Callable[[BaseTTS], T]):
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(self._run, fn, submitted)
+
+    def _run(self, fn: Callable[[BaseTTS], T], submitted: float) -> T:
+        wait_ms = (time.perf_counter() - submitted) * 1000
+        # ワーカー数 = レプリカ数なので待たずに取り出せる
+        replica = self._free.get()
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+            self._total_wait_ms += wait_ms
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+        try:
+            return fn(replica)
+        finally:
+            self._free.put(replica)
+            with self._lock:
+                self._busy -= 1
+                self._completed += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            started = self._completed + self._busy
+            return {
+                "model": self.model_name,
+                "replicas": len(self.replicas),
+                "torch_threads": torch.get_num_threads(),
+                "busy": self._busy,
+                "queued": self._queued,
+                "occupancy": self._busy / len(self.replicas),
+                "completed": self._completed,
+                "avg_wait_ms": (
+                    self._total_wait_ms / started if started else 0.0
+                ),
+                "max_wait_ms": self._max_wait_ms,
+            }
+
+
+def replica_pool(factory: Callable[[], BaseTTS], name: str) -> TTSReplicaPool:
+    """
+    環境変数の設定でプールを作る。
+    TTS_REPLICAS_<NAME>（なければ TTS_REPLICAS、既定 1）/
+    TTS_TORCH_THREADS（プロセス全体の torch 演算スレッド数、既定は変更しない）
+    """
+    replicas = os.getenv(f"TTS_REPLICAS_{name.upper()}") or os.getenv(
+        "TTS_REPLICAS"
+    )
+    threads = os.getenv("TTS_TORCH_THREADS")
+    return TTSReplicaPool(
+        factory,
+        replicas=int(replicas or 1),
+        torch_threads=int(threads) if threads else None,
+    )
+
+
+def tts_pool_stats() -> list[dict[str, Any]]:
+    return [p.stats() for p in _pools]
@@ -0,0 +1,221 @@
+# Style-BERT-VITS2 のテキスト前処理（正規化・G2P・BERT 特徴量）のメモ化。
+#
+# 同じ文を合成するたびに pyopenjtalk と deberta-v2-large（約 3 億パラメータ）を
+# 回さないよう、正規化した文ごとに結果をバイト数上限付き LRU に保持する。
+# 1 ターンで複数の文がキューに溜まっているときは prefetch() で
+# BERT をまとめて 1 回のバッチで実行する。
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import torch
+from style_bert_vits2.constants import Languages
+from style_bert_vits2.models import commons
+from style_bert_vits2.models.hyper_parameters import HyperParameters
+from style_bert_vits2.nlp import (
+    bert_models,
+    clean_text,
+    cleaned_text_to_sequence,
+)
+from style_bert_vits2.nlp.japanese.g2p import text_to_sep_kata
+
+from .cached_tts import normalize_text
+
+# BERT 入力文のリスト → 文ごとの hidden state (tokens, 1024)
+BertFn = Callable[[list[str]], list[np.ndarray]]
+
+
+@dataclass(frozen=True)
+class FrontendEntry:
+    phone: np.ndarray
+    tone: np.ndarray
+    language: np.ndarray
+    word2ph: np.ndarray
+    # トークン単位の特徴量。音素単位への展開（repeat）は使うときに行う
+    hidden: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes
+            for a in (
+                self.phone,
+                self.tone,
+                self.language,
+                self.word2ph,
+                self.hidden,
+            )
+        )
+
+    def bert(self) -> np.ndarray:
+        """音素単位の BERT 特徴量 (1024, n_phones)"""
+        return np.repeat(self.hidden, self.word2ph, axis=0).T
+
+
+@dataclass(frozen=True)
+class _G2P:
+    phone: list[int]
+    tone: list[int]
+    language: list[int]
+    word2ph: list[int]
+    bert_text: str
+
+
+class SBV2Frontend:
+    def __init__(
+        self,
+        hps: HyperParameters,
+        bert_fn: BertFn,
+        max_bytes: int | None = None,
+    ):
+        self.hps = hps
+        self.bert_fn = bert_fn
+        self.jp_extra = hps.version.endswith("JP-Extra")
+        # SBV2_FRONTEND_CACHE_MB（既定 32）
+        self.max_bytes = max_bytes or int(
+            float(os.getenv("SBV2_FRONTEND_CACHE_MB", "32")) * 1024**2
+        )
+        self._entries: OrderedDict[str, FrontendEntry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bert_batches = 0
+        _frontends.append(self)
+
+    # ---------- 公開 API ----------
+
+    def features(self, text: str) -> FrontendEntry:
+        """1 文分の前処理結果（キャッシュになければ計算）"""
+        key = normalize_text(text)
+        entry = self._get(key)
+        if entry is None:
+            entry = self._compute([text])[0]
+            self._put(key, entry)
+        return entry
+
+    def prefetch(self, texts: Sequence[str]):
+        """未計算の文をまとめて前処理する（BERT は 1 回のバッチ）"""
+        todo: dict[str, str] = {}
+        # 合成時と同じく改行ごとに 1 文として扱う
+        lines = (line for t in texts for line in t.split("\n") if line)
+        for line in lines:
+            key = normalize_text(line)
+            if key and key not in todo and not self._contains(key):
+                todo[key] = line
+        if not todo:
+            return
+        for key, entry in zip(todo, self._compute(list(todo.values()))):
+            self._put(key, entry)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.hps.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bert_batches": self.bert_batches,
+            }
+
+    # ---------- 内部処理 ----------
+
+    def _g2p(self, text: str) -> _G2P:
+        """models.infer.get_text と同じ手順で音素列と word2ph を作る"""
+        norm_text, phone, tone, word2ph = clean_text(
+            text,
+            Languages.JP,
+            use_jp_extra=self.jp_extra,
+            raise_yomi_error=False,
+        )
+        phone, tone, language = cleaned_text_to_sequence(
+            phone, tone, Languages.JP
+        )
+        if self.hps.data.add_blank:
+            phone = commons.intersperse(phone, 0)
+            tone = commons.intersperse(tone, 0)
+            language = commons.intersperse(language, 0)
+            word2ph = [w * 2 for w in word2ph]
+            word2ph[0] += 1
+        # extract_bert_feature と同じく読めない文字を除いた文を BERT に入れる
+        bert_text = "".join(
+            text_to_sep_kata(norm_text, raise_yomi_error=False)[0]
+        )
+        assert len(word2ph) == len(bert_text) + 2, bert_text
+        return _G2P(phone, tone, language, word2ph, bert_text)
+
+    def _compute(self, texts: list[str]) -> list[FrontendEntry]:
+        g2ps = [self._g2p(t) for t in texts]
+        hiddens = self.bert_fn([g.bert_text for g in g2ps])
+        with self._lock:
+            self.misses += len(texts)
+            self.bert_batches += 1
+        return [
+            FrontendEntry(
+                phone=np.asarray(g.phone, dtype=np.int64),
+                tone=np.asarray(g.tone, dtype=np.int64),
+                language=np.asarray(g.language, dtype=np.int64),
+                word2ph=np.asarray(g.word2ph, dtype=np.int64),
+                hidden=np.ascontiguousarray(h, dtype=np.float32),
+            )
+            for g, h in zip(g2ps, hiddens)
+        ]
+
+    def _contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def _get(self, key: str) -> FrontendEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def _put(self, key: str, entry: FrontendEntry):
+        with self._lock:
+            if key in self._entries or entry.nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+
+
+_frontends: list[SBV2Frontend] = []
+
+
+def frontend_cache_stats() -> list[dict[str, Any]]:
+    return [f.stats() for f in _frontends]
+
+
+# ---------- BERT 実行（PyTorch） ----------
+
+
+def torch_bert_fn(device: str) -> BertFn:
+    """deberta-v2 をパディング付きバッチで 1 回だけ実行する"""
+    if device == "cuda" and not torch.cuda.is_available():
+        device = "cpu"
+
+    def run(texts: list[str]) -> list[np.ndarray]:
+        model = bert_models.load_model(Languages.JP).to(device)
+        tokenizer = bert_models.load_tokenizer(Languages.JP)
+        inputs = tokenizer(texts, return_tensors="pt", padding=True)
+        with torch.no_grad():
+            out = model(
+                input_ids=inputs["input_ids"].to(device),
+                attention_mask=inputs["attention_mask"].to(device),
+                output_hidden_states=True,
+            )
+        hidden = out["hidden_states"][-3].float().cpu().numpy()
+        lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        return [hidden[i, :n] for i, n in enumerate(lengths)]
+
+    return run
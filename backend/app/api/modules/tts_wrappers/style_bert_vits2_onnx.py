@@ -0,0 +1,362 @@
+# Style-BERT-VITS2 を ONNX Runtime（CPU）で推論する BaseTTS 実装。
+# 初回に PyTorch の generator と BERT 特徴抽出器を ONNX へ書き出して
+# model_dir/onnx/ にキャッシュし、以降はそれを読み込むだけにする。
+# テキスト前処理（g2p・トーン・word2ph）は sbv2_frontend のキャッシュを共有する。
+import argparse
+import io
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+import soundfile as sf
+import torch
+from style_bert_vits2.constants import (
+    DEFAULT_LENGTH,
+    DEFAULT_NOISE,
+    DEFAULT_NOISEW,
+    DEFAULT_SDP_RATIO,
+    DEFAULT_SPLIT_INTERVAL,
+    DEFAULT_STYLE,
+    DEFAULT_STYLE_WEIGHT,
+    Languages,
+)
+from style_bert_vits2.models.hyper_parameters import HyperParameters
+from style_bert_vits2.models.infer import get_net_g
+from style_bert_vits2.nlp import bert_models
+
+from .base_tts import BaseTTS
+from .sbv2_frontend import SBV2Frontend
+
+# BERT トークナイザのパス設定を共有する
+from .style_bert_vits2_wrapper import RuminaStyleBertVITS2Wrapper
+
+GENERATOR_FILE = "G_2900.pth"
+ONNX_OPSET = 17
+
+_GENERATOR_INPUTS = (
+    "x",
+    "x_lengths",
+    "sid",
+    "tone",
+    "language",
+    "bert",
+    "style_vec",
+    "noise_scale",
+    "length_scale",
+    "noise_scale_w",
+    "sdp_ratio",
+)
+
+
+# ---------- ONNX 書き出し ----------
+
+
+class _GeneratorForExport(torch.nn.Module):
+    """net_g.infer を ONNX で扱える forward にしたもの（出力は波形のみ）"""
+
+    def __init__(self, net_g: torch.nn.Module, jp_extra: bool):
+        super().__init__()
+        self.net_g = net_g
+        self.jp_extra = jp_extra
+
+    def forward(
+        self,
+        x,
+        x_lengths,
+        sid,
+        tone,
+        language,
+        bert,
+        style_vec,
+        noise_scale,
+        length_scale,
+        noise_scale_w,
+        sdp_ratio,
+    ):
+        kwargs = dict(
+            style_vec=style_vec,
+            noise_scale=noise_scale,
+            length_scale=length_scale,
+            noise_scale_w=noise_scale_w,
+            sdp_ratio=sdp_ratio,
+        )
+        if self.jp_extra:
+            out = self.net_g.infer(
+                x, x_lengths, sid, tone, language, bert, **kwargs
+            )
+        else:
+            # 非 JP-Extra は zh/ja/en の 3 系統。日本語のみなので他は 0
+            zeros = torch.zeros_like(bert)
+            out = self.net_g.infer(
+                x, x_lengths, sid, tone, language, zeros, bert, zeros, **kwargs
+            )
+        return out[0]
+
+
+class _BertForExport(torch.nn.Module):
+    """
+    extract_bert_feature と同じく後ろから 3 層目の hidden state を返す
+    （複数文をまとめて流せるよう batch 次元を残す）
+    """
+
+    def __init__(self, bert: torch.nn.Module):
+        super().__init__()
+        self.bert = bert
+
+    def forward(self, input_ids, attention_mask):
+        out = self.bert(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            output_hidden_states=True,
+        )
+        return out["hidden_states"][-3]
+
+
+def export_generator(
+    model_dir: Path, hps: HyperParameters, style_dim: int, out_path: Path
+):
+    net_g = get_net_g(
+        model_path=str(model_dir / GENERATOR_FILE),
+        version=hps.version,
+        device="cpu",
+        hps=hps,
+    )
+    module = _GeneratorForExport(net_g, hps.version.endswith("JP-Extra"))
+    module.eval()
+
+    n = 32
+    dummy = (
+        torch.randint(1, 40, (1, n)),
+        torch.LongTensor([n]),
+        torch.LongTensor([0]),
+        torch.zeros(1, n, dtype=torch.long),
+        torch.zeros(1, n, dtype=torch.long),
+        torch.randn(1, 1024, n),
+        torch.randn(1, style_dim),
+        torch.tensor(DEFAULT_NOISE),
+        torch.tensor(DEFAULT_LENGTH),
+        torch.tensor(DEFAULT_NOISEW),
+        torch.tensor(DEFAULT_SDP_RATIO),
+    )
+    phones = {1: "phones"}
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            dummy,
+            str(out_path),
+            input_names=list(_GENERATOR_INPUTS),
+            output_names=["audio"],
+            dynamic_axes={
+                "x": phones,
+                "tone": phones,
+                "language": phones,
+                "bert": {2: "phones"},
+                "audio": {2: "samples"},
+            },
+            opset_version=ONNX_OPSET,
+        )
+
+
+def export_bert(out_path: Path):
+    module = _BertForExport(bert_models.load_model(Languages.JP).to("cpu"))
+    module.eval()
+    tokens = {0: "batch", 1: "tokens"}
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            (
+                torch.ones(1, 16, dtype=torch.long),
+                torch.ones(1, 16, dtype=torch.long),
+            ),
+            str(out_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["hidden"],
+            dynamic_axes={
+                "input_ids": tokens,
+                "attention_mask": tokens,
+                "hidden": tokens,
+            },
+            opset_version=ONNX_OPSET,
+        )
+
+
+# ---------- 推論 ----------
+
+
+class RuminaStyleBertVITS2OnnxWrapper(BaseTTS):
+    def __init__(
+        self,
+        model_dir: str,
+        intra_op_threads: int | None = None,
+        speaker_id: int = 0,
+    ):
+        model_dir = Path(model_dir)
+        self.hps = HyperParameters.load_from_json(model_dir / "config.json")
+        self.jp_extra = self.hps.version.endswith("JP-Extra")
+        self.sample_rate = self.hps.data.sampling_rate
+        self.speaker_id = speaker_id
+
+        # TTSModel.infer の既定（Neutral / DEFAULT_STYLE_WEIGHT）と同じスタイル
+        style_vectors = np.load(model_dir / "style_vectors.npy")
+        mean = style_vectors[0]
+        style = style_vectors[self.hps.data.style2id[DEFAULT_STYLE]]
+        self.style_vec = (mean + (style - mean) * DEFAULT_STYLE_WEIGHT)[
+            None
+        ].astype(np.float32)
+
+        onnx_dir = model_dir / "onnx"
+        onnx_dir.mkdir(exist_ok=True)
+        generator_path = onnx_dir / f"{Path(GENERATOR_FILE).stem}.onnx"
+        bert_path = onnx_dir / "bert_jp_batch.onnx"
+        if not generator_path.exists():
+            print(f"📦 ONNX へ書き出し: {generator_path}")
+            export_generator(
+                model_dir, self.hps, style_vectors.shape[1], generator_path
+            )
+        if not bert_path.exists():
+            print(f"📦 ONNX へ書き出し: {bert_path}")
+            export_bert(bert_path)
+
+        # 環境変数 SBV2_ONNX_THREADS で演算スレッド数を指定（既定は CPU 数）
+        threads = intra_op_threads or int(
+            os.getenv("SBV2_ONNX_THREADS", os.cpu_count() or 1)
+        )
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        providers = ["CPUExecutionProvider"]
+        self.generator = ort.InferenceSession(
+            str(generator_path), options, providers=providers
+        )
+        self.bert = ort.InferenceSession(
+            str(bert_path), options, providers=providers
+        )
+        self.tokenizer = bert_models.load_tokenizer(Languages.JP)
+        self.frontend = SBV2Frontend(self.hps, self.run_bert)
+        print(f"ONNX Style-BERT-VITS2 ready (intra_op_threads={threads})")
+
+    def run_bert(self, texts: list[str]) -> list[np.ndarray]:
+        """パディングして 1 回で流し、文ごとの hidden state を返す"""
+        enc = self.tokenizer(texts, return_tensors="np", padding=True)
+        mask = enc["attention_mask"].astype(np.int64)
+        (hidden,) = self.bert.run(
+            None,
+            {
+                "input_ids": enc["input_ids"].astype(np.int64),
+                "attention_mask": mask,
+            },
+        )
+        return [hidden[i, :n] for i, n in enumerate(mask.sum(axis=1))]
+
+    def text_to_inputs(self, text: str) -> dict[str, np.ndarray]:
+        """models.infer.get_text と同じ前処理で generator の入力を作る"""
+        entry = self.frontend.features(text)
+        n = len(entry.phone)
+        return {
+            "x": entry.phone[None],
+            "x_lengths": np.asarray([n], dtype=np.int64),
+            "sid": np.asarray([self.speaker_id], dtype=np.int64),
+            "tone": entry.tone[None],
+            "language": entry.language[None],
+            "bert": entry.bert()[None],
+            "style_vec": self.style_vec,
+        }
+
+    def prefetch(self, texts: list[str]):
+        self.frontend.prefetch(texts)
+
+    def infer(
+        self,
+        text: str,
+        sdp_ratio: float = DEFAULT_SDP_RATIO,
+        noise: float = DEFAULT_NOISE,
+        noise_w: float = DEFAULT_NOISEW,
+        length: float = DEFAULT_LENGTH,
+    ) -> tuple[int, np.ndarray]:
+        """TTSModel.infer と同じく改行ごとに合成し、int16 の波形を返す"""
+        scalars = {
+            "noise_scale": np.float32(noise),
+            "length_scale": np.float32(length),
+            "noise_scale_w": np.float32(noise_w),
+            "sdp_ratio": np.float32(sdp_ratio),
+        }
+        audios = []
+        for i, line in enumerate(t for t in text.split("\n") if t != ""):
+            if i:
+                audios.append(
+                    np.zeros(int(44100 * DEFAULT_SPLIT_INTERVAL), np.float32)
+                )
+            (out,) = self.generator.run(
+                None, {**self.text_to_inputs(line), **scalars}
+            )
+            audios.append(out[0, 0])
+        audio = np.concatenate(audios)
+        peak = np.abs(audio).max()
+        if peak > 0:
+            audio = audio / peak
+        return self.sample_rate, (audio * 32767).astype(np.int16)
+
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        sr, audio = self.infer(text)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, sr, format="WAV")
+        return buffer.getvalue()
+
+    @property
+    def voice_id(self) -> str:
+        return f"{self.speaker_id}:{DEFAULT_STYLE}"
+
+    @property
+    def model_name(self) -> str:
+        return "style_bert_vits2_onnx"
+
+
+# ---------- PyTorch 版との一致確認 ----------
+
+
+def check_parity(
+    model_dir: str, text: str = "こんにちは。今日はいい天気ですね。"
+) -> dict[str, float]:
+    """
+    ノイズを 0 にして（決定的な出力にして）PyTorch 版と波形を比較する。
+    返り値の snr_db が十分大きければ（目安 30 dB 以上）一致とみなす。
+    """
+    torch_model = RuminaStyleBertVITS2Wrapper(model_dir, device="cpu")
+    sr_ref, ref = torch_model.infer(text, noise=0.0, noise_w=0.0)
+    onnx_model = RuminaStyleBertVITS2OnnxWrapper(model_dir)
+    sr_out, out = onnx_model.infer(text, noise=0.0, noise_w=0.0)
+    assert sr_ref == sr_out
+
+    n = min(len(ref), len(out))
+    ref_f = ref[:n].astype(np.float64)
+    err = ref_f - out[:n].astype(np.float64)
+    snr_db = 10 * np.log10(np.sum(ref_f**2) / max(np.sum(err**2), 1e-9))
+    return {
+        "samples_torch": len(ref),
+        "samples_onnx": len(out),
+        "snr_db": float(snr_db),
+    }
+
+
+if __name__ == "__main__":
+    # python -m api.modules.tts_wrappers.style_bert_vits2_onnx <model_dir>
+    parser = argparse.ArgumentParser(description="ONNX/PyTorch 出力の一致確認")
+    parser.add_argument("model_dir")
+    parser.add_argument("--text", default="こんにちは。今日はいい天気ですね。")
+    parser.add_argument("--min-snr", type=float, default=30.0)
+    args = parser.parse_args()
+
+    result = check_parity(args.model_dir, args.text)
+    print(result)
+    ok = (
+        result["samples_torch"] == result["samples_onnx"]
+        and result["snr_db"] >= args.min_snr
+    )
+    print("✅ parity OK" if ok else "❌ parity NG")
+    sys.exit(0 if ok else 1)
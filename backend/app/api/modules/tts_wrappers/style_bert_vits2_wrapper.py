@@ -1,4 +1,3 @@
-import base64
 import io
 from pathlib import Path
 
@@ -13,14 +12,23 @@ bert_models.DEFAULT_BERT_TOKENIZER_PATHS[Languages.JP] = Path(
 )
 
 
+import numpy as np
+import torch
+from api.utils.model_registry import registry
 from style_bert_vits2.constants import (
     DEFAULT_LENGTH,
     DEFAULT_NOISE,
     DEFAULT_NOISEW,
     DEFAULT_SDP_RATIO,
+    DEFAULT_SPLIT_INTERVAL,
+    DEFAULT_STYLE,
+    DEFAULT_STYLE_WEIGHT,
     Languages,
 )
-from style_bert_vits2.tts_model import TTSModel
+from style_bert_vits2.models.hyper_parameters import HyperParameters
+from style_bert_vits2.models.infer import get_net_g
+
+from .sbv2_frontend import FrontendEntry, SBV2Frontend, torch_bert_fn
 
 
 class RuminaStyleBertVITS2Wrapper(BaseTTS):
@@ -33,35 +41,117 @@ class RuminaStyleBertVITS2Wrapper(BaseTTS):
         print(f"コンフィグパス: {config_path}")
         print(f"スタイルベクトルパス: {style_vec_path}")
 
-        self.tts_model = TTSModel(
-            model_path=model_path,
-            config_path=config_path,
-            style_vec_path=style_vec_path,
+        self.device = device
+        self.hps = HyperParameters.load_from_json(config_path)
+        self.jp_extra = self.hps.version.endswith("JP-Extra")
+        self.net_g = get_net_g(
+            model_path=str(model_path),
+            version=self.hps.version,
             device=device,
+            hps=self.hps,
         )
-        self.tts_model.load()
 
-    def generate(self, text: str, output_path: str):
-        sr, audio = self.tts_model.infer(
-            text=text,
-            language=Languages.JP,
-            speaker_id=0,
-            sdp_ratio=DEFAULT_SDP_RATIO,
-            noise=DEFAULT_NOISE,
-            noise_w=DEFAULT_NOISEW,
-            length=DEFAULT_LENGTH,
-        )
-        import soundfile as sf
+        # TTSModel.infer の既定（Neutral / DEFAULT_STYLE_WEIGHT）と同じスタイル
+        style_vectors = np.load(style_vec_path)
+        mean = style_vectors[0]
+        style = style_vectors[self.hps.data.style2id[DEFAULT_STYLE]]
+        self.style_vec = mean + (style - mean) * DEFAULT_STYLE_WEIGHT
+
+        # G2P と BERT 特徴量を文単位でキャッシュする（レプリカ間で共有）
+        self.frontend = registry.get_or_load(
+            ("sbv2_frontend", str(model_dir), device),
+            lambda: SBV2Frontend(self.hps, torch_bert_fn(device)),
+        ).model
+
+    def infer(
+        self,
+        text: str,
+        sdp_ratio: float = DEFAULT_SDP_RATIO,
+        noise: float = DEFAULT_NOISE,
+        noise_w: float = DEFAULT_NOISEW,
+        length: float = DEFAULT_LENGTH,
+    ) -> tuple[int, np.ndarray]:
+        """
+        TTSModel.infer と同じく改行ごとに合成し、int16 の波形を返す。
+        前処理（G2P・BERT）はフロントエンドのキャッシュから取る。
+        """
+        lines = [t for t in text.split("\n") if t != ""]
+        audios = []
+        with torch.no_grad():
+            for i, line in enumerate(lines):
+                if i:
+                    audios.append(
+                        np.zeros(int(44100 * DEFAULT_SPLIT_INTERVAL))
+                    )
+                audios.append(
+                    self._infer_line(
+                        self.frontend.features(line),
+                        skip_start=i != 0,
+                        skip_end=i != len(lines) - 1,
+                        sdp_ratio=sdp_ratio,
+                        noise_scale=noise,
+                        noise_scale_w=noise_w,
+                        length_scale=length,
+                    )
+                )
+        audio = np.concatenate(audios)
+        peak = np.abs(audio).max()
+        if peak > 0:
+            audio = audio / peak
+        return self.hps.data.sampling_rate, (audio * 32767).astype(np.int16)
 
+    def generate(self, text: str, output_path: str):
+        sr, audio = self.infer(text)
         sf.write(output_path, audio, sr)
         return output_path
 
-    def synthesize_to_base64(self, text: str) -> str:
-        sr, audio = self.tts_model.infer(text=text)
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        sr, audio = self.infer(text)
         buffer = io.BytesIO()
         sf.write(buffer, audio, sr, format="WAV")
-        buffer.seek(0)
-        return base64.b64encode(buffer.read()).decode("utf-8")
+        return buffer.getvalue()
+
+    def prefetch(self, texts: list[str]):
+        self.frontend.prefetch(texts)
+
+    def _infer_line(
+        self,
+        entry: FrontendEntry,
+        skip_start: bool,
+        skip_end: bool,
+        **scales: float,
+    ) -> np.ndarray:
+        """models.infer.infer の get_text 以降と同じ処理（1 行分）"""
+        # 行の連結部分は先頭 3 / 末尾 2 音素を落としてつなぐ
+        cut = slice(3 if skip_start else None, -2 if skip_end else None)
+        phone = torch.from_numpy(entry.phone[cut])
+        tone = torch.from_numpy(entry.tone[cut])
+        language = torch.from_numpy(entry.language[cut])
+        bert = torch.from_numpy(entry.bert()[:, cut])
+
+        device = self.device
+        args = [
+            phone.to(device).unsqueeze(0),
+            torch.LongTensor([len(phone)]).to(device),
+            torch.LongTensor([0]).to(device),
+            tone.to(device).unsqueeze(0),
+            language.to(device).unsqueeze(0),
+        ]
+        ja_bert = bert.to(device).unsqueeze(0)
+        if self.jp_extra:
+            args.append(ja_bert)
+        else:
+            # 非 JP-Extra は zh/ja/en の 3 系統。日本語のみなので他は 0
+            zeros = torch.zeros_like(ja_bert)
+            args += [zeros, ja_bert, zeros]
+        style_vec = torch.from_numpy(self.style_vec).to(device).unsqueeze(0)
+        output = self.net_g.infer(*args, style_vec=style_vec, **scales)
+        return output[0][0, 0].data.cpu().float().numpy()
+
+    @property
+    def voice_id(self) -> str:
+        # infer() の既定値（speaker 0 / Neutral スタイル）で合成している
+        return f"0:{DEFAULT_STYLE}"
 
     @property
     def model_name(self) -> str:
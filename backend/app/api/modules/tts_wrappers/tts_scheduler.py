@@ -0,0 +1,338 @@
+# ストリーミング応答の文ごとの TTS を順序付き・同時数制限付きで実行するスケジューラ。
+#
+#   • セッション内: seq の小さい文（特に seq 0）から優先して合成し、
+#     合成が前後しても seq 順にクライアントへ送る。
+#   • モデル単位: 全セッション共通のゲートで同時合成数を制限する。
+#     ゲート待ちも seq 0 を優先するので、新しいターンの最初の音声が先に出る。
+#   • 同じターンの文が複数溜まっていれば、合成前に tts.prefetch() で
+#     テキスト前処理（BERT 等）をまとめて実行させる。
+#   • stream=True なら tts.stream_bytes() の途中結果を、
+#     その文が送信順の先頭になった時点から届いた順に送る。
+#   • ターンの cancel_event が立ったら、待機中のジョブは合成せずに捨てる。
+#     ストリーミング中の合成は打ち切り（HTTP 等の接続も閉じる）、
+#     止められないスレッドの合成は結果を破棄する。
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from .base_tts import BaseTTS
+
+
+@dataclass(order=True)
+class TTSJob:
+    priority: tuple[int, int]
+    turn_id: str = field(compare=False)
+    turn: int = field(compare=False)
+    seq: int = field(compare=False)
+    text: str = field(compare=False)
+    cancel_event: asyncio.Event = field(compare=False)
+    enqueued: float = field(compare=False, default_factory=time.monotonic)
+
+
+@dataclass
+class _SeqAudio:
+    """1 文分の合成結果（ストリーミング時は途中まで）"""
+
+    job: TTSJob
+    chunks: list[bytes] = field(default_factory=list)
+    sent: int = 0
+    done: bool = False
+
+
+@dataclass
+class _TurnState:
+    next_seq: int = 0
+    last_seq: int | None = None
+    # seq → 合成結果。失敗・破棄した文は chunks が空のまま done になる
+    results: dict[int, _SeqAudio] = field(default_factory=dict)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # 投入済みでまだ prefetch に渡していない文
+    pending: list[str] = field(default_factory=list)
+
+
+class ModelGate:
+    """モデルごとの同時合成数を制限する優先度付きセマフォ"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._in_use = 0
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+        self.acquired = 0
+        self.total_wait_ms = 0.0
+
+    async def acquire(self, priority: int):
+        start = time.monotonic()
+        if self._in_use < self.limit and not self._waiters:
+            self._in_use += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._waiters, (priority, next(self._counter), future)
+            )
+            try:
+                await future
+            except asyncio.CancelledError:
+                # 枠を譲られた直後にキャンセルされた場合は返却する
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+        self.acquired += 1
+        self.total_wait_ms += (time.monotonic() - start) * 1000
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 枠はそのまま次の待機者へ引き継ぐ
+                future.set_result(None)
+                return
+        self._in_use -= 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "model": self.name,
+            "limit": self.limit,
+            "in_use": self._in_use,
+            "waiting": sum(1 for *_, f in self._waiters if not f.done()),
+            "acquired": self.acquired,
+            "avg_wait_ms": (
+                self.total_wait_ms / self.acquired if self.acquired else 0.0
+            ),
+        }
+
+
+_gates: dict[str, ModelGate] = {}
+
+
+def get_model_gate(tts: BaseTTS) -> ModelGate:
+    """
+    TTS モデルごとのゲートを返す。
+    上限は TTS_MODEL_CONCURRENCY（未設定ならモデルの max_concurrency）。
+    """
+    gate = _gates.get(tts.model_name)
+    if gate is None:
+        limit = int(os.getenv("TTS_MODEL_CONCURRENCY", tts.max_concurrency))
+        gate = ModelGate(tts.model_name, max(1, limit))
+        _gates[tts.model_name] = gate
+    return gate
+
+
+def tts_scheduler_stats() -> list[dict[str, Any]]:
+    return [g.stats() for g in _gates.values()]
+
+
+# emit(job, audio, final)。final はその文の最後の音声であることを示す
+EmitFn = Callable[[TTSJob, bytes, bool], Awaitable[None]]
+
+
+class TTSScheduler:
+    """
+    1 セッション分の TTS キュー。
+    submit() で文を投入し、合成できた音声は emit(job, audio, final) で
+    seq 順に渡す。stream=False なら 1 文 1 回（final=True）にまとめて渡す。
+    """
+
+    def __init__(
+        self,
+        tts: BaseTTS,
+        emit: EmitFn,
+        max_concurrency: int | None = None,
+        stream: bool = False,
+    ):
+        self.tts = tts
+        self.emit = emit
+        self.stream = stream
+        self.gate = get_model_gate(tts)
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("TTS_SESSION_CONCURRENCY", "2")
+        )
+        self._queue: asyncio.PriorityQueue[TTSJob] = asyncio.PriorityQueue()
+        self._turns: dict[str, _TurnState] = {}
+        self._counter = itertools.count()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self):
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.max_concurrency)
+        ]
+
+    async def close(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._turns.clear()
+
+    def submit(
+        self,
+        turn_id: str,
+        turn: int,
+        seq: int,
+        text: str,
+        cancel_event: asyncio.Event,
+    ):
+        """seq は 0 から連番で投入する"""
+        self._turns.setdefault(turn_id, _TurnState()).pending.append(text)
+        job = TTSJob(
+            priority=(seq, next(self._counter)),
+            turn_id=turn_id,
+            turn=turn,
+            seq=seq,
+            text=text,
+            cancel_event=cancel_event,
+        )
+        self._queue.put_nowait(job)
+
+    def end_turn(self, turn_id: str, n_seq: int):
+        """ターンの文がすべて投入されたことを通知する（状態の後片付け用）"""
+        state = self._turns.get(turn_id)
+        if state is None:
+            return
+        state.last_seq = n_seq - 1
+        if state.next_seq > state.last_seq:
+            del self._turns[turn_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                print("TTS scheduler error:", e)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: TTSJob):
+        state = self._turns.get(job.turn_id)
+        if state is None:
+            return
+        entry = state.results.setdefault(job.seq, _SeqAudio(job))
+        try:
+            async with contextlib.aclosing(self._synthesize(job)) as chunks:
+                async for chunk in chunks:
+                    entry.chunks.append(chunk)
+                    if self.stream:
+                        await self._flush(job.turn_id, state)
+        finally:
+            entry.done = True
+            await self._flush(job.turn_id, state)
+
+    async def _synthesize(self, job: TTSJob) -> AsyncIterator[bytes]:
+        if job.cancel_event.is_set():
+            return
+
+        # キャッシュ済みならゲートを通さずに返す
+        audio = self.tts.cached_bytes(job.text)
+        if audio is not None:
+            yield audio
+            return
+
+        if not await self._acquire(job):
+            return
+        try:
+            await self._prefetch(job)
+            source = self.tts.stream_bytes(job.text)
+            async for chunk in _until_cancelled(source, job.cancel_event):
+                yield chunk
+        except Exception as e:
+            print("TTS chunk failed:", e)
+        finally:
+            self.gate.release()
+
+    async def _prefetch(self, job: TTSJob):
+        """溜まっている同じターンの文をまとめて前処理させる"""
+        state = self._turns.get(job.turn_id)
+        if state is None or len(state.pending) < 2:
+            return
+        texts, state.pending = state.pending, []
+        try:
+            await asyncio.to_thread(self.tts.prefetch, texts)
+        except Exception as e:
+            print("TTS prefetch failed:", e)
+
+    async def _acquire(self, job: TTSJob) -> bool:
+        """ゲートの枠を取る。待っている間にキャンセルされたら False"""
+        acquire = asyncio.create_task(self.gate.acquire(job.seq))
+        cancel = asyncio.create_task(job.cancel_event.wait())
+        await asyncio.wait(
+            {acquire, cancel}, return_when=asyncio.FIRST_COMPLETED
+        )
+        cancel.cancel()
+        if acquire.done() and not job.cancel_event.is_set():
+            return True
+        if acquire.done():
+            self.gate.release()
+        else:
+            acquire.cancel()
+            try:
+                await acquire
+            except asyncio.CancelledError:
+                pass
+        return False
+
+    async def _flush(self, turn_id: str, state: _TurnState):
+        """先頭の文から順に、送れる分の音声を送る"""
+        async with state.lock:
+            while (entry := state.results.get(state.next_seq)) is not None:
+                if self.stream or entry.done:
+                    await self._emit_pending(entry)
+                if not entry.done:
+                    return
+                del state.results[state.next_seq]
+                state.next_seq += 1
+            if state.last_seq is not None and state.next_seq > state.last_seq:
+                self._turns.pop(turn_id, None)
+
+    async def _emit_pending(self, entry: _SeqAudio):
+        """
+        未送信のチャンクを送る。final を付けられるよう、合成中は最後の
+        1 チャンクを手元に残す（stream=False では全体を 1 回で送る）。
+        """
+        if entry.job.cancel_event.is_set():
+            entry.sent = len(entry.chunks)
+            return
+        if not self.stream:
+            if entry.chunks:
+                await self.emit(entry.job, b"".join(entry.chunks), True)
+            entry.sent = len(entry.chunks)
+            return
+        end = len(entry.chunks) if entry.done else len(entry.chunks) - 1
+        while entry.sent < end:
+            chunk = entry.chunks[entry.sent]
+            entry.sent += 1
+            final = entry.done and entry.sent == len(entry.chunks)
+            await self.emit(entry.job, chunk, final)
+
+
+async def _until_cancelled(
+    source: AsyncIterator[bytes], cancel_event: asyncio.Event
+) -> AsyncIterator[bytes]:
+    """cancel_event が立った時点で source の待機を打ち切って閉じる"""
+    cancelled = asyncio.ensure_future(cancel_event.wait())
+    try:
+        while True:
+            step = asyncio.ensure_future(source.__anext__())
+            await asyncio.wait(
+                {step, cancelled}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not step.done():
+                step.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await step
+                return
+            try:
+                chunk = step.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        cancelled.cancel()
+        await source.aclose()
@@ -1,3 +1,11 @@
+from api.modules.transcribers.batch_scheduler import batch_scheduler_stats
+from api.modules.tts_wrappers.cached_tts import tts_cache_stats
+from api.modules.tts_wrappers.replica_pool import tts_pool_stats
+from api.modules.tts_wrappers.sbv2_frontend import frontend_cache_stats
+from api.modules.tts_wrappers.tts_scheduler import tts_scheduler_stats
+from api.utils.image_preprocess import image_cache_stats
+from api.utils.inference_executor import get_stt_executor
+from api.utils.model_registry import registry
 from db.session import get_pool
 from fastapi import APIRouter
 
@@ -28,3 +36,17 @@ async def list_tables():
         {"schema": row["table_schema"], "name": row["table_name"]}
         for row in rows
     ]
+
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "stt_executor": get_stt_executor().stats(),
+        "stt_batching": batch_scheduler_stats(),
+        "tts_cache": tts_cache_stats(),
+        "tts_frontend": frontend_cache_stats(),
+        "tts_scheduler": tts_scheduler_stats(),
+        "tts_pools": tts_pool_stats(),
+        "vlm_images": image_cache_stats(),
+        "loaded_models": registry.loaded_keys(),
+    }
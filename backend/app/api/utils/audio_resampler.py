@@ -0,0 +1,197 @@
+# サーバ側での PCM 形式変換とリサンプリング。
+# クライアントは 48 kHz / 44.1 kHz、float32 / int16、モノラル / ステレオの
+# いずれでも送信でき、ここでモデル入力（16 kHz mono int16）へ揃える。
+from dataclasses import asdict, dataclass
+from math import gcd
+from typing import Any, Literal
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from numpy.typing import NDArray
+
+SampleDType = Literal["int16", "float32"]
+SUPPORTED_SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+
+
+class PolyphaseResampler:
+    """
+    有理数比 (up/down) のポリフェーズ FIR リサンプラ。
+    フィルタ履歴と出力位相をインスタンスに保持するので、
+    チャンクごとに呼び出しても境界で不連続にならない。
+    """
+
+    def __init__(
+        self,
+        src_rate: int,
+        dst_rate: int,
+        taps_per_phase: int = 24,
+        kaiser_beta: float = 8.0,
+        rolloff: float = 0.94,
+    ):
+        g = gcd(src_rate, dst_rate)
+        self.up = dst_rate // g
+        self.down = src_rate // g
+        self.taps = taps_per_phase
+
+        # アップサンプル後のレートで窓関数法のローパスを設計する
+        n_taps = taps_per_phase * self.up
+        cutoff = 0.5 * min(1 / self.up, 1 / self.down) * rolloff
+        n = np.arange(n_taps) - (n_taps - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n)
+        h *= np.kaiser(n_taps, kaiser_beta) * self.up
+        # phases[p, k] = h[p + k*up] を、畳み込みしやすいよう k 方向に反転して保持
+        self._phases = (
+            h.reshape(taps_per_phase, self.up).T[:, ::-1].astype(np.float32)
+        )
+
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._base = -(taps_per_phase - 1)  # _history[0] の入力インデックス
+        self._next = 0  # 次の出力のアップサンプル後インデックス
+
+    def process(self, x: NDArray[np.float32]) -> NDArray[np.float32]:
+        buf = np.concatenate([self._history, x])
+        last = self._base + len(buf) - 1  # 利用可能な最後の入力インデックス
+
+        positions = np.arange(self._next, (last + 1) * self.up, self.down)
+        if len(positions):
+            src = positions // self.up
+            phase = positions % self.up
+            windows = sliding_window_view(buf, self.taps)
+            rows = windows[src - self._base - (self.taps - 1)]
+            out = np.einsum("ij,ij->i", rows, self._phases[phase])
+            self._next = int(positions[-1]) + self.down
+        else:
+            out = np.empty(0, dtype=np.float32)
+
+        keep = self.taps - 1
+        self._history = buf[len(buf) - keep :].copy()
+        self._base = last + 1 - keep
+        return out.astype(np.float32, copy=False)
+
+    @property
+    def delay(self) -> float:
+        """フィルタの群遅延（出力サンプル数）"""
+        return (self.taps * self.up - 1) / 2 / self.down
+
+
+def resample(
+    x: NDArray[np.float32], src_rate: int, dst_rate: int
+) -> NDArray[np.float32]:
+    """1 回分の信号をまとめて変換する（群遅延を補正し長さを揃える）。"""
+    if src_rate == dst_rate:
+        return x
+    resampler = PolyphaseResampler(src_rate, dst_rate)
+    out = np.concatenate(
+        [
+            resampler.process(x),
+            resampler.process(np.zeros(resampler.taps, dtype=np.float32)),
+        ]
+    )
+    start = int(round(resampler.delay))
+    n_out = -(-len(x) * resampler.up // resampler.down)
+    return out[start : start + n_out]
+
+
+@dataclass(frozen=True)
+class PcmFormat:
+    sample_rate: int = 16000
+    dtype: SampleDType = "int16"
+    channels: int = 1
+
+    @classmethod
+    def from_spec(cls, spec: dict[str, Any] | None) -> "PcmFormat":
+        """init メッセージの "audio_format" から生成する（省略時は 16k/int16/mono）。"""
+        if not spec:
+            return cls()
+        if not isinstance(spec, dict):
+            raise ValueError(f"Invalid audio_format: {spec!r}")
+        try:
+            fmt = cls(
+                sample_rate=int(spec.get("sample_rate", 16000)),
+                dtype=spec.get("dtype", "int16"),
+                channels=int(spec.get("channels", 1)),
+            )
+        except TypeError as e:
+            raise ValueError(f"Invalid audio_format: {e}") from e
+        if fmt.sample_rate not in SUPPORTED_SAMPLE_RATES:
+            raise ValueError(f"Unsupported sample_rate: {fmt.sample_rate}")
+        if fmt.dtype not in ("int16", "float32"):
+            raise ValueError(f"Unsupported dtype: {fmt.dtype}")
+        if fmt.channels not in (1, 2):
+            raise ValueError(f"Unsupported channels: {fmt.channels}")
+        return fmt
+
+    @classmethod
+    def negotiate(
+        cls, spec: dict[str, Any] | None
+    ) -> tuple["PcmFormat", str | None]:
+        """
+        from_spec と同じだが、非対応の形式ならセッションを落とさず
+        既定形式（16k/int16/mono）とエラー内容を返す（init_ack で通知する）。
+        """
+        try:
+            return cls.from_spec(spec), None
+        except ValueError as e:
+            print("⚠️ 非対応の audio_format（既定形式で受信）:", e)
+            return cls(), str(e)
+
+    def describe(self, error: str | None = None) -> dict[str, Any]:
+        """init_ack に載せる実際の受信形式"""
+        described: dict[str, Any] = asdict(self)
+        if error is not None:
+            described["error"] = error
+        return described
+
+    @property
+    def frame_bytes(self) -> int:
+        return (2 if self.dtype == "int16" else 4) * self.channels
+
+
+class PcmConverter:
+    """
+    受信 PCM をモデル入力形式（mono int16 / target_rate）へ逐次変換する。
+    形式が一致していれば何もせずに入力をそのまま返す。
+    """
+
+    def __init__(self, src: PcmFormat, target_rate: int = 16000):
+        self.src = src
+        self.target_rate = target_rate
+        self.passthrough = src == PcmFormat(sample_rate=target_rate)
+        self._resampler = (
+            PolyphaseResampler(src.sample_rate, target_rate)
+            if src.sample_rate != target_rate
+            else None
+        )
+        # チャンク境界で割り切れなかったバイト（サンプル/チャンネルの端数）
+        self._remainder = b""
+
+    def convert(
+        self, data: bytes | memoryview
+    ) -> bytes | memoryview | NDArray[np.int16]:
+        if self.passthrough:
+            return data
+
+        if self._remainder:
+            data = self._remainder + bytes(data)
+        usable = len(data) // self.src.frame_bytes * self.src.frame_bytes
+        self._remainder = bytes(data[usable:])
+
+        samples = np.frombuffer(
+            data[:usable],
+            dtype=np.int16 if self.src.dtype == "int16" else np.float32,
+        ).reshape(-1, self.src.channels)
+
+        # ダウンミックス（float32 化を兼ねる）
+        if self.src.channels == 1:
+            mono = samples[:, 0].astype(np.float32)
+        else:
+            mono = samples.mean(axis=1, dtype=np.float32)
+        if self.src.dtype == "int16":
+            mono *= 1.0 / 32768.0
+
+        if self._resampler is not None:
+            mono = self._resampler.process(mono)
+
+        np.clip(mono, -1.0, 32767 / 32768, out=mono)
+        mono *= 32768.0
+        return np.rint(mono).astype(np.int16)
@@ -0,0 +1,182 @@
+# 合成音声をクライアントへ送る経路とコーデックの交渉。
+#
+# init メッセージで指定する（省略時は従来どおり JSON + base64、TTS の出力形式のまま）:
+#   "audio_transport": "json" | "binary"
+#   "audio_codec":     "source" | "opus" | "mp3" | "wav" | "pcm"
+#   "audio_pcm_rate":  pcm 選択時のサンプルレート（既定 24000）
+#   "tts_stream":      true で合成途中の音声も届いた順に送る
+#                      （TTS がストリーミング対応で、変換不要な codec の場合のみ）
+#
+# binary の場合は JSON メッセージ（本文・id・seq 等）の直後に、
+# binary_framing 形式のフレーム（kind=FRAME_AUDIO, turn/seq 付き）で音声本体を送る。
+import asyncio
+import base64
+import io
+from dataclasses import dataclass
+from typing import Any, Literal
+
+import numpy as np
+import soundfile as sf
+from api.utils.audio_resampler import SUPPORTED_SAMPLE_RATES, resample
+from api.utils.binary_framing import (
+    AUDIO_MIME,
+    FMT_MP3,
+    FMT_OGG_OPUS,
+    FMT_PCM16,
+    FMT_WAV,
+    FRAME_AUDIO,
+    FrameHeader,
+    pack_frame,
+)
+from fastapi import WebSocket
+
+TransportMode = Literal["json", "binary"]
+AudioCodec = Literal["source", "opus", "mp3", "wav", "pcm"]
+
+_SOURCE_FMT = {"wav": FMT_WAV, "mp3": FMT_MP3, "ogg": FMT_OGG_OPUS}
+_CODEC_FMT = {
+    "opus": FMT_OGG_OPUS,
+    "mp3": FMT_MP3,
+    "wav": FMT_WAV,
+    "pcm": FMT_PCM16,
+}
+# libopus が受け付けるサンプルレート
+_OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+@dataclass(frozen=True)
+class AudioTransport:
+    mode: TransportMode = "json"
+    codec: AudioCodec = "source"
+    pcm_rate: int = 24000
+
+    @classmethod
+    def from_spec(cls, init: dict[str, Any] | None) -> "AudioTransport":
+        """init メッセージから生成する。未知・不正な値は ValueError。"""
+        if not init:
+            return cls()
+        try:
+            transport = cls(
+                mode=init.get("audio_transport", "json"),
+                codec=init.get("audio_codec", "source"),
+                pcm_rate=int(init.get("audio_pcm_rate", 24000)),
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid audio_pcm_rate: {e}") from e
+        if transport.mode not in ("json", "binary"):
+            raise ValueError(f"Unsupported audio_transport: {transport.mode}")
+        if transport.codec not in ("source", *_CODEC_FMT):
+            raise ValueError(f"Unsupported audio_codec: {transport.codec}")
+        if transport.pcm_rate not in SUPPORTED_SAMPLE_RATES:
+            raise ValueError(
+                f"Unsupported audio_pcm_rate: {transport.pcm_rate}"
+            )
+        return transport
+
+    @classmethod
+    def negotiate(
+        cls, init: dict[str, Any] | None
+    ) -> tuple["AudioTransport", str | None]:
+        """
+        from_spec と同じだが、未知の値ならセッションを落とさず
+        既定（json / source / 24000）とエラー内容を返す（init_ack で通知する）。
+        """
+        try:
+            return cls.from_spec(init), None
+        except ValueError as e:
+            print("⚠️ 非対応の音声送信設定（既定で送信）:", e)
+            return cls(), str(e)
+
+    def describe(self, error: str | None = None) -> dict[str, Any]:
+        """init_ack に載せる交渉結果"""
+        described: dict[str, Any] = {
+            "transport": self.mode,
+            "codec": self.codec,
+            "pcm_rate": self.pcm_rate if self.codec == "pcm" else None,
+        }
+        if error is not None:
+            described["error"] = error
+        return described
+
+    def passthrough(self, source_format: str) -> bool:
+        """TTS 出力をそのまま送れるか（途中までの音声も送れるか）"""
+        return self.codec == "source" or (
+            _SOURCE_FMT.get(source_format) == _CODEC_FMT[self.codec]
+        )
+
+    async def encode(
+        self, audio: bytes, source_format: str
+    ) -> tuple[int, bytes]:
+        """TTS 出力を交渉済みコーデックへ変換する（重い処理はワーカースレッドで）"""
+        if self.passthrough(source_format):
+            return _SOURCE_FMT.get(source_format, FMT_WAV), audio
+        payload = await asyncio.to_thread(
+            transcode, audio, self.codec, self.pcm_rate
+        )
+        return _CODEC_FMT[self.codec], payload
+
+    async def send(
+        self,
+        ws: WebSocket,
+        message: dict[str, Any],
+        audio: bytes,
+        source_format: str,
+        turn: int = 0,
+        seq: int = 0,
+        flags: int = 0,
+    ):
+        """
+        message に音声を添えて送る。
+        json: message["audio_base64"] に埋め込む。
+        binary: message["audio"] にフレーム情報を入れ、直後にバイナリで送る。
+        """
+        fmt, payload = await self.encode(audio, source_format)
+        if self.mode == "json":
+            await ws.send_json(
+                {
+                    **message,
+                    "audio_base64": base64.b64encode(payload).decode("ascii"),
+                    "audio_mime": AUDIO_MIME[fmt],
+                }
+            )
+            return
+
+        header = FrameHeader(FRAME_AUDIO, fmt, flags, seq=seq, turn=turn)
+        await ws.send_json(
+            {
+                **message,
+                "audio": {
+                    "binary": True,
+                    "mime": AUDIO_MIME[fmt],
+                    "turn": header.turn,
+                    "seq": header.seq,
+                    "flags": header.flags,
+                    "bytes": len(payload),
+                },
+            }
+        )
+        await ws.send_bytes(pack_frame(header, payload))
+
+
+def transcode(audio: bytes, codec: AudioCodec, pcm_rate: int) -> bytes:
+    """WAV/MP3 等の音声バイナリを codec 形式へ変換する（同期・CPU バウンド）"""
+    samples, sr = sf.read(io.BytesIO(audio), dtype="float32")
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1, dtype=np.float32)
+
+    if codec == "pcm":
+        samples = resample(samples, sr, pcm_rate)
+        np.clip(samples, -1.0, 32767 / 32768, out=samples)
+        return np.rint(samples * 32768.0).astype("<i2").tobytes()
+
+    buffer = io.BytesIO()
+    if codec == "opus":
+        # Kokoro(22.05k) / Style-BERT-VITS2(44.1k) は Opus 非対応レートなので 48k へ
+        if sr not in _OPUS_RATES:
+            samples, sr = resample(samples, sr, 48000), 48000
+        sf.write(buffer, samples, sr, format="OGG", subtype="OPUS")
+    elif codec == "mp3":
+        sf.write(buffer, samples, sr, format="MP3", subtype="MPEG_LAYER_III")
+    else:
+        sf.write(buffer, samples, sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
@@ -0,0 +1,76 @@
+# WebSocket のバイナリフレーム形式。
+# 先頭 10 バイトの固定ヘッダ + ペイロード（生 PCM や画像・合成音声のバイト列）。
+#
+#   0      1      2       3         4..5      6..9
+#   kind   fmt    flags   reserved  seq(u16)  turn(u32)   (ネットワークバイトオーダ)
+#
+# JSON の制御メッセージはそのまま併用し、バイナリは接続時の
+# init メッセージ（"framing": "binary"）で有効化する。
+# サーバ → クライアントの合成音声は "audio_transport": "binary" で有効化する
+# （api/utils/audio_transport.py）。
+import struct
+from dataclasses import dataclass
+
+# ---- kind ----
+FRAME_AUDIO = 0x01
+FRAME_IMAGE = 0x02
+
+# ---- fmt ----
+FMT_PCM16 = 0x01
+FMT_WAV = 0x02
+FMT_MP3 = 0x03
+FMT_OGG_OPUS = 0x04
+FMT_JPEG = 0x10
+FMT_PNG = 0x11
+FMT_WEBP = 0x12
+
+IMAGE_MIME = {
+    FMT_JPEG: "image/jpeg",
+    FMT_PNG: "image/png",
+    FMT_WEBP: "image/webp",
+}
+
+# ---- flags ----
+FLAG_FILLER = 0x01  # 本応答の前に流すフィラー音声
+FLAG_PARTIAL = 0x02  # 同じ seq の音声が後に続く（ストリーミング合成の途中）
+
+AUDIO_MIME = {
+    FMT_PCM16: "audio/pcm",
+    FMT_WAV: "audio/wav",
+    FMT_MP3: "audio/mpeg",
+    FMT_OGG_OPUS: "audio/ogg; codecs=opus",
+}
+
+_HEADER = struct.Struct("!BBBxHI")
+HEADER_SIZE = _HEADER.size
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    kind: int
+    fmt: int
+    flags: int = 0
+    seq: int = 0
+    turn: int = 0
+
+
+def parse_frame(data: bytes) -> tuple[FrameHeader, memoryview]:
+    """ヘッダを解釈し、ペイロードはコピーせずに memoryview で返す。"""
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"frame too short: {len(data)} bytes")
+    header = FrameHeader(*_HEADER.unpack_from(data))
+    return header, memoryview(data)[HEADER_SIZE:]
+
+
+def pack_header(header: FrameHeader) -> bytes:
+    return _HEADER.pack(
+        header.kind,
+        header.fmt,
+        header.flags,
+        header.seq & 0xFFFF,
+        header.turn & 0xFFFFFFFF,
+    )
+
+
+def pack_frame(header: FrameHeader, payload: bytes) -> bytes:
+    return pack_header(header) + payload
@@ -0,0 +1,139 @@
+# セッションごとの会話履歴。
+# トークン数（get_tokenizer で計数）の予算内に収まる直近のターンだけを
+# プロンプトに載せ、あふれた古いターンは任意でバックグラウンド要約にまとめる。
+# 履歴には完了したターン（ユーザー発話 + 応答）だけを入れるので、
+# 今回のユーザー発話がプロンプト内で重複することはない。
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from api.modules.response_generation.vlm.tokenizer import get_tokenizer
+from services.openai_chat import summarize_conversation
+
+# (これまでの要約, 要約に追加するメッセージ) → 新しい要約
+Summarizer = Callable[[str | None, list[dict[str, str]]], Awaitable[str]]
+
+
+@dataclass(frozen=True)
+class _Message:
+    role: str
+    content: str
+    tokens: int
+
+
+class ConversationStore:
+    def __init__(
+        self,
+        model_name: str,
+        max_tokens: int | None = None,
+        summarize: Summarizer | None = None,
+    ):
+        """
+        :param model_name: トークン数を数える tokenizer のモデル名
+        :param max_tokens: 履歴（要約を含む）のトークン予算
+            （既定は CONVERSATION_MAX_TOKENS、未設定なら 1500）
+        :param summarize: あふれたターンを要約する関数（None なら捨てる）
+        """
+        self._tokenize = get_tokenizer(model_name)
+        self.max_tokens = max_tokens or int(
+            os.getenv("CONVERSATION_MAX_TOKENS", "1500")
+        )
+        self.summarize = summarize
+        self.summary: str | None = None
+        self._summary_tokens = 0
+        self._messages: list[_Message] = []
+        self._summary_task: asyncio.Task | None = None
+
+    def messages(self) -> list[dict[str, str]]:
+        """プロンプトに載せる履歴（今回のユーザー発話は含まない）"""
+        out = []
+        if self.summary:
+            out.append(
+                {
+                    "role": "system",
+                    "content": f"これまでの会話の要約: {self.summary}",
+                }
+            )
+        out.extend(
+            {"role": m.role, "content": m.content}
+            for m in self._messages[self._window_start() :]
+        )
+        return out
+
+    def add_turn(self, user_text: str, assistant_text: str | None):
+        """完了したターンを追加する（応答が空ならユーザー発話だけ）"""
+        for role, text in (("user", user_text), ("assistant", assistant_text)):
+            if text:
+                self._messages.append(
+                    _Message(role, text, len(self._tokenize(text)))
+                )
+        self._compact()
+
+    @property
+    def prompt_tokens(self) -> int:
+        """messages() のおおよそのトークン数"""
+        start = self._window_start()
+        return self._summary_tokens + sum(
+            m.tokens for m in self._messages[start:]
+        )
+
+    async def close(self):
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+
+    # ---------- 内部処理 ----------
+
+    def _window_start(self) -> int:
+        """予算に収まる直近メッセージの開始位置"""
+        budget = self.max_tokens - self._summary_tokens
+        start = len(self._messages)
+        while start > 0 and self._messages[start - 1].tokens <= budget:
+            budget -= self._messages[start - 1].tokens
+            start -= 1
+        # 応答だけが先頭に残らないよう、ユーザー発話から始める
+        while start < len(self._messages) and (
+            self._messages[start].role != "user"
+        ):
+            start += 1
+        return start
+
+    def _compact(self):
+        """予算からあふれたメッセージを要約に回す（要約しないなら捨てる）"""
+        n = self._window_start()
+        if n == 0:
+            return
+        if self.summarize is None:
+            del self._messages[:n]
+            return
+        if self._summary_task is None or self._summary_task.done():
+            self._summary_task = asyncio.create_task(self._fold(n))
+
+    async def _fold(self, n: int):
+        """先頭 n 件を要約に取り込む（追加は末尾だけなので n 件は不変）"""
+        overflow = [
+            {"role": m.role, "content": m.content} for m in self._messages[:n]
+        ]
+        try:
+            summary = await self.summarize(self.summary, overflow)
+        except Exception as e:
+            # 失敗しても履歴は伸ばさない（その分は要約されずに消える）
+            print("⚠️ 会話の要約に失敗:", e)
+        else:
+            self.summary = summary
+            self._summary_tokens = len(self._tokenize(summary))
+        del self._messages[:n]
+        # 要約中に追加されたターンや要約自体の増加であふれた分を処理する
+        self._summary_task = None
+        self._compact()
+
+
+def new_conversation(model_name: str) -> ConversationStore:
+    """
+    環境変数の設定で履歴を作る。
+    CONVERSATION_SUMMARY=1 で、あふれたターンを要約して残す。
+    """
+    summarize = None
+    if os.getenv("CONVERSATION_SUMMARY", "0") == "1":
+        summarize = summarize_conversation
+    return ConversationStore(model_name, summarize=summarize)
@@ -0,0 +1,264 @@
+# VLM へ送る前の画像前処理。
+# クライアントのフレームは Web カメラの解像度のまま（形式も JPEG/PNG/WebP が
+# 混在）届くので、1 回だけデコードしてモデルごとの目標サイズへ縮小し、
+# 品質を指定した JPEG / WebP に再エンコードして正しい MIME の data URL にする。
+# 同じフレームは何度も送られる（発話ごとに最新画像を添付する）ため、
+# 結果はフレームのハッシュでキャッシュする。ImageStore の画像は
+# 生バイト列と sha256 を持っているので、Base64 を経由せずそのまま使う。
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any
+
+from api.utils.image_store import StoredImage
+from PIL import Image, ImageOps
+
+# OpenAI の detail="low" は 512px 四方に縮小して固定トークンで処理される
+_LOW_DETAIL_MAX_SIDE = 512
+
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+_PIL_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    # 長辺の上限（px）
+    max_side: int = 768
+    # OpenAI の detail（"low" / "high" / "auto"）
+    detail: str = "auto"
+    # 再エンコード形式（"jpeg" / "webp"）
+    format: str = "jpeg"
+    quality: int = 80
+
+    @property
+    def signature(self) -> str:
+        """キャッシュキー用の設定文字列"""
+        return (
+            f"side={self.max_side},detail={self.detail},"
+            f"fmt={self.format},q={self.quality}"
+        )
+
+
+# モデルごとの目標解像度・detail。
+# high では短辺 768px 以下に縮小された上で 512px タイル単位で課金されるため、
+# 長辺 768px に収めると 16:9 のフレームで 2 タイルになる。
+IMAGE_PROFILES: dict[str, ImageProfile] = {
+    "gpt-4o": ImageProfile(max_side=768, detail="high"),
+    "gpt-4o-mini": ImageProfile(max_side=768, detail="high"),
+}
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    data_url: str
+    detail: str
+    width: int
+    height: int
+    nbytes: int
+
+    def content_block(self) -> dict[str, Any]:
+        """chat.completions の image_url コンテンツ"""
+        return {
+            "type": "image_url",
+            "image_url": {"url": self.data_url, "detail": self.detail},
+        }
+
+
+def image_profile(model_name: str) -> ImageProfile:
+    """
+    モデルのプロファイルに環境変数の上書きをかけて返す。
+    VLM_IMAGE_MAX_SIDE / VLM_IMAGE_DETAIL / VLM_IMAGE_FORMAT /
+    VLM_IMAGE_QUALITY
+    """
+    profile = IMAGE_PROFILES.get(model_name, ImageProfile())
+    overrides: dict[str, Any] = {}
+    if side := os.getenv("VLM_IMAGE_MAX_SIDE"):
+        overrides["max_side"] = int(side)
+    if detail := os.getenv("VLM_IMAGE_DETAIL"):
+        overrides["detail"] = detail
+    if fmt := os.getenv("VLM_IMAGE_FORMAT"):
+        overrides["format"] = fmt.lower()
+    if quality := os.getenv("VLM_IMAGE_QUALITY"):
+        overrides["quality"] = int(quality)
+    profile = replace(profile, **overrides)
+    if profile.format not in _FORMATS:
+        raise ValueError(f"unsupported image format: {profile.format}")
+    if profile.detail == "low":
+        # low では API 側で 512px に縮小されるので、それ以上は送らない
+        profile = replace(
+            profile, max_side=min(profile.max_side, _LOW_DETAIL_MAX_SIDE)
+        )
+    return profile
+
+
+def split_data_url(image_b64: str) -> tuple[str | None, str]:
+    """data URL を (MIME, Base64 本体) に分ける（プレフィックスなしなら None）"""
+    if image_b64.startswith("data:"):
+        header, _, payload = image_b64.partition(",")
+        return header[5:].split(";", 1)[0] or None, payload
+    return None, image_b64
+
+
+def preprocess_image(
+    raw: bytes, mime: str | None, profile: ImageProfile
+) -> PreparedImage:
+    """
+    画像ファイルのバイト列を縮小・再エンコードする。
+    再エンコードしても小さくならない場合は元のバイト列を正しい MIME で使う。
+    """
+    with Image.open(io.BytesIO(raw)) as img:
+        source_mime = _PIL_MIME.get(img.format or "", mime or "image/png")
+        target = (profile.max_side, profile.max_side)
+        needs_resize = max(img.size) > profile.max_side
+        # JPEG は縮小率に応じた低解像度でデコードする（IDCT を省ける）
+        img.draft("RGB", target)
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > profile.max_side:
+            img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        pil_format, target_mime = _FORMATS[profile.format]
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, quality=profile.quality)
+        width, height = img.size
+
+    data = buffer.getvalue()
+    if not needs_resize and len(raw) <= len(data):
+        data, target_mime = raw, source_mime
+    encoded = base64.b64encode(data).decode("ascii")
+    return PreparedImage(
+        data_url=f"data:{target_mime};base64,{encoded}",
+        detail=profile.detail,
+        width=width,
+        height=height,
+        nbytes=len(data),
+    )
+
+
+class ImageCache:
+    """前処理済み画像の LRU（バイト数上限）。キーはフレームの sha256 と設定"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, PreparedImage] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # ---- メトリクス ----
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.total_ms = 0.0
+
+    @staticmethod
+    def key(sha256: str, profile: ImageProfile) -> str:
+        return f"{sha256}:{profile.signature}"
+
+    def get(self, key: str) -> PreparedImage | None:
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def prepare(
+        self, key: str, raw: bytes, mime: str | None, profile: ImageProfile
+    ) -> PreparedImage:
+        start = time.perf_counter()
+        image = preprocess_image(raw, mime, profile)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.input_bytes += len(raw)
+            self.output_bytes += image.nbytes
+            self.total_ms += elapsed_ms
+            if key not in self._entries:
+                self._entries[key] = image
+                self._bytes += len(image.data_url)
+            while self._bytes > self.max_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old.data_url)
+        return image
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            prepared = self.misses - self.errors
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "avg_ms": self.total_ms / prepared if prepared else 0.0,
+                "bytes_in": self.input_bytes,
+                "bytes_out": self.output_bytes,
+            }
+
+
+_cache = ImageCache(int(os.getenv("VLM_IMAGE_CACHE_MB", "16")) * 1024 * 1024)
+
+
+async def prepare_image(
+    image: StoredImage | str, model_name: str
+) -> PreparedImage:
+    """
+    モデル向けに前処理した画像を返す（キャッシュにあればそのまま）。
+    StoredImage はバイト列と sha256 をそのまま使う（Base64 / data URL も可）。
+    デコードできない画像は元のまま送る。
+    """
+    profile = image_profile(model_name)
+    if isinstance(image, StoredImage):
+        mime, raw, sha256 = image.mime, image.data, image.sha256
+    else:
+        mime, payload = split_data_url(image)
+        try:
+            raw = base64.b64decode(payload)
+        except ValueError as e:
+            # binascii.Error / 非 ASCII 文字（どちらも ValueError）
+            print("⚠️ 画像の Base64 デコードに失敗（元の画像を送信）:", e)
+            return _original(mime, payload, len(payload) * 3 // 4, profile)
+        sha256 = hashlib.sha256(raw).hexdigest()
+
+    key = ImageCache.key(sha256, profile)
+    if (prepared := _cache.get(key)) is not None:
+        return prepared
+    try:
+        return await asyncio.to_thread(_cache.prepare, key, raw, mime, profile)
+    except (OSError, ValueError) as e:
+        # Image.open の UnidentifiedImageError は OSError の派生
+        print("⚠️ 画像の前処理に失敗（元の画像を送信）:", e)
+        _cache.record_error()
+        payload = base64.b64encode(raw).decode("ascii")
+        return _original(mime, payload, len(raw), profile)
+
+
+def _original(
+    mime: str | None, payload: str, nbytes: int, profile: ImageProfile
+) -> PreparedImage:
+    """前処理できなかった画像をそのまま送る"""
+    return PreparedImage(
+        data_url=f"data:{mime or 'image/png'};base64,{payload}",
+        detail=profile.detail,
+        width=0,
+        height=0,
+        nbytes=nbytes,
+    )
+
+
+def image_cache_stats() -> dict[str, Any]:
+    return _cache.stats()
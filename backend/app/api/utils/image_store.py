@@ -0,0 +1,216 @@
+# セッションごとの画像ストア（内容アドレス）。
+# カメラの画角が変わらなくても毎回 Base64 の画像を送らせないよう、
+# クライアントはまずハッシュだけを提示し、サーバーが持っていない場合だけ
+# 画像本体を送る。画像は Base64 ではなく生のバイト列で保持する。
+#
+# プロトコル（JSON）:
+#   client → {"type": "image_hash", "sha256": "<hex>", "dhash": "<16 hex>"}
+#       sha256 は画像ファイルのバイト列（Base64 デコード後）のハッシュ。
+#       dhash（任意）は 64bit の差分ハッシュ: グレースケールを 9x8 に縮小し、
+#       各行で「左の画素 < 右の画素」を 1 とした 64 ビット（行優先・MSB 先頭）。
+#   server → {"type": "image_ack", "sha256": ..., "status": "cached"}
+#       保持している / {"status": "similar"} dhash が近い画像を保持している
+#       （どちらも現在の画像として使う）
+#   server → {"type": "image_request", "sha256": ...}  画像本体が必要
+#   client → {"type": "image_upload", "sha256": ..., "image_base64": ...}
+#       （/ws/image ではバイナリの FRAME_IMAGE でも可）
+#   server → {"type": "image_ack", "sha256": ..., "status": "stored"}
+#       （受信した画像が既存の画像とほぼ同じなら "similar"、
+#       デコードできなければ "error"）
+# 従来どおり image_base64 を直接送った場合も同じストアに入る。
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+IMAGE_MESSAGES = ("image_hash", "image_upload")
+
+# 差分ハッシュの入力サイズ（幅は比較のため 1 列多い）
+_DHASH_SIZE = (9, 8)
+# 別名（dhash が近いとして既存画像に対応づけた sha256）の上限
+_MAX_ALIASES = 256
+
+
+@dataclass(frozen=True)
+class StoredImage:
+    sha256: str
+    dhash: int
+    mime: str
+    data: bytes
+
+
+def dhash(img: Image.Image) -> int:
+    """64bit の差分ハッシュ（近い画像ほどハミング距離が小さい）"""
+    # JPEG は 1/8 スケールでデコードできるので縮小が安い
+    img.draft("L", (_DHASH_SIZE[0] * 8, _DHASH_SIZE[1] * 8))
+    small = img.convert("L").resize(_DHASH_SIZE, Image.Resampling.BOX)
+    px = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(px[:, :-1] < px[:, 1:])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def _decode(data: bytes, mime: str | None) -> StoredImage:
+    with Image.open(io.BytesIO(data)) as img:
+        mime = Image.MIME.get(img.format or "", mime or "image/png")
+        return StoredImage(
+            sha256=hashlib.sha256(data).hexdigest(),
+            dhash=dhash(img),
+            mime=mime,
+            data=data,
+        )
+
+
+class ImageStore:
+    def __init__(
+        self, max_bytes: int | None = None, threshold: int | None = None
+    ):
+        """
+        :param max_bytes: 保持する画像の合計バイト数
+            （既定は IMAGE_STORE_MB、未設定なら 4MB）
+        :param threshold: 同じ画像とみなす dhash のハミング距離
+            （既定は IMAGE_DHASH_THRESHOLD、未設定なら 4。負なら無効）
+        """
+        self.max_bytes = max_bytes or (
+            int(os.getenv("IMAGE_STORE_MB", "4")) * 1024 * 1024
+        )
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else int(os.getenv("IMAGE_DHASH_THRESHOLD", "4"))
+        )
+        self.latest: StoredImage | None = None
+        self._images: OrderedDict[str, StoredImage] = OrderedDict()
+        self._aliases: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+
+    async def handle(self, data: dict[str, Any]) -> dict[str, Any]:
+        """image_hash / image_upload を処理して返信メッセージを返す"""
+        sha256 = data.get("sha256")
+        if data["type"] == "image_upload":
+            return await self.put_base64(data.get("image_base64"), sha256)
+        try:
+            dhash = data.get("dhash")
+            return self.offer(sha256, int(dhash, 16) if dhash else None)
+        except (TypeError, ValueError) as e:
+            print("⚠️ 不正な image_hash:", e)
+            return _error(sha256)
+
+    def offer(
+        self, sha256: str | None, dhash: int | None = None
+    ) -> dict[str, Any]:
+        """ハッシュの提示。持っていれば現在の画像にする"""
+        if not sha256:
+            raise ValueError("sha256 is required")
+        image = self._lookup(sha256)
+        if image is not None:
+            return self._use(image, sha256, "cached")
+        if dhash is not None and (image := self._similar(dhash)):
+            self._alias(sha256, image)
+            return self._use(image, sha256, "similar")
+        return {"type": "image_request", "sha256": sha256}
+
+    async def put_base64(
+        self, image_b64: str | None, sha256: str | None = None
+    ) -> dict[str, Any]:
+        """Base64（data URL 可）の画像を受け取る"""
+        if not isinstance(image_b64, str):
+            print("⚠️ 不正な image_base64:", type(image_b64).__name__)
+            return _error(sha256)
+        mime = None
+        if image_b64.startswith("data:"):
+            header, _, image_b64 = image_b64.partition(",")
+            mime = header[5:].split(";", 1)[0] or None
+        try:
+            data = base64.b64decode(image_b64)
+        except ValueError as e:
+            # binascii.Error / 非 ASCII 文字（どちらも ValueError）
+            print("⚠️ 画像の Base64 デコードに失敗:", e)
+            return _error(sha256)
+        return await self.put(data, mime, sha256)
+
+    async def put(
+        self, data: bytes, mime: str | None = None, sha256: str | None = None
+    ) -> dict[str, Any]:
+        """画像本体を受け取り、現在の画像にする"""
+        try:
+            image = await asyncio.to_thread(_decode, data, mime)
+        except (OSError, ValueError) as e:
+            # 壊れた画像でセッションは止めない（現在の画像もそのまま）
+            print("⚠️ 画像のデコードに失敗:", e)
+            return _error(sha256)
+        reply = self._store(image)
+        if sha256 is not None and sha256 != image.sha256:
+            # クライアントが計算したハッシュでも次から引けるようにする
+            print(f"⚠️ 画像のハッシュ不一致: {sha256} != {image.sha256}")
+            self._alias(sha256, self.latest)
+        return reply
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "images": len(self._images),
+            "aliases": len(self._aliases),
+            "bytes": self._bytes,
+        }
+
+    # ---------- 内部処理 ----------
+
+    def _store(self, image: StoredImage) -> dict[str, Any]:
+        if (known := self._lookup(image.sha256)) is not None:
+            return self._use(known, image.sha256, "cached")
+        if similar := self._similar(image.dhash):
+            # ほぼ同じ画像は保存せず、既存の画像をそのまま使う
+            self._alias(image.sha256, similar)
+            return self._use(similar, image.sha256, "similar")
+
+        self._images[image.sha256] = image
+        self._bytes += len(image.data)
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            _, old = self._images.popitem(last=False)
+            self._bytes -= len(old.data)
+        return self._use(image, image.sha256, "stored")
+
+    def _lookup(self, sha256: str) -> StoredImage | None:
+        sha256 = self._aliases.get(sha256, sha256)
+        image = self._images.get(sha256)
+        if image is not None:
+            self._images.move_to_end(sha256)
+        return image
+
+    def _similar(self, dhash: int) -> StoredImage | None:
+        """ハミング距離が閾値以内で最も近い画像（現在の画像を優先）"""
+        if self.threshold < 0:
+            return None
+        candidates = list(self._images.values())
+        if self.latest is not None:
+            candidates.insert(0, self.latest)
+        best = min(
+            candidates,
+            key=lambda image: (image.dhash ^ dhash).bit_count(),
+            default=None,
+        )
+        if best is None or (best.dhash ^ dhash).bit_count() > self.threshold:
+            return None
+        return best
+
+    def _alias(self, sha256: str, image: StoredImage):
+        self._aliases[sha256] = image.sha256
+        self._aliases.move_to_end(sha256)
+        while len(self._aliases) > _MAX_ALIASES:
+            self._aliases.popitem(last=False)
+
+    def _use(
+        self, image: StoredImage, sha256: str, status: str
+    ) -> dict[str, Any]:
+        self.latest = image
+        return {"type": "image_ack", "sha256": sha256, "status": status}
+
+
+def _error(sha256: str | None) -> dict[str, Any]:
+    return {"type": "image_ack", "sha256": sha256, "status": "error"}
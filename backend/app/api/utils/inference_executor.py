@@ -0,0 +1,122 @@
+# 推論処理をイベントループの外（専用スレッドプール）で実行するための executor。
+# 同時実行数・待ち行列の上限を持ち、キュー深さと待ち時間を計測する。
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class InferenceExecutor:
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        if max_pending < max_workers:
+            raise ValueError("max_pending must be >= max_workers")
+
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        # 実行中 + 待機中の合計を max_pending で頭打ちにする（超過分は await で待つ）
+        self._slots = asyncio.Semaphore(max_pending)
+
+        # ---- メトリクス ----
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._last_wait_ms = 0.0
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        fn(*args, **kwargs) をワーカースレッドで実行し、結果を返す。
+        待ち行列が満杯の場合は空きが出るまで呼び出し側を待たせる。
+        """
+        async with self._slots:
+            submitted = time.perf_counter()
+            started = False
+
+            def _job() -> T:
+                nonlocal started
+                wait_ms = (time.perf_counter() - submitted) * 1000
+                with self._lock:
+                    started = True
+                    self._queued -= 1
+                    self._running += 1
+                    self._last_wait_ms = wait_ms
+                    self._total_wait_ms += wait_ms
+                    self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    with self._lock:
+                        self._running -= 1
+                        self._completed += 1
+
+            with self._lock:
+                self._queued += 1
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._pool, _job)
+            except asyncio.CancelledError:
+                # 開始前にキャンセルされたジョブは待ち行列から外す
+                with self._lock:
+                    if not started:
+                        self._queued -= 1
+                raise
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            avg_wait_ms = (
+                self._total_wait_ms / self._completed
+                if self._completed
+                else 0.0
+            )
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "last_wait_ms": round(self._last_wait_ms, 1),
+                "avg_wait_ms": round(avg_wait_ms, 1),
+                "max_wait_ms": round(self._max_wait_ms, 1),
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------- STT 用のプロセス共通 executor ----------
+_stt_executor: InferenceExecutor | None = None
+
+
+def get_stt_executor() -> InferenceExecutor:
+    """
+    STT 推論用の executor を返す（プロセス内シングルトン）。
+    ワーカー数は STT_INFERENCE_WORKERS、待ち行列上限は
+    STT_INFERENCE_MAX_PENDING 環境変数で変更できる。
+    """
+    global _stt_executor
+    if _stt_executor is None:
+        workers = int(os.getenv("STT_INFERENCE_WORKERS", "1"))
+        max_pending = int(
+            os.getenv("STT_INFERENCE_MAX_PENDING", str(max(workers, 32)))
+        )
+        _stt_executor = InferenceExecutor(
+            "stt", max_workers=workers, max_pending=max_pending
+        )
+    return _stt_executor
@@ -0,0 +1,79 @@
+# プロセス全体で共有するモデルのレジストリ。
+# 重い STT/TTS モデルは (種類, 名前, デバイス) ごとに 1 度だけ遅延ロードし、
+# セッション側はキューや VAD などの軽量な状態だけを持つ。
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, Hashable, TypeVar
+
+import torch
+import whisper
+
+T = TypeVar("T")
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+@dataclass
+class SharedModel(Generic[T]):
+    """
+    共有モデル本体と、その推論を直列化するためのロック。
+    Whisper の transcribe は kv-cache フックをモデルに直接登録するため、
+    同一インスタンスへの同時呼び出しは lock 経由で行う。
+    """
+
+    key: tuple[Hashable, ...]
+    model: T
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self.lock:
+            return fn(*args, **kwargs)
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models: dict[tuple[Hashable, ...], SharedModel[Any]] = {}
+        self._load_locks: dict[tuple[Hashable, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(
+        self, key: tuple[Hashable, ...], loader: Callable[[], T]
+    ) -> SharedModel[T]:
+        """
+        key に対応するモデルを返す。未ロードなら loader で 1 度だけ生成する。
+        ロード中（と他スレッドのロード待ち）は呼び出し元をブロックするので、
+        WebSocket ハンドラ等の async コードからは asyncio.to_thread 経由で呼ぶ。
+        """
+        shared = self._models.get(key)
+        if shared is not None:
+            return shared
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # 同じ key のロードは 1 スレッドだけが行い、他はその完了を待つ
+        with load_lock:
+            shared = self._models.get(key)
+            if shared is None:
+                print(f"📦 モデルをロード: {key}")
+                shared = SharedModel(key=key, model=loader())
+                self._models[key] = shared
+        return shared
+
+    def loaded_keys(self) -> list[str]:
+        return ["/".join(str(k) for k in key) for key in self._models]
+
+
+registry = ModelRegistry()
+
+
+def get_whisper_model(
+    name: str = "base", device: str | None = None
+) -> SharedModel[whisper.Whisper]:
+    device = device or default_device()
+    return registry.get_or_load(
+        ("whisper", name, device),
+        lambda: whisper.load_model(name, device=device),
+    )
@@ -1,20 +1,30 @@
 # This module provides functions to select the appropriate instances
 # based on the model name for TTS, transcription, and multimodal response.
-import torch
+import os
+from typing import Callable
+
 from api.modules.response_generation.vlm.openai_vlm import OpenAIVLM
 from api.modules.transcribers.transcribers import (
     OpenAITranscriber,
     WhisperLocalTranscriber,
 )
 from api.modules.tts_wrappers.base_tts import BaseTTS
+from api.modules.tts_wrappers.cached_tts import cached
 from api.modules.tts_wrappers.kokoro_tts import TTSGenerator
 from api.modules.tts_wrappers.openai_tts import OpenAI_TTS
+from api.modules.tts_wrappers.postprocess import (
+    PostProcessConfig,
+    PostProcessingTTS,
+)
+from api.modules.tts_wrappers.replica_pool import replica_pool
 from api.modules.tts_wrappers.style_bert_vits2_wrapper import (
     RuminaStyleBertVITS2Wrapper,
 )
+from api.utils.model_registry import default_device, registry
 from services.openai_chat import get_multimodal_response
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+device = default_device()
+RUMINA_TTS_MODEL_DIR = "/workspace/backend/app/model/tts/richika_v1"
 
 
 def get_transcriber_instance(model_name: str):
@@ -55,21 +65,86 @@ def get_response_instance(model_name: str):
         raise ValueError(f"Unsupported model: {model_name}")
 
 
-tts_instance = TTSGenerator()
-rumina_tts_instance = RuminaStyleBertVITS2Wrapper(
-    model_dir="/workspace/backend/app/model/tts/richika_v1", device=device
-)
-openai_tts_instance = OpenAI_TTS()
+# モデルセットごとの TTS 後処理（None で無効）
+# OpenAI TTS は MP3 で無音・音量も整っているため掛けない
+# 環境変数 TTS_POSTPROCESS=0 で全体を無効にできる
+TTS_POSTPROCESS: dict[str, PostProcessConfig | None] = {
+    "rumina-m1": PostProcessConfig(),
+    "rumina-m1-pro": PostProcessConfig(),
+    "rumina-m1-promax": None,
+    "rumina-m2": None,
+}
+
+
+# TTS モデルはレジストリ経由で初回利用時に 1 度だけロードし、全セッションで共有する
+# 合成結果は CachedTTS で（モデル, 後処理設定）ごとにキャッシュする
+# スレッドセーフでないローカルモデルは TTSReplicaPool で複製して使う
+def _serve_tts(
+    key: tuple,
+    load: Callable[[], BaseTTS],
+    postprocess: PostProcessConfig | None = None,
+) -> BaseTTS:
+    backend = registry.get_or_load(key, load).model
+    if postprocess is None:
+        return registry.get_or_load(
+            key + ("cached",), lambda: cached(backend)
+        ).model
+    return registry.get_or_load(
+        key + ("cached", postprocess.signature),
+        lambda: cached(PostProcessingTTS(backend, postprocess)),
+    ).model
+
+
+def _kokoro_tts(postprocess: PostProcessConfig | None = None) -> BaseTTS:
+    return _serve_tts(
+        ("tts", "kokoro_tts", device),
+        lambda: replica_pool(TTSGenerator, "kokoro_tts"),
+        postprocess,
+    )
+
+
+def _rumina_tts(postprocess: PostProcessConfig | None = None) -> BaseTTS:
+    # STYLE_BERT_VITS2_BACKEND=onnx で ONNX Runtime（CPU）版を使う
+    if os.getenv("STYLE_BERT_VITS2_BACKEND", "torch") == "onnx":
+        # onnxruntime は任意依存なので使うときだけ import する
+        from api.modules.tts_wrappers.style_bert_vits2_onnx import (
+            RuminaStyleBertVITS2OnnxWrapper,
+        )
+
+        return _serve_tts(
+            ("tts", "style_bert_vits2_onnx"),
+            lambda: RuminaStyleBertVITS2OnnxWrapper(
+                model_dir=RUMINA_TTS_MODEL_DIR
+            ),
+            postprocess,
+        )
+    return _serve_tts(
+        ("tts", "style_bert_vits2", device),
+        lambda: replica_pool(
+            lambda: RuminaStyleBertVITS2Wrapper(
+                model_dir=RUMINA_TTS_MODEL_DIR, device=device
+            ),
+            "style_bert_vits2",
+        ),
+        postprocess,
+    )
+
+
+def _openai_tts(postprocess: PostProcessConfig | None = None) -> BaseTTS:
+    return _serve_tts(("tts", "openai_tts-1"), OpenAI_TTS, postprocess)
 
 
 def get_tts_instance(model_name: str) -> BaseTTS:
+    postprocess = TTS_POSTPROCESS.get(model_name)
+    if os.getenv("TTS_POSTPROCESS", "1") == "0":
+        postprocess = None
     if model_name == "rumina-m1":
-        return tts_instance
+        return _kokoro_tts(postprocess)
     elif model_name == "rumina-m1-pro":
-        return rumina_tts_instance
+        return _rumina_tts(postprocess)
     elif model_name == "rumina-m1-promax":
-        return openai_tts_instance
+        return _openai_tts(postprocess)
     elif model_name == "rumina-m2":
-        return openai_tts_instance  # TODO: 後で変更
+        return _openai_tts(postprocess)  # TODO: 後で変更
     else:
         raise ValueError(f"Unsupported model: {model_name}")
@@ -0,0 +1,98 @@
+# セッションごとの PCM (int16) 受信バッファ。
+# 容量は事前確保で固定し、溢れたときの扱いは OverflowPolicy で明示する。
+# データを 2 重に書き込む（ミラーリング）ことで、保持中の区間は
+# 折り返しを含めて常に連続したゼロコピーのビューとして取り出せる。
+from typing import Literal
+
+import numpy as np
+from numpy.typing import NDArray
+
+# drop_oldest: 古いサンプルを捨てて最新を保持する（プリロール等のリング用途）
+# drop_newest: 満杯以降の入力を捨てる（1 発話の録音用途）
+# reject     : PcmBufferOverflow を送出する
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "reject"]
+
+
+class PcmBufferOverflow(Exception):
+    pass
+
+
+class PcmRingBuffer:
+    def __init__(
+        self, capacity: int, overflow: OverflowPolicy = "drop_newest"
+    ):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.capacity = capacity
+        self.overflow: OverflowPolicy = overflow
+        self._data = np.zeros(capacity * 2, dtype=np.int16)
+        self._start = 0
+        self._len = 0
+        self.dropped_samples = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self._len
+
+    @property
+    def is_full(self) -> bool:
+        return self._len == self.capacity
+
+    def write(self, pcm: bytes | memoryview | NDArray[np.int16]) -> int:
+        """
+        PCM を書き込み、実際に取り込んだサンプル数を返す。
+        溢れた分の扱いは overflow ポリシーに従う。
+        """
+        if isinstance(pcm, np.ndarray):
+            samples = pcm
+        else:
+            view = memoryview(pcm).cast("B")
+            samples = np.frombuffer(view[: len(view) // 2 * 2], np.int16)
+        n = len(samples)
+        if n > self.free:
+            if self.overflow == "reject":
+                raise PcmBufferOverflow(
+                    f"PCM buffer overflow: {n} > {self.free} samples free"
+                )
+            if self.overflow == "drop_newest":
+                self.dropped_samples += n - self.free
+                samples = samples[: self.free]
+                n = len(samples)
+            else:  # drop_oldest
+                if n > self.capacity:
+                    self.dropped_samples += n - self.capacity
+                    samples = samples[-self.capacity :]
+                    n = self.capacity
+                evict = n - self.free
+                self.dropped_samples += evict
+                self._start = (self._start + evict) % self.capacity
+                self._len -= evict
+
+        pos = (self._start + self._len) % self.capacity
+        written = 0
+        while written < n:
+            k = min(n - written, self.capacity - pos)
+            chunk = samples[written : written + k]
+            self._data[pos : pos + k] = chunk
+            self._data[pos + self.capacity : pos + self.capacity + k] = chunk
+            written += k
+            pos = (pos + k) % self.capacity
+        self._len += n
+        return n
+
+    def view(self) -> NDArray[np.int16]:
+        """
+        保持中のサンプルを古い順に並べたゼロコピーのビューを返す。
+        ビューは次の write / clear まで有効。
+        """
+        return self._data[self._start : self._start + self._len]
+
+    def view_bytes(self) -> memoryview:
+        return memoryview(self.view()).cast("B")
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
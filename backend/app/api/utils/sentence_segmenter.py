@@ -0,0 +1,223 @@
+# ストリーミング生成されるテキストを TTS 向けのチャンクに区切る。
+#
+#   • トークンの途中にある句点も検出する（"です。" や "!\n" など）
+#   • 句点・感嘆符・疑問符・三点リーダ・改行で区切り、直後の閉じ括弧/引用符は前の文に含める
+#   • 最初のチャンクは短く（読点でも区切る）して最初の音声を早く出し、
+#     2 つ目以降は短い文をまとめて長めにし、TTS の呼び出し回数を減らす
+#   • 区切りが来ないまま max_wait 秒たったテキストは強制的に出す
+import asyncio
+import time
+from typing import AsyncIterator, Callable, TypeVar
+
+T = TypeVar("T")
+
+TERMINATORS = frozenset("。！？!?．…‥")
+SOFT_BREAKS = frozenset("、，,;；")
+CLOSERS = frozenset("」』）)】〕〉》\"'”’")
+NEWLINES = frozenset("\r\n")
+
+
+class SentenceSegmenter:
+    def __init__(
+        self,
+        first_min_chars: int = 1,
+        first_soft_chars: int = 10,
+        min_chars: int = 24,
+        max_chars: int = 120,
+        split_on_comma: bool = True,
+        max_wait: float | None = 0.8,
+    ):
+        """
+        :param first_min_chars: 最初のチャンクとして出す最小文字数
+        :param first_soft_chars: 最初のチャンクを読点で区切る最小文字数
+        :param min_chars: 2 つ目以降のチャンクの最小文字数（短い文はまとめる）
+        :param max_chars: これを超えたら読点（なければその位置）で区切る
+        :param split_on_comma: 読点での区切りを許可する
+        :param max_wait: 区切りを待つ最大秒数（None で無効）
+        """
+        self.first_min_chars = first_min_chars
+        self.first_soft_chars = first_soft_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.split_on_comma = split_on_comma
+        self.max_wait = max_wait
+
+        self._buf = ""
+        self._emitted = 0
+        self._pending_since: float | None = None
+
+    # ---------- 公開 API ----------
+
+    def feed(self, text: str, now: float | None = None) -> list[str]:
+        """テキスト片を追加し、確定したチャンクを返す"""
+        if not text:
+            return self.poll(now)
+        now = time.monotonic() if now is None else now
+        if self._pending_since is None:
+            self._pending_since = now
+        self._buf += text
+        return self._drain(now) + self.poll(now)
+
+    def poll(self, now: float | None = None) -> list[str]:
+        """max_wait を過ぎていれば保留中のテキストを出す"""
+        now = time.monotonic() if now is None else now
+        remaining = self.deadline_in(now)
+        if remaining is None or remaining > 0:
+            return []
+        return self._force(now)
+
+    def flush(self) -> list[str]:
+        """生成終了時に残りをすべて出す"""
+        chunks = self._force(time.monotonic())
+        if self._buf.strip():
+            chunks.extend(self._take(len(self._buf), None))
+        return chunks
+
+    def deadline_in(self, now: float | None = None) -> float | None:
+        """次に poll() すべきまでの秒数（保留がなければ None）"""
+        if self.max_wait is None or self._pending_since is None:
+            return None
+        if not self._buf.strip():
+            return None
+        now = time.monotonic() if now is None else now
+        return self._pending_since + self.max_wait - now
+
+    # ---------- 内部処理 ----------
+
+    def _min_chars(self) -> int:
+        return self.first_min_chars if self._emitted == 0 else self.min_chars
+
+    def _drain(self, now: float) -> list[str]:
+        chunks = []
+        while (cut := self._find_cut()) is not None:
+            chunks.extend(self._take(cut, now))
+        return chunks
+
+    def _force(self, now: float) -> list[str]:
+        chunks = self._drain(now)
+        if self._buf.strip():
+            # 文末（なければ読点）までを出し、区切りがなければ全部出す
+            cut = self._last_break() or len(self._buf)
+            chunks.extend(self._take(cut, now))
+        return chunks
+
+    def _take(self, cut: int, now: float | None) -> list[str]:
+        chunk, self._buf = self._buf[:cut].strip(), self._buf[cut:]
+        self._buf = self._buf.lstrip()
+        self._pending_since = now if self._buf else None
+        if not chunk:
+            return []
+        self._emitted += 1
+        return [chunk]
+
+    def _find_cut(self) -> int | None:
+        buf = self._buf
+        min_chars = self._min_chars()
+        first = self._emitted == 0
+        last_soft: int | None = None
+        i = 0
+        while i < len(buf):
+            ch = buf[i]
+            if ch in NEWLINES:
+                end = i + 1
+                while end < len(buf) and buf[end] in NEWLINES:
+                    end += 1
+                if len(buf[:end].strip()) >= min_chars:
+                    return end
+                i = end
+                continue
+
+            if ch in TERMINATORS or ch == ".":
+                end = self._terminator_end(i)
+                if end is None:
+                    # 末尾のため、閉じ括弧や連続する記号が続くか未確定
+                    break
+                if end > i and len(buf[:end].strip()) >= min_chars:
+                    return end
+                i = max(end, i + 1)
+                continue
+
+            if ch in SOFT_BREAKS and self.split_on_comma:
+                last_soft = i + 1
+                if first and i + 1 >= self.first_soft_chars:
+                    return i + 1
+
+            if i + 1 >= self.max_chars:
+                if last_soft is not None and last_soft >= min_chars:
+                    return last_soft
+                return i + 1
+            i += 1
+        return None
+
+    def _terminator_end(self, i: int) -> int | None:
+        """
+        buf[i] から始まる文末記号の終わり（閉じ括弧込み）を返す。
+        文末でない "." の場合は i、末尾で未確定なら None。
+        """
+        buf = self._buf
+        end = i
+        while end < len(buf) and (buf[end] in TERMINATORS or buf[end] == "."):
+            end += 1
+        while end < len(buf) and buf[end] in CLOSERS:
+            end += 1
+        if end >= len(buf):
+            return None
+        if buf[i] == "." and buf[end - 1] == "." and not buf[end].isspace():
+            # 3.14 や example.com の "." は区切らない
+            return i
+        return end
+
+    def _last_break(self) -> int | None:
+        """確定している最後の文末（なければ最後の読点）の位置"""
+        buf = self._buf
+        last_hard = last_soft = None
+        i = 0
+        while i < len(buf):
+            ch = buf[i]
+            if ch in NEWLINES:
+                last_hard = i + 1
+            elif ch in TERMINATORS or ch == ".":
+                end = self._terminator_end(i)
+                if end is None:
+                    break
+                if end > i:
+                    last_hard = end
+                    i = end
+                    continue
+            elif ch in SOFT_BREAKS and self.split_on_comma:
+                last_soft = i + 1
+            i += 1
+        return last_hard or last_soft
+
+
+async def iter_with_deadline(
+    source: AsyncIterator[T], deadline: Callable[[], float | None]
+) -> AsyncIterator[T | None]:
+    """
+    source を順に返しつつ、deadline() 秒以内に次が来なければ None を返す。
+    （待機中の __anext__ はキャンセルせずに引き継ぐ）
+    途中で閉じられたら source も閉じる（aclose）。
+    """
+    it = source.__aiter__()
+    pending = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            timeout = deadline()
+            done, _ = await asyncio.wait(
+                {pending}, timeout=None if timeout is None else max(timeout, 0)
+            )
+            if not done:
+                yield None
+                continue
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            yield item
+            pending = asyncio.ensure_future(it.__anext__())
+    finally:
+        pending.cancel()
+        # 実行中の __anext__ が終わってからでないと aclose できない
+        await asyncio.gather(pending, return_exceptions=True)
+        if (aclose := getattr(it, "aclose", None)) is not None:
+            await aclose()
@@ -1,12 +1,28 @@
 import asyncio
+import contextlib
 import json
+import os
 import uuid
 from dataclasses import dataclass, field
 from typing import Optional
 
 import numpy as np
 import scipy.io.wavfile as wav
-from api.modules.response_generation.vlm.types import GenerationResult
+from api.modules.fillers.filler_bank import (
+    FILLER_SET_ID,
+    Filler,
+    get_filler_bank,
+)
+from api.modules.response_generation.vlm.types import (
+    GenerationResult,
+    tokens_per_sec,
+)
+from api.modules.tts_wrappers.tts_scheduler import TTSJob, TTSScheduler
+from api.utils.audio_resampler import PcmConverter, PcmFormat
+from api.utils.audio_transport import AudioTransport
+from api.utils.binary_framing import FLAG_FILLER, FLAG_PARTIAL
+from api.utils.conversation_store import new_conversation
+from api.utils.image_store import IMAGE_MESSAGES, ImageStore, StoredImage
 from api.utils.invalid_transcription import is_invalid_transcription
 from api.utils.model_selector import (
     get_response_instance,
@@ -14,6 +30,8 @@ from api.utils.model_selector import (
     get_tts_instance,
 )
 from api.utils.model_set import make_set_id
+from api.utils.pcm_ring_buffer import PcmRingBuffer
+from api.utils.sentence_segmenter import SentenceSegmenter, iter_with_deadline
 from asyncpg import Pool
 from db.session import get_pool
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
@@ -23,10 +41,32 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 Endpoint: /ws/m/image-stream
 
 Behaviour:
-    • Streams VLM tokens → sentence buffering (「。」, "!", "?" 等)
-    • Emits each sentence to the client as soon as it closes.
-    • Kicks off an async TTS worker per sentence; sends audio when ready.
+    • Streams VLM tokens → incremental sentence segmentation (boundaries
+      inside tokens, 「」/newlines/読点; short first chunk, max-wait flush).
+    • Emits each chunk to the client as soon as it closes.
+    • Queues each sentence on a per-session TTS scheduler (bounded, seq 0
+      first, shared per-model limit); audio is sent in seq order and
+      queued sentences are dropped on interruption.
     • Supports user interruption by speech‑id or explicit stop message.
+    • Optional partial transcripts while the user is still speaking
+      (init: ``"partial_transcripts": true`` → ``partial_transcription``).
+    • Optional speculative turns (init: ``"speculative": true``): on
+      ``speech_pause`` the server transcribes and starts the VLM right away
+      but holds the output; ``speech_resume`` cancels the turn and
+      ``active_audio_end`` commits it.
+    • Optional binary audio downstream (init: ``"audio_transport": "binary"``,
+      ``"audio_codec": "opus" | "mp3" | "wav" | "pcm"``): audio chunks are
+      sent as binary frames tagged with turn/seq instead of base64 JSON.
+    • Optional fillers (init: ``"fillers": true``, ``"filler_threshold_ms"``):
+      if the first VLM token is late, a pre-synthesized acknowledgement is
+      sent as ``assistant_filler`` to mask the wait.
+    • Optional streamed TTS (init: ``"tts_stream": true``): with a
+      streaming TTS backend and a pass-through codec, each sentence's audio
+      is forwarded in several ``assistant_audio_chunk`` messages as it
+      arrives (``"final": false`` / FLAG_PARTIAL until the last one).
+    • Content-addressed images: the client offers ``image_hash`` (sha256 +
+      optional dHash) and uploads ``image_upload`` only when the server
+      answers ``image_request``; see api/utils/image_store.py.
 
 This file lives under routers/single_pass so that Track (single/dual) × I/O (sync/stream)
 are orthogonal and discoverable.
@@ -34,8 +74,8 @@ are orthogonal and discoverable.
 
 router = APIRouter()
 
-MAX_HISTORY = 5
-conversation_history: list[dict] = []
+MAX_UTTERANCE_SEC = 60  # 1 発話あたりの受信上限（超過分は破棄）
+FILLER_THRESHOLD_MS = int(os.getenv("FILLER_THRESHOLD_MS", "600"))
 
 
 # ───────── Data classes ───────── #
@@ -43,13 +83,28 @@ conversation_history: list[dict] = []
 class UtteranceTask:
     id: str
     speech_id: int
+    turn: int = 0
     cancel_event: asyncio.Event = field(default_factory=asyncio.Event)
+    # Speculative turns start uncommitted: output is held until commit.
+    committed: asyncio.Event = field(default_factory=asyncio.Event)
+    released: bool = True
+    held: list[tuple[int, str]] = field(default_factory=list)
+    first_token: asyncio.Event = field(default_factory=asyncio.Event)
+    filler: Optional[Filler] = None
+    filler_sent_ms: Optional[int] = None
 
 
-# ───────── Helpers ───────── #
-SEPS = ("。", "！", "？", ".", "!", "?")
+@dataclass
+class Speculation:
+    """A turn started on ``speech_pause`` that is not yet confirmed."""
+
+    speech_id: int
+    committed: bool = False
+    cancelled: bool = False
+    task: Optional[UtteranceTask] = None
 
 
+# ───────── Helpers ───────── #
 def save_debug_wav(pcm: bytes, sr: int = 16_000, prefix="debug"):
     """Dump raw PCM to disk for debugging (optional)."""
     try:
@@ -72,13 +127,50 @@ async def ws_image_stream(ws: WebSocket):
     init = await ws.receive_json()
     model_name = init.get("model", "rumina-m2")
     vad_silence_ms = init.get("vad_silence_threshold", 1000)
+    partials_enabled = bool(init.get("partial_transcripts", False))
+    speculative_enabled = bool(init.get("speculative", False))
+    fillers_enabled = bool(init.get("fillers", False))
+    filler_threshold_ms = int(
+        init.get("filler_threshold_ms", FILLER_THRESHOLD_MS)
+    )
+    # Client may capture at its native rate/format; convert server-side.
+    # An unsupported format falls back to 16k/int16/mono (see init_ack).
+    pcm_format, pcm_error = PcmFormat.negotiate(init.get("audio_format"))
+    pcm_converter = PcmConverter(pcm_format)
+    audio_transport, transport_error = AudioTransport.negotiate(init)
     print(f"📝 model={model_name}  vad={vad_silence_ms}ms (stream mode)")
+    if init.keys() & {
+        "audio_transport",
+        "audio_codec",
+        "audio_pcm_rate",
+        "audio_format",
+    }:
+        await ws.send_json(
+            {
+                "type": "init_ack",
+                "audio": audio_transport.describe(transport_error),
+                "audio_format": pcm_format.describe(pcm_error),
+            }
+        )
 
     # Modules
-    transcriber = get_transcriber_instance(model_name)
+    # First use loads the Whisper weights; keep that off the loop
+    transcriber = await asyncio.to_thread(get_transcriber_instance, model_name)
     await transcriber.start()
     vlm = get_response_instance(model_name)
-    tts = get_tts_instance(model_name)
+    # Per-session history, trimmed to a token budget
+    memory = new_conversation(vlm.model_name)
+    # Per-session images, referenced by content hash and kept as raw bytes
+    images = ImageStore()
+    # First use loads the model (and its replicas); keep that off the loop
+    tts = await asyncio.to_thread(get_tts_instance, model_name)
+    filler_bank = get_filler_bank(tts) if fillers_enabled else None
+    # Partial audio can only be forwarded untouched (no transcoding)
+    tts_stream = (
+        bool(init.get("tts_stream", False))
+        and tts.supports_streaming
+        and audio_transport.passthrough(tts.audio_format)
+    )
 
     # IDs
     stt_id = transcriber.model_name
@@ -89,7 +181,7 @@ async def ws_image_stream(ws: WebSocket):
         stt_id=stt_id,
         vlm_id=vlm_id,
         tts_id=tts_id,
-        filler_id=None,
+        filler_id=FILLER_SET_ID if filler_bank is not None else None,
         set_type="single",
     )
 
@@ -98,31 +190,37 @@ async def ws_image_stream(ws: WebSocket):
     async with pool.acquire() as conn:
         await conn.execute(
             """
-            INSERT INTO model_set_catalog (set_id, set_type, stt_id, vlm_id, tts_id)
-            VALUES ($1, 'single', $2, $3, $4)
+            INSERT INTO model_set_catalog (
+                set_id, set_type, stt_id, vlm_id, tts_id, filler_id
+            )
+            VALUES ($1, 'single', $2, $3, $4, $5)
             ON CONFLICT (set_id) DO NOTHING
             """,
             model_set_id,
             stt_id,
             vlm_id,
             tts_id,
+            FILLER_SET_ID if filler_bank is not None else None,
         )
 
     # Silence threshold
     transcriber.set_silence_threshold(max((vad_silence_ms / 1000) - 0.3, 0.05))
 
     # ────── State vars ──────
-    audio_buf = bytearray()
+    # 1 発話分の PCM。容量固定で、溢れた分は捨ててクライアントに通知する
+    audio_buf = PcmRingBuffer(int(MAX_UTTERANCE_SEC * 16_000))
+    overflow_notified = False
     current_task: Optional[UtteranceTask] = None
     current_speech_id = 0
     buffer_speech_id = 0
-    pending_ids: asyncio.Queue[int] = asyncio.Queue()
+    speculation: Optional[Speculation] = None
 
     ###############################
     # Receive Loop                #
     ###############################
     async def recv_loop():
         nonlocal current_task, current_speech_id, buffer_speech_id
+        nonlocal speculation, overflow_notified
         while True:
             try:
                 msg = await ws.receive()
@@ -135,32 +233,112 @@ async def ws_image_stream(ws: WebSocket):
                         current_speech_id += 1
                         buffer_speech_id = current_speech_id
                         audio_buf.clear()
+                        overflow_notified = False
                         print("🎙️ START", current_speech_id)
 
                         if current_task:
                             current_task.cancel_event.set()
+                        if speculation:
+                            speculation.cancelled = True
+                        speculation = None
+
+                        if partials_enabled:
+                            transcriber.begin_incremental()
 
+                        # Legacy: full image on every start
                         if img := data.get("image_base64"):
-                            transcriber.update_latest_image(img)
+                            await images.put_base64(img)
+
+                    elif data["type"] in IMAGE_MESSAGES:
+                        # Hash offer / upload of a requested image
+                        await ws.send_json(await images.handle(data))
+
+                    elif data["type"] == "speech_pause":
+                        # Candidate end of speech → start the turn now
+                        if speculative_enabled and speculation is None:
+                            print("🔮 PAUSE -> speculative turn")
+                            speculation = Speculation(buffer_speech_id)
+                            asyncio.create_task(
+                                transcriber.transcribe_audio_chunk(
+                                    # Runs concurrently with recv → snapshot
+                                    audio_buf.view().tobytes(),
+                                    meta={
+                                        "speech_id": buffer_speech_id,
+                                        "speculation": speculation,
+                                    },
+                                    keep_incremental=True,
+                                )
+                            )
+
+                    elif data["type"] == "speech_resume":
+                        # User kept talking → roll the speculative turn back
+                        if speculation and not speculation.committed:
+                            print("↩️ RESUME -> speculative turn cancelled")
+                            speculation.cancelled = True
+                            if speculation.task:
+                                speculation.task.cancel_event.set()
+                            speculation = None
 
                     elif data["type"] == "active_audio_end":
-                        print("🛑 END -> transcribe (stream)")
-                        await transcriber.transcribe_audio_chunk(
-                            bytes(audio_buf)
-                        )
-                        await pending_ids.put(buffer_speech_id)
+                        if (
+                            speculation
+                            and speculation.speech_id == buffer_speech_id
+                        ):
+                            print("✅ END -> commit speculative turn")
+                            speculation.committed = True
+                            if speculation.task:
+                                speculation.task.committed.set()
+                            transcriber.end_incremental()
+                            speculation = None
+                        else:
+                            print("🛑 END -> transcribe (stream)")
+                            await transcriber.transcribe_audio_chunk(
+                                audio_buf.view_bytes(),
+                                meta={"speech_id": buffer_speech_id},
+                            )
 
                     elif data["type"] == "stop_generation" and current_task:
                         current_task.cancel_event.set()
 
                 # PCM
                 elif "bytes" in msg:
-                    audio_buf.extend(msg["bytes"])
+                    dropped = audio_buf.dropped_samples
+                    audio_buf.write(pcm_converter.convert(msg["bytes"]))
+                    if (
+                        audio_buf.dropped_samples > dropped
+                        and not overflow_notified
+                    ):
+                        overflow_notified = True
+                        print("⚠️ audio buffer full, dropping PCM")
+                        await ws.send_json(
+                            {
+                                "type": "audio_overflow",
+                                "speech_id": buffer_speech_id,
+                                "max_sec": MAX_UTTERANCE_SEC,
+                            }
+                        )
+                    if partials_enabled:
+                        transcriber.feed_incremental(audio_buf.view_bytes())
 
             except Exception as e:
                 print("recv_loop error:", e)
                 break
 
+    ###############################
+    # Partial transcripts         #
+    ###############################
+    async def partial_loop():
+        while True:
+            partial = await transcriber.partial_queue.get()
+            await ws.send_json(
+                {
+                    "type": "partial_transcription",
+                    "speech_id": buffer_speech_id,
+                    "message": partial["text"],
+                    "committed": partial["committed"],
+                }
+            )
+
     ###############################
     # Transcription → VLM         #
     ###############################
@@ -171,40 +349,46 @@ async def ws_image_stream(ws: WebSocket):
                 result = await transcriber.result_queue.get()
                 text = result["text"]
                 stt_latency = result["latency_ms"]
-                speech_id = await pending_ids.get()
+                speech_id = result["speech_id"]
+                spec: Optional[Speculation] = result.get("speculation")
                 print(
                     f"🔡 STT latency={stt_latency}ms text={text} (sid={speech_id})"
                 )
 
                 if isinstance(text, dict):
                     text = text.get("text", "")
+                if spec and spec.cancelled:
+                    continue
                 if is_invalid_transcription(text):
                     continue
 
-                await ws.send_json({"type": "transcription", "message": text})
+                if spec is None:
+                    await ws.send_json(
+                        {"type": "transcription", "message": text}
+                    )
 
-                # Build history
-                hist = [
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant.",
-                    }
-                ]
-                hist.extend(conversation_history[-MAX_HISTORY * 2 :])
-                hist.append({"role": "user", "content": text})
+                # Past turns only; the VLM appends this user turn itself
+                hist = memory.messages()
 
                 task = UtteranceTask(
                     id=f"assistant_{uuid.uuid4().hex[:8]}",
                     speech_id=speech_id,
                 )
+                if spec is None or spec.committed:
+                    task.committed.set()
+                if spec is not None:
+                    # Transcription is held back along with the reply
+                    task.released = False
+                    spec.task = task
                 current_task = task
                 turn_index += 1
+                task.turn = turn_index
 
                 asyncio.create_task(
                     handle_utterance(
                         task,
                         text,
-                        transcriber.latest_image_base64,
+                        images.latest,
                         hist,
                         session_id,
                         turn_index,
@@ -223,7 +407,7 @@ async def ws_image_stream(ws: WebSocket):
     async def handle_utterance(
         task: UtteranceTask,
         user_text: str,
-        img_b64: str | None,
+        image: StoredImage | None,
         hist: list,
         session_id: str,
         turn_index: int,
@@ -233,100 +417,216 @@ async def ws_image_stream(ws: WebSocket):
     ):
         nonlocal current_speech_id
 
-        sentence_buf: str = ""
+        segmenter = SentenceSegmenter()
         seq = 0
-        vlm_tokens_in = vlm_tokens_out = vlm_tok_per_sec = None
+        reply_parts: list[str] = []
+        usage: GenerationResult | None = None
+
+        # Speculative turn: generate now, release output once committed
+        release_task = None
+        if not task.released:
+            release_task = asyncio.create_task(release_held(task, user_text))
 
         vlm_start = asyncio.get_event_loop().time()
+        if filler_bank is not None:
+            asyncio.create_task(
+                send_filler(task, user_text, image is not None, vlm_start)
+            )
         try:
-            async for token in vlm.stream_generate(
-                message=user_text,
-                image_base64=img_b64,
-                history=hist,
-            ):
-                # First token → prompt/completion counts available
-                if vlm_tokens_in is None:
+            # aclosing: a break (barge-in) closes the whole chain, so the
+            # VLM stream is released right away instead of at GC time
+            tokens = iter_with_deadline(
+                vlm.stream_generate(
+                    message=user_text,
+                    image=image,
+                    history=hist,
+                ),
+                segmenter.deadline_in,
+            )
+            async with contextlib.aclosing(tokens):
+                async for token in tokens:
+                    # No boundary within max-wait → flush what we have
+                    if token is None:
+                        for chunk in segmenter.poll():
+                            await publish(task, seq, chunk)
+                            seq += 1
+                        continue
+
+                    # Final usage record (tokens, TTFT, ITL) after the text
                     if isinstance(token, GenerationResult):
-                        # Some impl may yield meta first
-                        vlm_tokens_in = token.prompt_tokens
-                        vlm_tokens_out = 0  # will accumulate
+                        usage = token
                         continue
 
-                # Cancellation check (per‑token granularity)
-                if (
-                    task.cancel_event.is_set()
-                    or task.speech_id != current_speech_id
-                ):
-                    print("✂️ generation cancelled")
-                    break
-
-                # Accumulate
-                sentence_buf += token
-                vlm_tokens_out = (vlm_tokens_out or 0) + 1
-
-                # Sentence boundary?
-                if token in SEPS:
-                    await emit_sentence(task, seq, sentence_buf)
-                    asyncio.create_task(tts_worker(task, seq, sentence_buf))
-                    sentence_buf = ""
-                    seq += 1
+                    # Cancellation check (per‑token granularity)
+                    if (
+                        task.cancel_event.is_set()
+                        or task.speech_id != current_speech_id
+                    ):
+                        print("✂️ generation cancelled")
+                        task.cancel_event.set()
+                        break
+
+                    task.first_token.set()
+                    reply_parts.append(token)
+                    for chunk in segmenter.feed(token):
+                        await publish(task, seq, chunk)
+                        seq += 1
 
             # flush remainder
-            if sentence_buf:
-                await emit_sentence(task, seq, sentence_buf)
-                asyncio.create_task(tts_worker(task, seq, sentence_buf))
-                seq += 1
+            if not task.cancel_event.is_set():
+                for chunk in segmenter.flush():
+                    await publish(task, seq, chunk)
+                    seq += 1
 
         except Exception as e:
             print("VLM stream error:", e)
+        finally:
+            # Stops a pending filler timer
+            task.first_token.set()
+
+        if release_task and not await release_task:
+            print("🗑️ speculative turn discarded")
+            return
+        tts_scheduler.end_turn(task.id, seq)
 
         vlm_latency = int((asyncio.get_event_loop().time() - vlm_start) * 1000)
-        if vlm_tokens_out and vlm_latency:
-            vlm_tok_per_sec = vlm_tokens_out / (vlm_latency / 1000)
+        if usage is None:
+            # Stream cut short: count the same prompt locally
+            usage = GenerationResult(
+                content="".join(reply_parts),
+                prompt_tokens=await vlm.count_prompt_tokens(user_text, hist),
+                completion_tokens=await vlm.count_tokens("".join(reply_parts)),
+                usage_source="tokenizer",
+            )
+        vlm_tok_per_sec = tokens_per_sec(usage, vlm_latency)
+        print(
+            f"📊 tokens in={usage.prompt_tokens} out={usage.completion_tokens}"
+            f" cached={usage.cached_tokens} ttft={usage.ttft_ms}ms"
+            f" ({usage.usage_source})"
+        )
 
         await ws.send_json({"type": "assistant_done", "id": task.id})
 
-        # History append (full text)
-        conversation_history.append(
-            {"role": "assistant", "content": ""}
-        )  # placeholder
-        if len(conversation_history) > MAX_HISTORY * 2:
-            conversation_history[:] = conversation_history[-MAX_HISTORY * 2 :]
+        # History append (what was actually generated, even if cut short)
+        memory.add_turn(user_text, "".join(reply_parts))
 
         # # DB logging (latency only; tokens optional)
+        # # Needs migrations 003/005; failures must not escape this task.
         # if pool is not None:
-        #     async with pool.acquire() as conn:
-        #         await conn.execute(
-        #             """
-        #             INSERT INTO single_turns (
-        #             request_id, session_id, turn_index, timestamp_utc, model_set_id,
-        #             stt_latency_ms, transcript,
-        #             vlm_latency_ms, vlm_tokens_in, vlm_tokens_out, vlm_tok_per_sec,
-        #             tts_latency_ms,
-        #             total_turn_latency_ms, net_up_ms, net_down_ms, error_flag
-        #             ) VALUES (
-        #             gen_random_uuid()::text,
-        #             $1, $2, now(), $3,
-        #             $4, $5,
-        #             $6, $7, $8, $9,
-        #             NULL,
-        #             NULL, NULL, NULL, NULL
+        #     filler = task.filler
+        #     try:
+        #         async with pool.acquire() as conn:
+        #             await conn.execute(
+        #                 """
+        #                 INSERT INTO single_turns (
+        #                 request_id, session_id, turn_index, timestamp_utc,
+        #                 model_set_id,
+        #                 stt_latency_ms, transcript,
+        #                 vlm_latency_ms, vlm_tokens_in, vlm_tokens_out,
+        #                 vlm_tok_per_sec,
+        #                 filler_key, filler_text, filler_sent_ms,
+        #                 vlm_cached_tokens, vlm_ttft_ms, vlm_itl_ms,
+        #                 vlm_usage_source
+        #                 ) VALUES (
+        #                 gen_random_uuid()::text,
+        #                 $1, $2, now(), $3,
+        #                 $4, $5,
+        #                 $6, $7, $8, $9,
+        #                 $10, $11, $12,
+        #                 $13, $14, $15,
+        #                 $16
+        #                 )
+        #                 """,
+        #                 session_id,
+        #                 turn_index,
+        #                 model_set_id,
+        #                 stt_latency,
+        #                 user_text,
+        #                 vlm_latency,
+        #                 usage.prompt_tokens,
+        #                 usage.completion_tokens,
+        #                 vlm_tok_per_sec,
+        #                 filler.key if filler else None,
+        #                 filler.text if filler else None,
+        #                 task.filler_sent_ms,
+        #                 usage.cached_tokens,
+        #                 usage.ttft_ms,
+        #                 usage.itl_ms,
+        #                 usage.usage_source,
         #             )
-        #             """,
-        #             session_id,
-        #             turn_index,
-        #             model_set_id,
-        #             stt_latency,
-        #             user_text,
-        #             vlm_latency,
-        #             vlm_tokens_in,
-        #             vlm_tokens_out,
-        #             vlm_tok_per_sec,
-        #         )
+        #     except Exception as e:
+        #         print("⚠️ turn logging failed:", e)
 
     ###############################
     # Emit helpers                #
     ###############################
+    async def publish(task: UtteranceTask, seq: int, text: str):
+        if not task.released:
+            task.held.append((seq, text))
+            return
+        await emit_sentence(task, seq, text)
+        tts_scheduler.submit(task.id, task.turn, seq, text, task.cancel_event)
+
+    async def release_held(task: UtteranceTask, user_text: str) -> bool:
+        """Wait for commit/cancel; on commit flush held output in order."""
+        commit = asyncio.create_task(task.committed.wait())
+        cancel = asyncio.create_task(task.cancel_event.wait())
+        await asyncio.wait(
+            {commit, cancel}, return_when=asyncio.FIRST_COMPLETED
+        )
+        commit.cancel()
+        cancel.cancel()
+        if task.cancel_event.is_set():
+            task.held.clear()
+            return False
+
+        await ws.send_json({"type": "transcription", "message": user_text})
+        while task.held:
+            seq, text = task.held.pop(0)
+            await emit_sentence(task, seq, text)
+            tts_scheduler.submit(
+                task.id, task.turn, seq, text, task.cancel_event
+            )
+        task.released = True
+        return True
+
+    async def send_filler(
+        task: UtteranceTask, user_text: str, has_image: bool, started: float
+    ):
+        """Send a filler if the first token misses the threshold."""
+        try:
+            await asyncio.wait_for(
+                task.first_token.wait(), filler_threshold_ms / 1000
+            )
+            return
+        except asyncio.TimeoutError:
+            pass
+        if task.cancel_event.is_set() or not task.released:
+            return
+        filler = filler_bank.pick(user_text, has_image)
+        if filler is None:  # bank still warming up
+            return
+        task.filler = filler
+        task.filler_sent_ms = int(
+            (asyncio.get_event_loop().time() - started) * 1000
+        )
+        print(f"🗣️ filler '{filler.text}' at {task.filler_sent_ms}ms")
+        try:
+            await audio_transport.send(
+                ws,
+                {
+                    "type": "assistant_filler",
+                    "id": task.id,
+                    "message": filler.text,
+                },
+                filler.audio,
+                tts.audio_format,
+                turn=task.turn,
+                flags=FLAG_FILLER,
+            )
+        except Exception as e:
+            print("filler send failed:", e)
+
     async def emit_sentence(task: UtteranceTask, seq: int, text: str):
         payload = {
             "type": "assistant_chunk",
@@ -336,27 +636,35 @@ async def ws_image_stream(ws: WebSocket):
         }
         await ws.send_json(payload)
 
-    async def tts_worker(task: UtteranceTask, seq: int, text: str):
-        if task.cancel_event.is_set():
-            return
+    async def send_audio(job: TTSJob, audio: bytes, final: bool):
+        # Called by the scheduler in seq order per turn
         try:
-            audio64 = await asyncio.to_thread(tts.synthesize_to_base64, text)
-            await ws.send_json(
+            await audio_transport.send(
+                ws,
                 {
                     "type": "assistant_audio_chunk",
-                    "id": task.id,
-                    "seq": seq,
-                    "audio_base64": audio64,
-                }
+                    "id": job.turn_id,
+                    "seq": job.seq,
+                    "final": final,
+                },
+                audio,
+                tts.audio_format,
+                turn=job.turn,
+                seq=job.seq,
+                flags=0 if final else FLAG_PARTIAL,
             )
         except Exception as e:
-            print("TTS chunk failed:", e)
+            print("TTS chunk send failed:", e)
+
+    tts_scheduler = TTSScheduler(tts, send_audio, stream=tts_stream)
 
     ###############################
     # Run loops                   #
     ###############################
     recv_task = asyncio.create_task(recv_loop())
     trans_task = asyncio.create_task(trans_loop())
+    partial_task = asyncio.create_task(partial_loop())
+    tts_scheduler.start()
 
     try:
         await asyncio.gather(recv_task, trans_task)
@@ -365,5 +673,8 @@ async def ws_image_stream(ws: WebSocket):
     finally:
         recv_task.cancel()
         trans_task.cancel()
+        partial_task.cancel()
+        await tts_scheduler.close()
+        await memory.close()
         await transcriber.stop()
         print("🛑 stream session closed")
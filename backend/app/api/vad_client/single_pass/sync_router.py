@@ -6,7 +6,14 @@ from typing import Optional
 
 import numpy as np
 import scipy.io.wavfile as wav
-from api.modules.response_generation.vlm.types import GenerationResult
+from api.modules.response_generation.vlm.types import (
+    GenerationResult,
+    tokens_per_sec,
+)
+from api.utils.audio_resampler import PcmConverter, PcmFormat
+from api.utils.audio_transport import AudioTransport
+from api.utils.conversation_store import new_conversation
+from api.utils.image_store import IMAGE_MESSAGES, ImageStore, StoredImage
 from api.utils.invalid_transcription import is_invalid_transcription
 from api.utils.model_selector import (
     get_response_instance,
@@ -14,14 +21,14 @@ from api.utils.model_selector import (
     get_tts_instance,
 )
 from api.utils.model_set import make_set_id
+from api.utils.pcm_ring_buffer import PcmRingBuffer
 from asyncpg import Pool
 from db.session import get_pool
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 router = APIRouter()
 
-MAX_HISTORY = 5
-conversation_history: list[dict] = []
+MAX_UTTERANCE_SEC = 60  # 1 発話あたりの受信上限（超過分は破棄）
 
 
 # ───────── データクラス ─────────
@@ -54,13 +61,38 @@ async def we_image_endpoint(ws: WebSocket):
     init = await ws.receive_json()
     model_name = init.get("model", "rumina-m2")
     vad_silence_ms = init.get("vad_silence_threshold", 1000)
+    # 端末のネイティブ形式（48kHz/float32/stereo 等）で受け取りサーバ側で変換する
+    # （非対応の形式なら既定形式で受け、init_ack で実際の形式とエラーを返す）
+    pcm_format, pcm_error = PcmFormat.negotiate(init.get("audio_format"))
+    pcm_converter = PcmConverter(pcm_format)
+    # 合成音声の送信経路（JSON+base64 / バイナリフレーム）とコーデック
+    audio_transport, transport_error = AudioTransport.negotiate(init)
     print(f"📝 model={model_name}  vad={vad_silence_ms}ms")
+    if init.keys() & {
+        "audio_transport",
+        "audio_codec",
+        "audio_pcm_rate",
+        "audio_format",
+    }:
+        await ws.send_json(
+            {
+                "type": "init_ack",
+                "audio": audio_transport.describe(transport_error),
+                "audio_format": pcm_format.describe(pcm_error),
+            }
+        )
 
     # モジュール取得
-    transcriber = get_transcriber_instance(model_name)
+    # 初回は Whisper の重みのロードになるのでイベントループ外で生成する
+    transcriber = await asyncio.to_thread(get_transcriber_instance, model_name)
     await transcriber.start()
     vlm = get_response_instance(model_name)
-    tts = get_tts_instance(model_name)
+    # 初回はモデル（とレプリカ）のロードになるのでイベントループ外で取得する
+    tts = await asyncio.to_thread(get_tts_instance, model_name)
+    # セッションごとの履歴（トークン予算で切り詰める）
+    memory = new_conversation(vlm.model_name)
+    # セッションごとの画像（ハッシュで参照、生バイトで保持）
+    images = ImageStore()
 
     # model 情報をログ出力
     print(f"STT_name: {transcriber.model_name}")
@@ -102,7 +134,9 @@ async def we_image_endpoint(ws: WebSocket):
     transcriber.set_silence_threshold(max((vad_silence_ms / 1000) - 0.3, 0.05))
 
     # ────── 状態変数 ──────
-    audio_buf = bytearray()
+    # 1 発話分の PCM。容量固定で、溢れた分は捨ててクライアントに通知する
+    audio_buf = PcmRingBuffer(int(MAX_UTTERANCE_SEC * 16_000))
+    overflow_notified = False
     current_task: Optional[UtteranceTask] = None
     current_speech_id = 0
     buffer_speech_id = 0  # ★ START〜END 間の ID
@@ -111,6 +145,7 @@ async def we_image_endpoint(ws: WebSocket):
     # ────── 音声と画像受信 ──────
     async def recv_loop():
         nonlocal current_task, current_speech_id, buffer_speech_id
+        nonlocal overflow_notified
         while True:
             try:
                 msg = await ws.receive()
@@ -124,25 +159,46 @@ async def we_image_endpoint(ws: WebSocket):
                         current_speech_id += 1
                         buffer_speech_id = current_speech_id
                         audio_buf.clear()
+                        overflow_notified = False
                         print("🎙️ START", current_speech_id)
 
                         if current_task:
                             current_task.cancel_event.set()
 
+                        # 従来形式（開始ごとに画像を丸ごと送る）
                         if img := data.get("image_base64"):
-                            transcriber.update_latest_image(img)
+                            await images.put_base64(img)
+
+                    # --- 画像（ハッシュ提示 / 要求された画像のアップロード）---
+                    elif data["type"] in IMAGE_MESSAGES:
+                        await ws.send_json(await images.handle(data))
 
                     # --- END ---
                     elif data["type"] == "active_audio_end":
                         print("🛑 END -> transcribe")
                         await transcriber.transcribe_audio_chunk(
-                            bytes(audio_buf)
+                            audio_buf.view_bytes()
                         )
                         await pending_ids.put(buffer_speech_id)
 
                 # === バイナリ（PCM） ===
                 elif "bytes" in msg:
-                    audio_buf.extend(msg["bytes"])
+                    dropped = audio_buf.dropped_samples
+                    audio_buf.write(pcm_converter.convert(msg["bytes"]))
+                    if (
+                        audio_buf.dropped_samples > dropped
+                        and not overflow_notified
+                    ):
+                        # 上限超過分は捨て、1 発話につき 1 度だけ通知する
+                        overflow_notified = True
+                        print("⚠️ 音声バッファが上限に達したため破棄")
+                        await ws.send_json(
+                            {
+                                "type": "audio_overflow",
+                                "speech_id": buffer_speech_id,
+                                "max_sec": MAX_UTTERANCE_SEC,
+                            }
+                        )
 
             except Exception as e:
                 print("recv_loop error:", e)
@@ -168,15 +224,8 @@ async def we_image_endpoint(ws: WebSocket):
 
                 await ws.send_json({"type": "transcription", "message": text})
 
-                # 履歴
-                hist = [
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant.",
-                    }
-                ]
-                hist.extend(conversation_history[-MAX_HISTORY * 2 :])
-                hist.append({"role": "user", "content": text})
+                # 履歴（過去のターンのみ。今回の発話は VLM 側で付ける）
+                hist = memory.messages()
 
                 # タスク生成
                 task = UtteranceTask(
@@ -188,7 +237,7 @@ async def we_image_endpoint(ws: WebSocket):
                     handle_utterance(
                         task,
                         text,
-                        transcriber.latest_image_base64,
+                        images.latest,
                         hist,
                         session_id,
                         turn_index,
@@ -205,7 +254,7 @@ async def we_image_endpoint(ws: WebSocket):
     async def handle_utterance(
         task: UtteranceTask,
         user_text: str,
-        img_b64: str | None,
+        image: StoredImage | None,
         hist: list,
         session_id: str,
         turn_index: int,
@@ -219,7 +268,7 @@ async def we_image_endpoint(ws: WebSocket):
         vlm_start = asyncio.get_event_loop().time()
         result: GenerationResult = await vlm.generate(
             message=user_text,
-            image_base64=img_b64,
+            image=image,
             history=hist,
         )
         vlm_latency = int((asyncio.get_event_loop().time() - vlm_start) * 1000)
@@ -227,9 +276,7 @@ async def we_image_endpoint(ws: WebSocket):
         vlm_tokens_in = result.prompt_tokens
         vlm_tokens_out = result.completion_tokens
 
-        vlm_tok_per_sec = (
-            vlm_tokens_out / (vlm_latency / 1000) if vlm_latency > 0 else None
-        )
+        vlm_tok_per_sec = tokens_per_sec(result, vlm_latency)
 
         resp_text = result.content
 
@@ -250,9 +297,18 @@ async def we_image_endpoint(ws: WebSocket):
         tts_start = asyncio.get_event_loop().time()
         tts_latency = None
         try:
-            audio64 = await asyncio.to_thread(
-                tts.synthesize_to_base64, resp_text
-            )
+            # 割り込まれたら合成（API のストリーム）も打ち切る
+            synth = asyncio.create_task(tts.synthesize_async(resp_text))
+            cancelled = asyncio.create_task(task.cancel_event.wait())
+            try:
+                await asyncio.wait(
+                    {synth, cancelled}, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                cancelled.cancel()
+            if not synth.done():
+                synth.cancel()
+            audio = synth.result() if synth.done() else b""
         except Exception as e:
             print("TTS failed:", e)
             await ws.send_json(
@@ -281,21 +337,16 @@ async def we_image_endpoint(ws: WebSocket):
                 (asyncio.get_event_loop().time() - tts_start) * 1000
             )
             print(f"🎵 TTS latency: {tts_latency}ms")
-            await ws.send_json(
-                {
-                    "type": "ai_response",
-                    "id": task.id,
-                    "message": resp_text,
-                    "audio_base64": audio64,
-                }
+            await audio_transport.send(
+                ws,
+                {"type": "ai_response", "id": task.id, "message": resp_text},
+                audio,
+                tts.audio_format,
+                turn=turn_index,
             )
 
         # 履歴追加
-        conversation_history.append(
-            {"role": "assistant", "content": resp_text}
-        )
-        if len(conversation_history) > MAX_HISTORY * 2:
-            conversation_history[:] = conversation_history[-MAX_HISTORY * 2 :]
+        memory.add_turn(user_text, resp_text)
 
         # --- 総ターンレイテンシー ---
         if tts_latency is None:
@@ -322,6 +373,10 @@ async def we_image_endpoint(ws: WebSocket):
                     vlm_tokens_in,
                     vlm_tokens_out,
                     vlm_tok_per_sec,
+                    vlm_cached_tokens,
+                    vlm_ttft_ms,
+                    vlm_itl_ms,
+                    vlm_usage_source,
 
                     tts_latency_ms,
 
@@ -335,25 +390,29 @@ async def we_image_endpoint(ws: WebSocket):
 
                     $4, $5,
 
-                    $6, $7, $8, $9,
+                    $6, $7, $8, $9, $12, $13, $14, $15,
 
                     $10,
 
                     $11, NULL, NULL, NULL
                     )
                     """,
-                    # $1…$10 の対応
+                    # $1…$15 の対応
                     session_id,  # $1
                     turn_index,  # $2
                     model_set_id,  # $3
                     stt_latency,  # $4: stt_latency_ms
                     user_text,  # $5: transcript
                     vlm_latency,  # $6
-                    vlm_tokens_in,  # $7: vlm_tokens_in 仮
-                    vlm_tokens_out,  # $8: vlm_tokens_out 仮
+                    vlm_tokens_in,  # $7: vlm_tokens_in
+                    vlm_tokens_out,  # $8: vlm_tokens_out
                     vlm_tok_per_sec,  # $9: vlm_tok_per_sec
                     tts_latency,  # $10: tts_latency_ms
                     total_latency,  # $11: total_turn_latency_ms
+                    result.cached_tokens,  # $12: vlm_cached_tokens
+                    result.ttft_ms,  # $13: vlm_ttft_ms
+                    result.itl_ms,  # $14: vlm_itl_ms
+                    result.usage_source,  # $15: vlm_usage_source
                 )
         else:
             print("DB pool is None, skipping DB insert.")
@@ -369,5 +428,6 @@ async def we_image_endpoint(ws: WebSocket):
     finally:
         recv_task.cancel()
         trans_task.cancel()
+        await memory.close()
         await transcriber.stop()
         print("🛑 session closed")
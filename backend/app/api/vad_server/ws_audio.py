@@ -1,26 +1,32 @@
 import asyncio
+import base64
 
 from api.modules.transcribers.whisper_transcriber_in_vad import (
     WhisperAudioTranscriber,
 )
+from api.utils.conversation_store import new_conversation
 from api.utils.invalid_transcription import is_invalid_transcription
-from api.utils.model_selector import tts_instance
+from api.utils.model_selector import get_tts_instance
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from services.openai_chat import get_chat_response
 
-transcriber_instance = WhisperAudioTranscriber(use_vad=True)
-
 router = APIRouter()
 
-MAX_HISTORY = 5
-conversation_history = []
-
 
 @router.websocket("/ws/audio")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("✅ WebSocket 接続を受け付けました")
 
+    # Whisper / TTS モデルは共有し、セッションごとに軽量な状態だけを作る
+    # （初回はモデルのロードになるのでイベントループ外で取得する）
+    transcriber_instance = await asyncio.to_thread(
+        WhisperAudioTranscriber, use_vad=True
+    )
+    tts_instance = await asyncio.to_thread(get_tts_instance, "rumina-m1")
+    # セッションごとの会話履歴（トークン予算で切り詰める）
+    memory = new_conversation("gpt-3.5-turbo")
+
     # 文字起こし処理開始
     await transcriber_instance.start()
 
@@ -41,23 +47,14 @@ async def websocket_endpoint(websocket: WebSocket):
                 {"type": "transcription", "message": transcription}
             )
 
-            history_messages = [
-                {"role": "system", "content": "You are a helpful assistant."}
-            ]
-            history_messages.extend(
-                conversation_history[-(MAX_HISTORY * 2) :]
-            )  # user/assistantセットで *2
-            history_messages.append({"role": "user", "content": transcription})
-
-            # ChatGPT へ問い合わせ（非同期）
-            response = await asyncio.to_thread(
-                get_chat_response, transcription, history_messages
+            # ChatGPT へ問い合わせ（非同期、履歴は過去のターンのみ）
+            response = await get_chat_response(
+                transcription, memory.messages()
             )
 
             # 音声合成処理
-            audio_base64 = await asyncio.to_thread(
-                tts_instance.synthesize_to_base64, response
-            )
+            audio = await tts_instance.synthesize_async(response)
+            audio_base64 = base64.b64encode(audio).decode("utf-8")
 
             # クライアントへ ChatGPT の応答を送信
             await websocket.send_json(
@@ -68,13 +65,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 }
             )
 
-            # 全体の履歴は常に蓄積されている
-            conversation_history.append(
-                {"role": "user", "content": transcription}
-            )
-            conversation_history.append(
-                {"role": "assistant", "content": response}
-            )
+            # 完了したターンを履歴に追加
+            memory.add_turn(transcription, response)
 
     # 並行タスクとして音声受信と結果送信を実行
     receive_task = asyncio.create_task(receive_audio())
@@ -89,5 +81,6 @@ async def websocket_endpoint(websocket: WebSocket):
     finally:
         receive_task.cancel()
         send_task.cancel()
+        await memory.close()
         await transcriber_instance.stop()
         print("🛑 録音セッション終了")
@@ -1,27 +1,45 @@
 import asyncio
 import base64
+import json
 from pathlib import Path
 
 from api.modules.transcribers.whisper_transcriber_in_vad import (
     WhisperAudioTranscriber,
 )
+from api.utils.audio_resampler import PcmConverter, PcmFormat
+from api.utils.audio_transport import AudioTransport
+from api.utils.binary_framing import (
+    FRAME_AUDIO,
+    FRAME_IMAGE,
+    IMAGE_MIME,
+    parse_frame,
+)
+from api.utils.conversation_store import new_conversation
+from api.utils.image_store import IMAGE_MESSAGES, ImageStore
 from api.utils.invalid_transcription import is_invalid_transcription
-from api.utils.model_selector import tts_instance
+from api.utils.model_selector import get_tts_instance
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from services.openai_chat import get_multimodal_response
 
-transcriber_instance = WhisperAudioTranscriber(use_vad=True)
 router = APIRouter()
 
-MAX_HISTORY = 5
-conversation_history = []
-
 
 @router.websocket("/ws/image")
 async def we_image_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("✅ WebSocket 接続を受け付けました")
 
+    # Whisper / TTS モデルは共有し、セッションごとに軽量な状態だけを作る
+    # （初回はモデルのロードになるのでイベントループ外で取得する）
+    transcriber_instance = await asyncio.to_thread(
+        WhisperAudioTranscriber, use_vad=True
+    )
+    tts_instance = await asyncio.to_thread(get_tts_instance, "rumina-m1")
+    # セッションごとの会話履歴（トークン予算で切り詰める）
+    memory = new_conversation("gpt-4o")
+    # セッションごとの画像（ハッシュで参照、生バイトで保持）
+    images = ImageStore()
+
     # 文字起こし処理開始
     await transcriber_instance.start()
 
@@ -36,23 +54,89 @@ async def we_image_endpoint(websocket: WebSocket):
         except Exception as e:
             print("⚠️ 画像の保存に失敗しました:", e)
 
+    # init で "framing": "binary" が届いたらバイナリフレームを受け付ける
+    binary_framing = False
+    # init の "audio_format" に応じてモデル入力形式へ変換する（既定は無変換）
+    pcm_converter = PcmConverter(PcmFormat())
+    # init の "audio_transport" / "audio_codec" で合成音声の送信方法を切り替える
+    audio_transport = AudioTransport()
+
+    async def handle_binary_frame(frame: bytes):
+        try:
+            header, payload = parse_frame(frame)
+            if header.kind == FRAME_AUDIO:
+                # 16kHz/int16/mono ならペイロードをコピーせず VAD のバッファへ
+                await transcriber_instance.put_audio_chunk(
+                    pcm_converter.convert(payload)
+                )
+            elif header.kind == FRAME_IMAGE:
+                # Base64 を経由せずそのままストアへ（ハッシュは ack で返す）
+                reply = await images.put(
+                    bytes(payload), IMAGE_MIME.get(header.fmt, "image/png")
+                )
+                transcriber_instance.update_latest_image(images.latest)
+                await websocket.send_json(reply)
+            else:
+                print("⚠️ 未知のフレーム種別:", header.kind)
+        except ValueError as e:
+            # 壊れたフレーム 1 つでセッション全体を落とさない
+            print("⚠️ 不正なフレームを破棄:", e)
+
     async def receive_audio_and_image():
+        nonlocal binary_framing, pcm_converter, audio_transport
         while True:
-            data = await websocket.receive_json()
-            if data["type"] == "audio_chunk":
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(msg.get("code", 1000))
+
+            # === バイナリフレーム ===
+            if msg.get("bytes") is not None:
+                if binary_framing:
+                    await handle_binary_frame(msg["bytes"])
+                else:
+                    print("⚠️ framing 未交渉のバイナリを破棄")
+                continue
+
+            # === JSON 制御メッセージ ===
+            data = json.loads(msg["text"])
+            if data["type"] == "init":
+                binary_framing = data.get("framing") == "binary"
+                # 非対応の形式なら既定形式で受け、実際の形式とエラーを返す
+                pcm_format, pcm_error = PcmFormat.negotiate(
+                    data.get("audio_format")
+                )
+                pcm_converter = PcmConverter(pcm_format)
+                audio_transport, transport_error = AudioTransport.negotiate(
+                    data
+                )
+                await websocket.send_json(
+                    {
+                        "type": "init_ack",
+                        "framing": "binary" if binary_framing else "json",
+                        "audio": audio_transport.describe(transport_error),
+                        "audio_format": pcm_format.describe(pcm_error),
+                    }
+                )
+            elif data["type"] == "audio_chunk":
                 # 音声チャンクを送信
                 await transcriber_instance.put_audio_chunk(
-                    bytes.fromhex(data["audio_hex"])
+                    pcm_converter.convert(bytes.fromhex(data["audio_hex"]))
                 )
             elif data["type"] == "image":
-                # 画像データの更新
-                transcriber_instance.update_latest_image(data["image_base64"])
+                # 画像データの更新（従来形式）
+                await images.put_base64(data.get("image_base64"))
+                transcriber_instance.update_latest_image(images.latest)
+            elif data["type"] in IMAGE_MESSAGES:
+                # ハッシュの提示 / 要求された画像のアップロード
+                await websocket.send_json(await images.handle(data))
+                transcriber_instance.update_latest_image(images.latest)
 
     async def transcription_to_response_pipeline():
+        turn_index = 0
         while True:
             bundle = await transcriber_instance.result_bundle_queue.get()
             transcription = bundle["text"]
-            image_base64 = bundle["image"]
+            image = bundle["image"]
 
             if is_invalid_transcription(transcription):
                 print("⏭️ 無効な文字起こしをスキップ：", transcription)
@@ -62,45 +146,28 @@ async def we_image_endpoint(websocket: WebSocket):
                 {"type": "transcription", "message": transcription}
             )
 
-            history_messages = [
-                {"role": "system", "content": "You are a helpful assustant."}
-            ]
-            # 過去の会話履歴の一部を追加
-            history_messages.extend(conversation_history[-(MAX_HISTORY * 2) :])
-
-            # ユーザーの指示を追加
-            history_messages.append({"role": "user", "contect": transcription})
-
-            # ChatGPTへ問い合わせ（非同期）
-            # TODO: ここの処理で画像を含めて処理するための関数を用意する必要がある
-            response = await asyncio.to_thread(
-                get_multimodal_response,
+            # ChatGPTへ問い合わせ（非同期、履歴は過去のターンのみ）
+            response = await get_multimodal_response(
                 message=transcription,
-                image_base64=image_base64,
-                history=history_messages,
+                image=image,
+                history=memory.messages(),
             )
 
             # 音声合成処理
-            audio_base64 = await asyncio.to_thread(
-                tts_instance.synthesize_to_base64, response
-            )
+            audio = await tts_instance.synthesize_async(response)
 
             # クライアントへ 応答を送信
-            await websocket.send_json(
-                {
-                    "type": "ai_response",
-                    "message": response,
-                    "audio_base64": audio_base64,
-                }
+            turn_index += 1
+            await audio_transport.send(
+                websocket,
+                {"type": "ai_response", "message": response},
+                audio,
+                tts_instance.audio_format,
+                turn=turn_index,
             )
 
             # 会話履歴に追加
-            conversation_history.append(
-                {"role": "user", "content": transcription}
-            )
-            conversation_history.append(
-                {"role": "assistant", "content": response}
-            )
+            memory.add_turn(transcription, response)
 
     # 並行タスクとして非同期で音声受信と結果作成および送信を実行
     receive_task = asyncio.create_task(receive_audio_and_image())
@@ -115,5 +182,6 @@ async def we_image_endpoint(websocket: WebSocket):
     finally:
         receive_task.cancel()
         send_task.cancel()
+        await memory.close()
         await transcriber_instance.stop()
         print("🛑 録音セッション終了")
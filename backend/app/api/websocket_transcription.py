@@ -1,4 +1,8 @@
-from services.audio_transcriber import WhisperAudioTranscriber
+from api.modules.transcribers.whisper_transcriber_in_vad import (
+    WhisperAudioTranscriber,
+)
 
-# Whisper モデルの初期化とタスク起動
-transcriber_instance = WhisperAudioTranscriber(use_vad=True)
+
+def create_transcriber_instance() -> WhisperAudioTranscriber:
+    # Whisper モデルはレジストリで共有されるため、セッションごとに生成しても軽量
+    return WhisperAudioTranscriber(use_vad=True)
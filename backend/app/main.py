@@ -1,6 +1,10 @@
+import asyncio
+import os
 from contextlib import asynccontextmanager
 
+from api.modules.fillers.filler_bank import get_filler_bank
 from api.routes import router
+from api.utils.model_selector import get_tts_instance
 from api.vad_client.single_pass.stream_router import router as stream_router
 from api.vad_client.single_pass.sync_router import router as m_image_router
 from api.vad_server.ws_audio import router as websocket_router
@@ -8,21 +12,37 @@ from api.vad_server.ws_image import router as image_router
 from db.session import get_pool
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from services.openai_client import (
+    close_async_openai,
+    prewarm_async_openai,
+)
+
 
-app = FastAPI()
+def prewarm_fillers():
+    """FILLER_PREWARM_MODELS（カンマ区切りのモデル名）のフィラーを合成しておく"""
+    names = os.getenv("FILLER_PREWARM_MODELS", "").split(",")
+    for model_name in filter(None, map(str.strip, names)):
+        tts = get_tts_instance(model_name)
+        get_filler_bank(tts, background=False).prepare()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- アプリ起動時 -------------------------------------------------
     await get_pool()  # プールを生成（シングルトン）
+    await asyncio.gather(
+        asyncio.to_thread(prewarm_fillers), prewarm_async_openai()
+    )
 
     yield  # ここでリクエストをさばく
 
     # --- アプリ終了時 -------------------------------------------------
     pool = await get_pool()
     await pool.close()
+    await close_async_openai()
+
 
+app = FastAPI(lifespan=lifespan)
 
 # CORSミドルウェア
 app.add_middleware(
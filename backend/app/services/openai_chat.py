@@ -1,29 +1,32 @@
 import os
 
+from api.utils.image_preprocess import prepare_image
+from api.utils.image_store import StoredImage
 from dotenv import load_dotenv
-from openai import OpenAI
+from services.openai_client import get_async_openai, with_retries
 
 load_dotenv()
 
-# OpenAIのAPIキー
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_clinet = OpenAI(api_key=OPENAI_API_KEY)
+# 1 回の呼び出しの上限秒数
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "30"))
 
 
-def get_chat_response(message: str, history: list[dict[str, str]] = []) -> str:
+async def get_chat_response(
+    message: str, history: list[dict[str, str]] = []
+) -> str:
     """
     ChatGPTに対してユーザーの入力（+履歴）を送信し、応答を返す。
 
     Args:
         message (str): 現在のユーザーの入力メッセージ
-        history (List[str]): 過去の発話履歴（任意）
+        history (list[dict]): 過去のターン（今回の入力は含めない）
 
     Returns:
         str: ChatGPTからの応答メッセージ
     """
     messages = [{"role": "system", "content": "You are a helpful assistant."}]
 
-    # 過去の履歴も user 発話として追加（必要に応じて role を分けてもOK）
+    # 過去のターン（今回の入力は下で追加する）
     for h in history:
         messages.append(h)
 
@@ -31,82 +34,124 @@ def get_chat_response(message: str, history: list[dict[str, str]] = []) -> str:
     messages.append({"role": "user", "content": message})
 
     # OpenAI Chat API 呼び出し
-    response = openai_clinet.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages,
-        max_tokens=54,
-        temperature=1,
-        top_p=0.5,
-        frequency_penalty=0,
-        presence_penalty=0,
+    client = get_async_openai()
+    response = await with_retries(
+        lambda: client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=54,
+            temperature=1,
+            top_p=0.5,
+            frequency_penalty=0,
+            presence_penalty=0,
+            timeout=OPENAI_CHAT_TIMEOUT,
+        )
     )
 
     # 最初の選択肢を返す
     return response.choices[0].message.content.strip()
 
 
-def get_multimodal_response(
+async def get_multimodal_response(
     message: str,
-    image_base64: str,
+    image: StoredImage | str | None,
     history: list[dict[str, str]] = [],
     system_prompt: str = (
         "あなたは気さくで話しやすい会話アシスタントです。"
         "ユーザーとは友達感覚で話し、長すぎる説明は避け、テンポよく短めの発言を心がけてください。"
         "必要以上に丁寧すぎず、自然な口調でカジュアルに答えてください。"
         "ユーザーの発言が画像に関係ない場合、視覚情報には言及せず、テキストだけで返答してください。"
-    )
+    ),
 ) -> str:
     """
     GPT-4o を使って画像とテキストのマルチモーダル入力に基づいて応答を返す。
 
     Args:
         message (str): ユーザーからの質問・指示などのテキスト
-        image_base64 (str): Base64でエンコードされた画像（JPEG/PNGなど）
-        history (list[dict]): 過去のチャット履歴
+        image (StoredImage | str | None): 画像（ImageStore の画像、または
+            Base64 でエンコードされた JPEG/PNG など）。
+            まだ画像が届いていなければ None（テキストのみで応答）
+        history (list[dict]): 過去のターン（今回の入力は含めない）
         system_prompt (str): システムプロンプト
 
     Returns:
         str: GPT-4oによる応答テキスト
     """
 
-    # Base64文字列からプレフィックス（例: data:image/jpeg;base64,）を取り除く
-    if image_base64.startswith("data:image"):
-        image_base64 = image_base64.split(",")[1]
-
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(history)
 
-    image_url = {"url": f"data:image/png;base64,{image_base64}"}
-
     # ユーザーの画像付き発話
-    messages = [
-        {"role": "system", "content": system_prompt},
+    content = [
         {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": message,
-                },
-                {
-                    "type": "image_url",
-                    "image_url": image_url,
-                },
-            ],
-        },
+            "type": "text",
+            "text": message,
+        }
     ]
+    if image:
+        # 縮小・再エンコードして正しい MIME の data URL にする
+        prepared = await prepare_image(image, "gpt-4o")
+        content.append(prepared.content_block())
+    messages.append({"role": "user", "content": content})
+
+    client = get_async_openai()
+    response = await with_retries(
+        lambda: client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=500,
+            temperature=1,
+            timeout=OPENAI_CHAT_TIMEOUT,
+        )
+    )
+
+    return response.choices[0].message.content.strip()
 
-    response = openai_clinet.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500,
-        temperature=1,
+
+async def summarize_conversation(
+    previous_summary: str | None, messages: list[dict[str, str]]
+) -> str:
+    """
+    履歴からあふれたターンをこれまでの要約に取り込み、新しい要約を返す。
+    モデルは OPENAI_SUMMARY_MODEL（既定 gpt-4o-mini）。
+
+    Args:
+        previous_summary (str | None): これまでの要約
+        messages (list[dict]): 要約に追加するメッセージ
+
+    Returns:
+        str: 新しい要約
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        f"これまでの要約:\n{previous_summary or '（なし）'}\n\n"
+        f"続きの会話:\n{transcript}"
     )
 
+    client = get_async_openai()
+    response = await with_retries(
+        lambda: client.chat.completions.create(
+            model=os.getenv("OPENAI_SUMMARY_MODEL", "gpt-4o-mini"),
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "会話の要約を更新してください。"
+                        "ユーザーについての事実・話題・約束事を残し、"
+                        "200 字以内の日本語で要約だけを出力してください。"
+                    ),
+                },
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=300,
+            temperature=0,
+            timeout=OPENAI_CHAT_TIMEOUT,
+        )
+    )
     return response.choices[0].message.content.strip()
 
 
 # if __name__ == "__main__":
 #     test_message = "こんにちは！調子はどう？"
-#     result = get_chat_response(test_message)
+#     result = asyncio.run(get_chat_response(test_message))
 #     print("🤖 ChatGPTの応答:", result)
@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import os
+import random
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# プロセス内で共有する非同期クライアント（接続を keep-alive で使い回す）
+_async_client: AsyncOpenAI | None = None
+
+# 再試行する例外（接続失敗・タイムアウト・429・5xx）
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def _timeout() -> httpx.Timeout:
+    """OPENAI_CONNECT_TIMEOUT（既定 5 秒）/ OPENAI_READ_TIMEOUT（既定 30 秒）"""
+    return httpx.Timeout(
+        float(os.getenv("OPENAI_READ_TIMEOUT", "30")),
+        connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+    )
+
+
+def get_async_openai() -> AsyncOpenAI:
+    """
+    共有の AsyncOpenAI を返す。
+    OPENAI_BASE_URL を指定するとローカルのスタブサーバー等へ向けられる。
+    再試行は SDK ではなく with_retries で行う（max_retries=0）。
+    """
+    global _async_client
+    if _async_client is None:
+        max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+        http_client = httpx.AsyncClient(
+            timeout=_timeout(),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=int(
+                    os.getenv("OPENAI_MAX_KEEPALIVE", max_connections)
+                ),
+                keepalive_expiry=float(
+                    os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120")
+                ),
+            ),
+        )
+        _async_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeout=_timeout(),
+            max_retries=0,
+            http_client=http_client,
+        )
+    return _async_client
+
+
+def max_retries() -> int:
+    """OPENAI_MAX_RETRIES（既定 2）"""
+    return int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+
+def backoff_delay(attempt: int, error: Exception | None = None) -> float:
+    """
+    attempt 回目（0 始まり）の再試行までの待ち秒数。
+    指数バックオフに full jitter をかけ、429 の Retry-After があれば従う。
+    """
+    delay = random.uniform(0, min(8.0, 0.25 * 2**attempt))
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            delay = max(delay, min(float(retry_after), 8.0))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+async def with_retries(
+    call: Callable[[], Awaitable[T]], retries: int | None = None
+) -> T:
+    """call() を実行し、一時的なエラーなら間隔を空けて再試行する"""
+    retries = max_retries() if retries is None else retries
+    for attempt in itertools.count():
+        try:
+            return await call()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(
+                f"🔁 OpenAI API 再試行 {attempt + 1}/{retries} "
+                f"({delay:.2f}s 後): {type(e).__name__}"
+            )
+            await asyncio.sleep(delay)
+
+
+async def prewarm_async_openai():
+    """
+    起動時に接続を張っておく（TLS ハンドシェイクを初回リクエストから外す）。
+    OPENAI_PREWARM_CONNECTIONS（既定 2、0 で無効）本を並列に開く。
+    """
+    n = int(os.getenv("OPENAI_PREWARM_CONNECTIONS", "2"))
+    if n <= 0:
+        return
+    client = get_async_openai()
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(client.models.list(), timeout=10)
+            for _ in range(n)
+        ),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        print(f"⚠️ OpenAI 接続の事前確立に失敗: {errors[0]!r}")
+    else:
+        print(f"🔌 OpenAI 接続を事前確立 ({n} 本)")
+
+
+async def close_async_openai():
+    """アプリ終了時に接続プールを閉じる"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
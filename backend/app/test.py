@@ -2,6 +2,7 @@
 import asyncio
 
 from api.modules.response_generation.vlm.openai_vlm import OpenAIVLM
+from api.modules.response_generation.vlm.types import GenerationResult
 
 
 async def main() -> None:
@@ -12,10 +13,19 @@ async def main() -> None:
     user_message = "こんにちは！夏休みのおすすめ旅行先を教えて。"
 
     print(">>> streaming response:")
+    usage = None
     async for token in vlm.stream_generate(user_message):
+        if isinstance(token, GenerationResult):
+            usage = token  # 最後に届く使用量
+            continue
         print(token, end="", flush=True)  # トークン到着ごとに出力
 
     print("\n>>> done")
+    if usage is not None:
+        print(
+            f">>> tokens in={usage.prompt_tokens} "
+            f"out={usage.completion_tokens} ttft={usage.ttft_ms}ms"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+-- ---------- フィラー ---------- --
+CREATE TABLE filler_catalog (
+  filler_id  TEXT PRIMARY KEY,
+  short_key  TEXT UNIQUE NOT NULL,
+  language   TEXT,
+  notes      TEXT
+);
+
+INSERT INTO filler_catalog(filler_id,short_key,language,notes)
+VALUES
+('ack_ja_v1','ack-ja','ja','事前合成した相槌・つなぎ言葉');
+
+-- filler_id は VLM ではなくフィラーセットを指す
+ALTER TABLE model_set_catalog
+  DROP CONSTRAINT model_set_catalog_filler_id_fkey,
+  ADD CONSTRAINT model_set_catalog_filler_id_fkey
+    FOREIGN KEY (filler_id) REFERENCES filler_catalog(filler_id);
+
+-- ターンごとに使ったフィラー
+ALTER TABLE single_turns
+  ADD COLUMN filler_key     TEXT,
+  ADD COLUMN filler_text    TEXT,
+  ADD COLUMN filler_sent_ms INTEGER;
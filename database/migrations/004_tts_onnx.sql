@@ -0,0 +1,3 @@
+INSERT INTO tts_catalog(tts_id,short_key,model_name,version,precision,provider)
+VALUES
+('style_bert_vits2_onnx','stylebert-vits2-onnx','Style-BERT-VITS2 (ONNX Runtime)','v2.1','fp32','local');
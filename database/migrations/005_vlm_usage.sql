@@ -0,0 +1,7 @@
+-- ---------- VLM の使用量・速度 ---------- --
+-- vlm_tokens_in / vlm_tokens_out は API の usage（無ければ tokenizer）の値
+ALTER TABLE single_turns
+  ADD COLUMN vlm_cached_tokens INTEGER,
+  ADD COLUMN vlm_ttft_ms       INTEGER,
+  ADD COLUMN vlm_itl_ms        REAL,
+  ADD COLUMN vlm_usage_source  TEXT;